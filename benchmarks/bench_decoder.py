@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+'''Parse throughput of the reply decoders
+
+Decodes a corpus of captured controller replies (one raw frame per command
+code) repeatedly, once with the table driven decoders and once with the
+split() based parsing the getters used before, and reports replies/second.
+
+Run with ``python benchmarks/bench_decoder.py [rounds]``
+'''
+import sys
+import time
+
+from gammaionctl.decoders import DECODERS
+
+CORPUS = [
+    ("01", b'OK 00 DIGITEL QPC\r\r>'),
+    ("0A", b'OK 00 9.0E-08 AMPS\r\r>'),
+    ("0B", b'OK 00 1.2E-09 MBAR\r\r>'),
+    ("0B", b'OK 00 1.3E-11 MBAR\r\r>'),
+    ("0C", b'OK 00 5600\r\r>'),
+    ("0D", b'OK 00 RUNNING\r\r>'),
+    ("11", b'OK 00 040.0 L/S\r\r>'),
+    ("61", b'OK 00 YES\r\r>'),
+]
+
+
+def legacyParse(code, frame):
+    repl = frame[:-1].decode("utf-8").strip('>\n ')
+    if not repl.startswith("OK"):
+        return False
+    if code in ("01", "0D"):
+        return repl[6:].strip()
+    if code == "0C":
+        return int(repl[6:])
+    if code == "61":
+        repl = repl.strip()
+        return True if repl.endswith("YES") else (False if repl.endswith("NO") else None)
+    repl = repl.split(" ")
+    if code == "0B":
+        pressure = float(repl[2])
+        return (None if pressure == 1.3e-11 else pressure), repl[3].strip()
+    return float(repl[2].strip())
+
+
+def tableParse(code, frame):
+    return DECODERS[code].decode(frame)
+
+
+def run(name, fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for code, frame in CORPUS:
+            fn(code, frame)
+    elapsed = time.perf_counter() - start
+    replies = rounds * len(CORPUS)
+    print("{:<8} {:>12.0f} replies/s {:>8.3f} us/reply".format(name, replies / elapsed, elapsed / replies * 1e6))
+    return elapsed
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    for code, frame in CORPUS:
+        assert legacyParse(code, frame) == tableParse(code, frame), code
+
+    legacy = run("legacy", legacyParse, rounds)
+    table = run("table", tableParse, rounds)
+    print("speedup  {:>12.2f}x".format(legacy / table))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+'''Time range lookups on the binary record log
+
+Writes a synthetic log (one controller, 4 channels, pressure, current and
+voltage at 1 Hz for the given number of days) and measures opening the log
+(mapping and building the sparse index), locating one hour and one day in
+the middle of the log and scanning the located records.
+
+Run with ``python benchmarks/bench_recordlog.py [days] [logfile]``
+'''
+import os
+import sys
+import tempfile
+import time
+
+from gammaionctl.recordlog import RecordLogWriter, RecordLogReader, RECORD
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print("{:<32} {:>10.3f} ms".format(label, (time.perf_counter() - start) * 1e3))
+    return result
+
+
+def main():
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    directory = tempfile.TemporaryDirectory()
+    filename = sys.argv[2] if len(sys.argv) > 2 else os.path.join(directory.name, "bench.log")
+
+    seconds = int(days * 86400)
+    start = 1.7e9
+    if not os.path.exists(filename):
+        with RecordLogWriter(filename) as writer:
+            for s in range(seconds):
+                t = start + s
+                for channel in (1, 2, 3, 4):
+                    writer.append(t, 0, channel, 1, 1e-9)
+                    writer.append(t, 0, channel, 2, 1e-7)
+                    writer.append(t, 0, channel, 3, 5600.0)
+    print("{} records, {:.1f} MB".format(seconds * 12, os.path.getsize(filename) / 1e6))
+
+    reader = timed("open + sparse index", lambda: RecordLogReader(filename))
+    middle = start + seconds / 2
+    timed("locate 1 hour", lambda: reader.indexRange(middle, middle + 3600))
+    timed("locate 1 day", lambda: reader.indexRange(middle, middle + 86400))
+    view = timed("raw view 1 day", lambda: reader.rawRange(middle, middle + 86400))
+    print("{:<32} {:>10d} records".format("records in 1 day view", len(view) // RECORD.size))
+    del view
+    timed("scan 1 hour channel 1 pressure", lambda: reader.values(middle, middle + 3600, channel=1, metric="pressure"))
+    reader.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''Micro benchmark comparing byte wise reply reading with the framed reader
+
+Replays a stream of canned controller replies through an in memory
+connection that honours the ``bufsize`` argument of ``recv`` and reports
+``recv`` calls and wall time per reply for both approaches.
+
+Run with ``python benchmarks/bench_recv.py [replies]``
+'''
+import sys
+import time
+
+from gammaionctl.framing import FramedReader, REPLY_DELIMITER
+
+# All replies share the same length so paced mode can split on frame
+# boundaries
+REPLIES = [
+    b'OK 00 1.2E-09 MBAR\r\r>',
+    b'OK 00 000000005600\r\r>',
+    b'OK 00 9.0E-08 AMPS\r\r>',
+    b'OK 00 RUNNING     \r\r>',
+    b'OK 00 YES         \r\r>',
+]
+
+
+class StreamConnection:
+    '''In memory connection
+
+    In paced mode a single ``recv`` never crosses a reply boundary - this
+    mimics request/response operation where the next reply is not yet on
+    the wire while the current one is being read.
+    '''
+    def __init__(self, data, frameLength=None):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.calls = 0
+        self.frameLength = frameLength
+
+    def recv(self, bufsize):
+        self.calls = self.calls + 1
+        end = self.pos + bufsize
+        if self.frameLength is not None:
+            end = min(end, (self.pos // self.frameLength + 1) * self.frameLength)
+        chunk = bytes(self.data[self.pos:end])
+        self.pos = self.pos + len(chunk)
+        return chunk
+
+
+def legacyRead(conn, count):
+    for _ in range(count):
+        repl = ''
+        while True:
+            chunk = conn.recv(1)
+            if chunk == b'':
+                return
+            if repl.endswith('\r\r'):
+                break
+            repl = repl + chunk.decode("utf-8")
+
+
+def framedRead(conn, count):
+    reader = FramedReader(conn)
+    for _ in range(count):
+        reader.readFrame(REPLY_DELIMITER)
+
+
+def run(name, fn, data, count, frameLength=None):
+    conn = StreamConnection(data, frameLength)
+    start = time.perf_counter()
+    fn(conn, count)
+    elapsed = time.perf_counter() - start
+    print("{:<8} {:>10.3f} us/reply {:>8.2f} recv/reply".format(
+        name, elapsed / count * 1e6, conn.calls / count))
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = b''.join(REPLIES[i % len(REPLIES)] for i in range(count))
+
+    frameLength = len(REPLIES[0])
+
+    print("Request/response (one reply available per recv)")
+    legacy = run("legacy", legacyRead, data, count, frameLength)
+    framed = run("framed", framedRead, data, count, frameLength)
+    print("speedup  {:>10.1f}x".format(legacy / framed))
+
+    print("Back to back replies (pipelined)")
+    legacy = run("legacy", legacyRead, data, count)
+    framed = run("framed", framedRead, data, count)
+    print("speedup  {:>10.1f}x".format(legacy / framed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,2 @@
 from .gammaionctl import GammaIonPump
+from .asyncgammaionctl import AsyncGammaIonPump
@@ -0,0 +1,390 @@
+'''Pump down and leak rate analysis of recorded readings
+
+Works on timestamps and readings as returned by ``getPressure`` or
+``getCurrent`` - lists, ``array('d')`` (for example ``PumpHistory`` windows
+or ``RecordLogReader.values``) or NumPy arrays. Readings that are not
+available (``None`` for disabled channels, ``False`` for error replies, NaN
+in the binary logs) are ignored by all calculations.
+
+* ``fitPumpDown`` fits the power law ``p(t) = a * (t - start)^-n`` of a
+  pump down in log-log space
+* ``timeToTarget`` predicts when a target pressure will be reached
+* ``rateOfRise`` estimates the pressure rise rate of an isolated volume by a
+  linear fit and from that the leak rate (``volume * dp/dt``)
+* ``flagAnomalies`` flags missing samples, isolated spikes and steps using a
+  robust (median absolute deviation) score of the sample to sample changes
+* ``analyzeChannels`` runs all of the above for several channels
+
+All calculations are vectorized using NumPy if it is installed (millions of
+samples take a few ten milliseconds). Without NumPy the same calculations
+run in pure Python on ``array`` objects, which is fine for hours of data but
+some hundred times slower.
+'''
+import math
+from array import array
+
+try:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    numpy = None
+
+FLAG_MISSING = 0x01
+FLAG_SPIKE = 0x02
+FLAG_STEP = 0x04
+
+# Scales the median absolute deviation to the standard deviation of a normal
+# distribution
+MAD_SCALE = 1.4826
+
+def _floats(values):
+    '''Converts readings into a float array, unavailable readings become NaN'''
+    if numpy is not None:
+        if isinstance(values, (numpy.ndarray, array, memoryview)):
+            return numpy.asarray(values, dtype=numpy.float64)
+        return numpy.fromiter((math.nan if (v is None or v is False) else v for v in values), dtype=numpy.float64)
+    if isinstance(values, array) and values.typecode == 'd':
+        return values
+    if isinstance(values, memoryview):
+        return array('d', values.tobytes())
+    return array('d', (math.nan if (v is None or v is False) else v for v in values))
+
+def _valid(timestamps, values, positive=False, start=None, end=None):
+    '''Returns the (timestamps, values) of all usable samples'''
+    t = _floats(timestamps)
+    v = _floats(values)
+    if len(t) != len(v):
+        raise ValueError("Got {} timestamps for {} values".format(len(t), len(v)))
+    if numpy is not None:
+        mask = numpy.isfinite(t) & numpy.isfinite(v)
+        if positive:
+            mask &= v > 0
+        if start is not None:
+            mask &= t >= start
+        if end is not None:
+            mask &= t <= end
+        return t[mask], v[mask]
+
+    ts, vs = array('d'), array('d')
+    for ti, vi in zip(t, v):
+        if math.isfinite(ti) and math.isfinite(vi) and (vi > 0 or not positive) \
+           and (start is None or ti >= start) and (end is None or ti <= end):
+            ts.append(ti)
+            vs.append(vi)
+    return ts, vs
+
+def _log10(values):
+    if numpy is not None:
+        return numpy.log10(values)
+    return array('d', (math.log10(v) for v in values))
+
+def _linearFit(x, y):
+    '''Least squares fit y = slope * x + intercept
+
+    Returns (slope, intercept, rms residual, r squared) or None if there are
+    less than two distinct x values.
+    '''
+    n = len(x)
+    if n < 2:
+        return None
+    if numpy is not None:
+        xm = x.mean()
+        ym = y.mean()
+        dx = x - xm
+        dy = y - ym
+        sxx = numpy.dot(dx, dx)
+        if sxx == 0:
+            return None
+        slope = numpy.dot(dx, dy) / sxx
+        residual = dy - slope * dx
+        ssRes = float(numpy.dot(residual, residual))
+        ssTot = float(numpy.dot(dy, dy))
+    else:
+        xm = math.fsum(x) / n
+        ym = math.fsum(y) / n
+        sxx, sxy, ssTot = 0.0, 0.0, 0.0
+        for xi, yi in zip(x, y):
+            sxx = sxx + (xi - xm) * (xi - xm)
+            sxy = sxy + (xi - xm) * (yi - ym)
+            ssTot = ssTot + (yi - ym) * (yi - ym)
+        if sxx == 0:
+            return None
+        slope = sxy / sxx
+        ssRes = 0.0
+        for xi, yi in zip(x, y):
+            r = (yi - ym) - slope * (xi - xm)
+            ssRes = ssRes + r * r
+    slope = float(slope)
+    intercept = float(ym) - slope * float(xm)
+    r2 = 1.0 - ssRes / ssTot if ssTot > 0 else 1.0
+    return slope, intercept, math.sqrt(ssRes / n), r2
+
+class PumpDownFit:
+    '''Power law pump down curve ``p(t) = amplitude * (t - start)^-exponent``
+
+    ``rms`` is the residual of the fit in decades.
+    '''
+    __slots__ = ('amplitude', 'exponent', 'start', 'rms', 'samples')
+
+    def __init__(self, amplitude, exponent, start, rms, samples):
+        self.amplitude = amplitude
+        self.exponent = exponent
+        self.start = start
+        self.rms = rms
+        self.samples = samples
+
+    def predict(self, timestamp):
+        '''Pressure predicted at timestamp (None before the start)'''
+        if timestamp <= self.start:
+            return None
+        return self.amplitude * (timestamp - self.start) ** (-self.exponent)
+
+    def timeToPressure(self, target):
+        '''Timestamp at which the curve reaches target (None if it never does)'''
+        if self.exponent <= 0 or target <= 0:
+            return None
+        return self.start + (self.amplitude / target) ** (1.0 / self.exponent)
+
+    def __repr__(self):
+        return "PumpDownFit(amplitude={:e}, exponent={:.3f}, start={}, rms={:.3f}, samples={})".format(
+            self.amplitude, self.exponent, self.start, self.rms, self.samples)
+
+def fitPumpDown(timestamps, pressures, start=None, end=None, since=None):
+    '''Fits a power law to a pump down
+
+    Parameters:
+        start       Start of the pump down (defaults to the first valid
+                    sample, which itself is not used for the fit)
+        end         Ignore samples after this timestamp
+        since       Only fit samples after this timestamp (the curve still
+                    starts at start), for example the last hour
+
+    Returns a PumpDownFit or None if there are less than two usable samples.
+    '''
+    t, p = _valid(timestamps, pressures, positive=True, end=end)
+    if len(t) == 0:
+        return None
+    if start is None:
+        start = float(t[0])
+    lower = start if since is None else max(start, since)
+    if numpy is not None:
+        mask = t > lower
+        t, p = t[mask], p[mask]
+        x = numpy.log10(t - start)
+    else:
+        keep = [ n for n, ti in enumerate(t) if ti > lower ]
+        t = array('d', (t[n] for n in keep))
+        p = array('d', (p[n] for n in keep))
+        x = array('d', (math.log10(ti - start) for ti in t))
+
+    fit = _linearFit(x, _log10(p))
+    if fit is None:
+        return None
+    slope, intercept, rms, _ = fit
+    return PumpDownFit(10.0 ** intercept, -slope, start, rms, len(t))
+
+def timeToTarget(timestamps, pressures, target, start=None, since=None):
+    '''Predicts the seconds (after the last valid sample) until target is reached
+
+    Returns 0 if the last reading already is at or below the target and None
+    if no prediction is possible (no usable fit or pressure not falling).
+    '''
+    t, p = _valid(timestamps, pressures, positive=True)
+    if len(t) == 0:
+        return None
+    if p[-1] <= target:
+        return 0.0
+    fit = fitPumpDown(t, p, start=start, since=since)
+    if fit is None:
+        return None
+    reached = fit.timeToPressure(target)
+    if reached is None:
+        return None
+    return max(0.0, reached - float(t[-1]))
+
+class RateOfRise:
+    '''Linear pressure rise ``p(t) = slope * t + intercept``
+
+    ``leakRate`` is ``slope * volume`` (mbar l/s with the volume in liters and
+    the pressure in mbar) or None if no volume has been given.
+    '''
+    __slots__ = ('slope', 'intercept', 'r2', 'samples', 'volume')
+
+    def __init__(self, slope, intercept, r2, samples, volume=None):
+        self.slope = slope
+        self.intercept = intercept
+        self.r2 = r2
+        self.samples = samples
+        self.volume = volume
+
+    @property
+    def leakRate(self):
+        if self.volume is None:
+            return None
+        return self.slope * self.volume
+
+    def __repr__(self):
+        return "RateOfRise(slope={:e}, r2={:.3f}, samples={}, leakRate={})".format(
+            self.slope, self.r2, self.samples, self.leakRate)
+
+def rateOfRise(timestamps, pressures, start=None, end=None, volume=None):
+    '''Fits the pressure rise of an isolated volume between start and end
+
+    Returns a RateOfRise or None if there are less than two usable samples.
+    '''
+    t, p = _valid(timestamps, pressures, positive=True, start=start, end=end)
+    if len(t) == 0:
+        return None
+    # Fit relative to the first sample to keep the epoch timestamps from
+    # dominating the numerical error
+    origin = float(t[0])
+    if numpy is not None:
+        x = t - origin
+    else:
+        x = array('d', (ti - origin for ti in t))
+    fit = _linearFit(x, p)
+    if fit is None:
+        return None
+    slope, intercept, _, r2 = fit
+    return RateOfRise(slope, intercept - slope * origin, r2, len(t), volume)
+
+def _median(values):
+    if numpy is not None:
+        return float(numpy.median(values))
+    ordered = sorted(values)
+    n = len(ordered)
+    return ordered[n // 2] if n % 2 else 0.5 * (ordered[n // 2 - 1] + ordered[n // 2])
+
+def flagAnomalies(values, threshold=6.0, logarithmic=True, minDeviation=0.01, window=5):
+    '''Flags every sample (FLAG_* bits)
+
+    * FLAG_MISSING - reading not available
+    * FLAG_SPIKE - the sample jumps away from its valid neighbours and back
+    * FLAG_STEP - the sample jumps to a new level and stays there
+
+    A change between two valid samples is a jump if it deviates more than
+    ``threshold`` robust standard deviations (but at least ``minDeviation``)
+    from the median of the ``window`` surrounding changes, so the steady
+    trend of a pump down is not flagged. Changes are taken in decades if
+    logarithmic (pressure), otherwise absolute.
+
+    Returns a ``numpy.uint8`` array or an ``array('B')``.
+    '''
+    v = _floats(values)
+    if numpy is not None:
+        flags = numpy.zeros(len(v), dtype=numpy.uint8)
+        valid = numpy.isfinite(v)
+        if logarithmic:
+            valid &= v > 0
+        flags[~valid] = FLAG_MISSING
+        index = numpy.flatnonzero(valid)
+        if len(index) < 3:
+            return flags
+        series = numpy.log10(v[index]) if logarithmic else v[index]
+        changes = numpy.diff(series)
+        half = window // 2
+        padded = numpy.pad(changes, half, mode="edge")
+        # Partial sort of the window (faster than numpy.median for short windows)
+        deviation = changes - numpy.partition(sliding_window_view(padded, 2 * half + 1), half, axis=1)[:, half]
+        scale = max(MAD_SCALE * numpy.median(numpy.abs(deviation)), minDeviation)
+        score = deviation / scale
+        jump = numpy.abs(score) > threshold
+        # Change k leads from valid sample k to k + 1
+        spike = jump[:-1] & jump[1:] & (numpy.sign(score[:-1]) != numpy.sign(score[1:]))
+        consumed = numpy.zeros(len(changes), dtype=bool)
+        consumed[:-1] |= spike
+        consumed[1:] |= spike
+        flags[index[1:-1][spike]] |= FLAG_SPIKE
+        flags[index[1:][jump & ~consumed]] |= FLAG_STEP
+        return flags
+
+    flags = array('B', bytes(len(v)))
+    index = []
+    series = []
+    for n, vi in enumerate(v):
+        if math.isfinite(vi) and (vi > 0 or not logarithmic):
+            index.append(n)
+            series.append(math.log10(vi) if logarithmic else vi)
+        else:
+            flags[n] = FLAG_MISSING
+    if len(index) < 3:
+        return flags
+    changes = [ b - a for a, b in zip(series, series[1:]) ]
+    half = window // 2
+    padded = [ changes[0] ] * half + changes + [ changes[-1] ] * half
+    deviation = [ c - _median(padded[k:k + 2 * half + 1]) for k, c in enumerate(changes) ]
+    scale = max(MAD_SCALE * _median([ abs(d) for d in deviation ]), minDeviation)
+    score = [ d / scale for d in deviation ]
+    jump = [ abs(s) > threshold for s in score ]
+    consumed = [ False ] * len(changes)
+    for k in range(len(changes) - 1):
+        if jump[k] and jump[k + 1] and (score[k] > 0) != (score[k + 1] > 0):
+            flags[index[k + 1]] |= FLAG_SPIKE
+            consumed[k] = consumed[k + 1] = True
+    for k in range(len(changes)):
+        if jump[k] and not consumed[k]:
+            flags[index[k + 1]] |= FLAG_STEP
+    return flags
+
+class ChannelAnalysis:
+    '''Results for one channel, ``available`` is False if the channel never
+    delivered a reading (disabled or not populated)'''
+    __slots__ = ('channel', 'samples', 'available', 'missing', 'spikes', 'steps', 'fit', 'rise', 'timeToTarget')
+
+    def __init__(self, channel, samples):
+        self.channel = channel
+        self.samples = samples
+        self.available = False
+        self.missing = samples
+        self.spikes = 0
+        self.steps = 0
+        self.fit = None
+        self.rise = None
+        self.timeToTarget = None
+
+    @property
+    def flags(self):
+        '''Union of all FLAG_* bits that occurred'''
+        return (FLAG_MISSING if self.missing else 0) | (FLAG_SPIKE if self.spikes else 0) | (FLAG_STEP if self.steps else 0)
+
+    def __repr__(self):
+        return "ChannelAnalysis({}, samples={}, available={}, missing={}, spikes={}, steps={}, fit={}, rise={}, timeToTarget={})".format(
+            self.channel, self.samples, self.available, self.missing, self.spikes, self.steps, self.fit, self.rise, self.timeToTarget)
+
+def _count(flags, bit):
+    if numpy is not None:
+        return int(numpy.count_nonzero(flags & bit))
+    return sum(1 for f in flags if f & bit)
+
+def analyzeChannels(timestamps, channels, target=None, volume=None, since=None, threshold=6.0):
+    '''Analyzes the pressure readings of several channels
+
+    ``channels`` maps the pump index to the readings taken at the shared
+    ``timestamps`` (for example the columns of a watch CSV). Spikes are
+    excluded from the fits. Returns a dictionary pump index ->
+    ChannelAnalysis.
+    '''
+    t = _floats(timestamps)
+    results = {}
+    for channel, values in channels.items():
+        v = _floats(values)
+        result = ChannelAnalysis(channel, len(v))
+        results[channel] = result
+        flags = flagAnomalies(v, threshold=threshold)
+        result.missing = _count(flags, FLAG_MISSING)
+        if result.missing == len(v):
+            continue
+        result.available = True
+        result.spikes = _count(flags, FLAG_SPIKE)
+        result.steps = _count(flags, FLAG_STEP)
+
+        if result.spikes:
+            if numpy is not None:
+                v = numpy.where(flags & FLAG_SPIKE, numpy.nan, v)
+            else:
+                v = array('d', (math.nan if f & FLAG_SPIKE else vi for vi, f in zip(v, flags)))
+        result.fit = fitPumpDown(t, v, since=since)
+        result.rise = rateOfRise(t, v, start=since, volume=volume)
+        if target is not None:
+            result.timeToTarget = timeToTarget(t, v, target, since=since)
+    return results
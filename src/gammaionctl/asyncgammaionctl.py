@@ -0,0 +1,199 @@
+import asyncio
+
+from .framing import REPLY_DELIMITER, PROMPT_DELIMITER
+from .gammaionctl import GammaIonPumpProtocol
+
+class AsyncGammaIonPump(GammaIonPumpProtocol):
+    '''asyncio based client for the QPC controller
+
+    Offers the same methods as ``GammaIonPump`` as coroutines. The connection
+    is established by ``connect`` or by using ``async with``:
+
+        async with AsyncGammaIonPump("10.0.0.11") as pump:
+            pressure = await pump.getPressure(1)
+
+    Every command is bounded by a deadline (``timeout`` seconds by default,
+    can be overridden per call) that includes waiting for commands queued
+    before it. When a deadline expires the command fails like any other I/O
+    error. If it had already been sent the connection is dropped as well - a
+    late reply would otherwise be matched to the next command.
+    '''
+    def __init__(self, host, timeout=2, connection=None, port=23):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.verbose = False
+        self.reader = None
+        self.writer = None
+        self._connection = connection
+        self._lock = None
+
+    @property
+    def connected(self):
+        return self.writer is not None
+
+    async def connect(self):
+        if self.host is not None:
+            connecting = asyncio.open_connection(self.host, self.port)
+        elif self._connection is not None:
+            connecting = asyncio.sleep(0, result=self._connection)
+        else:
+            raise ConnectionError("Failed to Connect to ion pump:\
+                                              No host or connection provided")
+
+        try:
+            self.reader, self.writer = await asyncio.wait_for(connecting, self.timeout)
+            # Wait for initial prompt
+            await asyncio.wait_for(self.reader.readuntil(PROMPT_DELIMITER), self.timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+            await self.close()
+            raise ConnectionError("Failed to Connect to ion pump:\
+                                Failed to connect to pump at specified IP")
+
+        self._lock = asyncio.Lock()
+        return self
+
+    async def __aenter__(self):
+        if self.writer is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self.writer is not None:
+            if self.verbose:
+                print("Closing socket connection")
+            writer = self.writer
+            self.writer = None
+            self.reader = None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, AttributeError):
+                pass
+
+    async def sendCommand(self, command, timeout=None):
+        '''Transmits a raw spc command and returns the reply string or False'''
+        return self._decodeReply(await self._transact(command, timeout))
+
+    async def _transact(self, command, timeout=None):
+        if self.verbose:
+            print("Sending command {}".format(command))
+        if self.writer is None:
+            if self.verbose:
+                print("Pump controller not connected")
+            raise ConnectionError("Failed to Connect to ion pump:\
+                                            Pump controller not connected")
+
+        if timeout is None:
+            timeout = self.timeout
+
+        async def locked():
+            async with self._lock:
+                # The connection may have been dropped by the command that
+                # held the lock before (for example after its deadline expired)
+                if self.writer is None:
+                    return None
+                try:
+                    return await self._exchange(command)
+                except (asyncio.CancelledError, asyncio.IncompleteReadError, OSError):
+                    # Drop the connection before the next command gets the
+                    # lock, a late reply would otherwise be matched to it
+                    await self.close()
+                    raise
+
+        # The deadline includes waiting for the lock. If it expires before
+        # the command has been sent the connection stays usable
+        try:
+            frame = await asyncio.wait_for(locked(), timeout)
+        except asyncio.TimeoutError:
+            if self.verbose:
+                print("Command {} timed out".format(command))
+            return False
+        except (asyncio.IncompleteReadError, OSError):
+            if self.verbose:
+                print('Failed to receive')
+            return False
+
+        if frame is None:
+            raise ConnectionError("Failed to Connect to ion pump:\
+                                            Connection lost while waiting")
+        return frame
+
+    async def _exchange(self, command):
+        self.writer.write(('spc '+command+"\r\n").encode())
+        await self.writer.drain()
+        return await self.reader.readuntil(REPLY_DELIMITER)
+
+    async def identify(self, timeout=None):
+        if self.verbose:
+            print("Requesting identity of pump controller")
+
+        return self._parseIdentity(await self._transact('01', timeout))
+
+    async def getPressureWithUnits(self, pumpIndex, timeout=None):
+        '''Reads ion pump pressure
+
+        Returns:
+            tuple (pressure, units) or
+            False if there was a communication error or
+            None if the pump is disabled or unavailable
+        '''
+        if self.verbose:
+            print("Requesting pressure for pump {}".format(pumpIndex))
+
+        return self._parsePressureWithUnits(await self._transact('0B '+str(pumpIndex), timeout))
+
+    async def getPressure(self, pumpIndex, require_units='mBar', timeout=None):
+        '''Returns pump pressure in requred units'''
+        return self._checkPressureUnits(await self.getPressureWithUnits(pumpIndex, timeout), require_units)
+
+    async def enable(self, pumpIndex, timeout=None):
+        if self.verbose:
+            print("Request enabling pump {}".format(pumpIndex))
+
+        return self._parseEnable(await self._transact('37 '+str(pumpIndex), timeout))
+
+    async def disable(self, pumpIndex, timeout=None):
+        if self.verbose:
+            print("Request disabling pump {}".format(pumpIndex))
+
+        return self._parseDisable(await self._transact('38 '+str(pumpIndex), timeout))
+
+    async def getVoltage(self, pumpIndex, timeout=None):
+        if self.verbose:
+            print("Requesting voltage for pump {}".format(pumpIndex))
+
+        return self._parseVoltage(await self._transact('0C '+str(pumpIndex), timeout))
+
+    async def getCurrent(self, pumpIndex, timeout=None):
+        if self.verbose:
+            print("Requesting current for pump {}".format(pumpIndex))
+
+        return self._parseCurrent(await self._transact('0A '+str(pumpIndex), timeout))
+
+    async def getPumpSize(self, pumpIndex, timeout=None):
+        if self.verbose:
+            print("Requesting pump size for pump {}".format(pumpIndex))
+
+        return self._parsePumpSize(await self._transact('11 '+str(pumpIndex), timeout))
+
+    async def getHighVoltageStatus(self, pumpIndex, timeout=None):
+        '''Reads ion pump high voltages status
+
+        Returns:
+            - True or False if it's on or off
+            - None if the pump's response was neither or the reply was empty
+        '''
+        if self.verbose:
+            print("Requesting if high voltage is enabled for pump {}".format(pumpIndex))
+
+        return self._parseHighVoltageStatus(await self._transact(f"61 {pumpIndex}", timeout))
+
+    async def getSupplyStatus(self, pumpIndex, timeout=None):
+        if self.verbose:
+            print("Requesting supply status for pump {}".format(pumpIndex))
+
+        return self._parseSupplyStatus(await self._transact('0D '+str(pumpIndex), timeout))
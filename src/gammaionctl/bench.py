@@ -0,0 +1,299 @@
+'''Client throughput and latency benchmark
+
+Drives ``GammaIonPump`` against a local responder (an in-process
+``QPCSimulator`` by default or an external one given by ``--target``) and
+reports per scenario:
+
+* commands per second
+* p50 / p95 / p99 latency
+* CPU time per reply (process CPU time - with the in-process simulator this
+  includes the simulator itself, use ``--target`` with a separately started
+  simulator to measure the client alone)
+* bytes and send/recv calls per reply
+
+Scenarios cover every single query type, a full sweep of all metrics on all
+four pumps (one command at a time and as pipelined ``snapshot``) and many
+parallel connections. Results can be written as JSON (``--output``) and
+compared against a previous run (``--compare``):
+
+    python -m gammaionctl.bench --iterations 2000 --output run.json
+    python -m gammaionctl.bench --compare run.json
+
+``--replay FILE`` replays a recorded session (see ``gammaionctl.capture``)
+``--iterations`` times instead, measuring the client on real traffic.
+'''
+import argparse
+import json
+import math
+import platform
+import socket
+import sys
+import threading
+import time
+
+from .gammaionctl import GammaIonPump
+from .capture import ReplayConnection, readCapture, replayRequests
+from .simulator import QPCSimulator, SimulatedController
+from .hosts import splitHost
+
+SINGLE_COMMANDS = (
+    ("identify", ()),
+    ("getPressureWithUnits", (1,)),
+    ("getVoltage", (1,)),
+    ("getCurrent", (1,)),
+    ("getPumpSize", (1,)),
+    ("getHighVoltageStatus", (1,)),
+    ("getSupplyStatus", (1,))
+)
+
+SWEEP_GETTERS = ("getPressureWithUnits", "getVoltage", "getCurrent", "getHighVoltageStatus", "getSupplyStatus")
+
+class CountingSocket:
+    '''Socket wrapper counting send/recv calls and transferred bytes'''
+    def __init__(self, sock):
+        self.sock = sock
+        self.sendCalls = 0
+        self.recvCalls = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    def send(self, data):
+        self.sendCalls = self.sendCalls + 1
+        self.bytesSent = self.bytesSent + len(data)
+        return self.sock.send(data)
+
+    def recv(self, bufsize):
+        data = self.sock.recv(bufsize)
+        self.recvCalls = self.recvCalls + 1
+        self.bytesReceived = self.bytesReceived + len(data)
+        return data
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
+
+    def counters(self):
+        return (self.sendCalls, self.recvCalls, self.bytesSent, self.bytesReceived)
+
+def connect(host, port, timeout=5):
+    '''Returns a GammaIonPump whose socket is wrapped into a CountingSocket'''
+    sock = socket.create_connection((host, port), timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    counter = CountingSocket(sock)
+    return GammaIonPump(None, connection=counter), counter
+
+def percentile(samples, p):
+    '''Nearest rank percentile of an already sorted list'''
+    if not samples:
+        return None
+    rank = int(math.ceil(p * len(samples) / 100.0))
+    return samples[max(rank, 1) - 1]
+
+def summarize(latencies, replies, wall, cpu, counters):
+    latencies = sorted(latencies)
+    sendCalls, recvCalls, bytesSent, bytesReceived = counters
+    return {
+        "replies" : replies,
+        "rate" : replies / wall if wall > 0 else None,
+        "p50" : percentile(latencies, 50),
+        "p95" : percentile(latencies, 95),
+        "p99" : percentile(latencies, 99),
+        "cpuPerReply" : cpu / replies,
+        "bytesPerReply" : (bytesSent + bytesReceived) / replies,
+        "sendPerReply" : sendCalls / replies,
+        "recvPerReply" : recvCalls / replies
+    }
+
+def _delta(after, before):
+    return tuple(a - b for a, b in zip(after, before))
+
+def benchSingle(host, port, iterations):
+    results = {}
+    pump, counter = connect(host, port)
+    try:
+        for name, args in SINGLE_COMMANDS:
+            getter = getattr(pump, name)
+            latencies = []
+            before = counter.counters()
+            cpu = time.process_time()
+            wall = time.perf_counter()
+            for _ in range(iterations):
+                t = time.perf_counter()
+                getter(*args)
+                latencies.append(time.perf_counter() - t)
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            results["single." + name] = summarize(latencies, iterations, wall, cpu, _delta(counter.counters(), before))
+    finally:
+        pump.close()
+    return results
+
+def benchSweep(host, port, iterations, pumps=(1, 2, 3, 4)):
+    '''Full sweep of all metrics on all pumps
+
+    ``latency`` is measured per sweep, ``replies`` counts individual replies.
+    '''
+    results = {}
+    pump, counter = connect(host, port)
+    perSweep = len(SWEEP_GETTERS) * len(pumps)
+
+    def sequential():
+        for pumpIndex in pumps:
+            for name in SWEEP_GETTERS:
+                getattr(pump, name)(pumpIndex)
+
+    def pipelined():
+        pump.snapshot(pumps)
+
+    try:
+        for label, sweep in (("sweep.sequential", sequential), ("sweep.snapshot", pipelined)):
+            latencies = []
+            before = counter.counters()
+            cpu = time.process_time()
+            wall = time.perf_counter()
+            for _ in range(iterations):
+                t = time.perf_counter()
+                sweep()
+                latencies.append(time.perf_counter() - t)
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            results[label] = summarize(latencies, iterations * perSweep, wall, cpu, _delta(counter.counters(), before))
+    finally:
+        pump.close()
+    return results
+
+def benchParallel(host, port, iterations, connections):
+    '''Pressure queries over many connections, one thread per connection'''
+    sessions = [ connect(host, port) for _ in range(connections) ]
+    latencies = [ [] for _ in range(connections) ]
+    barrier = threading.Barrier(connections + 1)
+
+    def worker(n):
+        pump, _ = sessions[n]
+        barrier.wait()
+        for _ in range(iterations):
+            t = time.perf_counter()
+            pump.getPressureWithUnits(1)
+            latencies[n].append(time.perf_counter() - t)
+
+    threads = [ threading.Thread(target=worker, args=(n,)) for n in range(connections) ]
+    for thread in threads:
+        thread.start()
+    before = [ counter.counters() for _, counter in sessions ]
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    counters = (0, 0, 0, 0)
+    for (pump, counter), start in zip(sessions, before):
+        counters = tuple(a + b for a, b in zip(counters, _delta(counter.counters(), start)))
+        pump.close()
+
+    merged = [ l for perConnection in latencies for l in perConnection ]
+    return { "parallel.{}".format(connections) : summarize(merged, len(merged), wall, cpu, counters) }
+
+def benchReplay(filename, iterations):
+    '''Replays a recorded session as fast as possible
+
+    Measures the client side only (framing, matching and decoding of real
+    controller traffic), ``latency`` is measured per replay of the whole
+    session.
+    '''
+    capture = readCapture(filename)
+    latencies = []
+    counters = (0, 0, 0, 0)
+    replies = 0
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        counter = CountingSocket(ReplayConnection(capture))
+        pump = GammaIonPump(None, connection=counter)
+        replies = replies + len(replayRequests(capture, pump))
+        pump.close()
+        latencies.append(time.perf_counter() - t)
+        counters = tuple(a + b for a, b in zip(counters, counter.counters()))
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    return { "replay" : summarize(latencies, max(1, replies), wall, cpu, counters) }
+
+def printResults(results, baseline=None):
+    print("{:<32} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8} {:>6} {:>6}".format(
+        "scenario", "replies/s", "p50 ms", "p95 ms", "p99 ms", "cpu us", "bytes", "send", "recv"))
+    for name, r in results.items():
+        line = "{:<32} {:>10.0f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.1f} {:>8.1f} {:>6.2f} {:>6.2f}".format(
+            name, r["rate"], r["p50"] * 1e3, r["p95"] * 1e3, r["p99"] * 1e3,
+            r["cpuPerReply"] * 1e6, r["bytesPerReply"], r["sendPerReply"], r["recvPerReply"])
+        if baseline is not None and name in baseline:
+            base = baseline[name]
+            line = line + "  rate {:+.1%} p50 {:+.1%}".format(r["rate"] / base["rate"] - 1, r["p50"] / base["p50"] - 1)
+        print(line)
+
+def run(host, port, iterations, connections):
+    results = {}
+    results.update(benchSingle(host, port, iterations))
+    results.update(benchSweep(host, port, max(1, iterations // 20)))
+    for n in connections:
+        results.update(benchParallel(host, port, max(1, iterations // n), n))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GammaIonPump client benchmark")
+    parser.add_argument("--iterations", type=int, default=1000, help="Commands per single command scenario")
+    parser.add_argument("--connections", default="1,8,32", help="Comma separated connection counts for the parallel scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="Reply latency of the in-process simulator in seconds")
+    parser.add_argument("--target", default=None, help="HOST:PORT of an external simulator instead of the in-process one")
+    parser.add_argument("--replay", default=None, help="Replay a recorded session (see gammaionctl.capture) instead")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    connections = [ int(n) for n in args.connections.split(",") if n ]
+    simulator = None
+    if args.replay is not None:
+        host, port = None, None
+    elif args.target is not None:
+        host, port = splitHost(args.target)
+    else:
+        simulator = QPCSimulator(SimulatedController(latency=args.latency, seed=0))
+        host, port = "127.0.0.1", simulator.start()
+
+    try:
+        if args.replay is not None:
+            results = benchReplay(args.replay, args.iterations)
+        else:
+            results = run(host, port, args.iterations, connections)
+    finally:
+        if simulator is not None:
+            simulator.stop()
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    printResults(results, baseline)
+
+    if args.output is not None:
+        document = {
+            "meta" : {
+                "timestamp" : time.time(),
+                "python" : sys.version.split()[0],
+                "platform" : platform.platform(),
+                "iterations" : args.iterations,
+                "target" : args.target,
+                "replay" : args.replay,
+                "latency" : args.latency
+            },
+            "results" : results
+        }
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+
+if __name__ == "__main__":
+    main()
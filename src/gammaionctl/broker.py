@@ -0,0 +1,185 @@
+'''Connection sharing broker
+
+The QPC offers a single telnet session. The broker owns that session (one
+``ThreadSafeReconnectingGammaIonPump`` per controller) and offers the same protocol
+on a local Unix socket per controller, so any number of local clients - a
+GUI, a logger and an interlock script - can use the controller at the same
+time:
+
+    gammaion-broker --socket-dir /run/gammaion 10.0.0.11 10.0.0.12
+
+Commands of all clients are serialized on the controller connection.
+Identical read queries (``decoders.READ_CODES``) of different clients that
+arrive while the same query is in flight (or still waiting for the
+connection) are answered by a single controller query and are repeated once
+after a reconnect. Every other command - ``enable``, ``disable`` or codes
+unknown to this library - is passed to the controller exactly once. If the
+controller is not reachable the broker answers with
+``ER 99 CONTROLLER NOT CONNECTED`` instead of dropping the client. Error
+replies of the controller (``ER nn ...``) are forwarded unchanged, a command
+the controller did not answer is reported as ``ER 98 COMMAND FAILED``.
+
+The sockets are created with mode ``0o600`` (only the user running the
+broker may connect), pass ``mode`` / ``--socket-mode`` to widen that, for
+example to ``0o660`` for a group of operators. An existing socket at the
+path is replaced, any other file is left alone and the broker refuses to
+start.
+
+Clients connect using ``BrokerGammaIonPump`` (a ``GammaIonPump`` talking
+to the broker socket) or by passing ``brokerConnection(path)`` as
+``connection`` to any ``GammaIonPump``.
+'''
+import argparse
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+from .gammaionctl import GammaIonPump
+from .threadsafe import ThreadSafeReconnectingGammaIonPump
+from .hosts import splitHost
+
+NOT_CONNECTED = b'ER 99 CONTROLLER NOT CONNECTED\r\r>'
+INVALID_COMMAND = b'ER 02 INVALID COMMAND\r\r>'
+COMMAND_FAILED = b'ER 98 COMMAND FAILED\r\r>'
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"\r\n>")
+        for line in self.rfile:
+            parts = line.decode("ascii", "replace").split(None, 1)
+            if not parts:
+                continue
+            if len(parts) < 2 or parts[0].lower() != "spc":
+                self.wfile.write(INVALID_COMMAND)
+                continue
+            pump = self.server.pump
+            try:
+                reply = pump.sendCommands([ parts[1].strip() ])[0]
+            except (ConnectionError, OSError):
+                reply = False
+            if reply:
+                self.wfile.write(reply.encode("ascii", "replace") + b"\r\r>")
+            else:
+                self.wfile.write(COMMAND_FAILED if pump.sock else NOT_CONNECTED)
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, pump, mode=0o600):
+        self.pump = pump
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError("Refusing to replace {} (not a socket)".format(path))
+            os.unlink(path)
+        super().__init__(path, BrokerHandler)
+        try:
+            os.chmod(path, mode)
+        except OSError:
+            self.server_close()
+            os.unlink(path)
+            raise
+
+class Broker:
+    '''Serves one Unix socket per controller
+
+    Parameters:
+        hosts           Controller addresses ("address" or "address:port")
+        socketDir       Directory the sockets are created in (``<host>.sock``)
+        timeout         Socket timeout of the controller sessions
+        pumpFactory     Callable ``(host, timeout)`` returning a thread safe
+                        GammaIonPump like object (defaults to a
+                        ThreadSafeReconnectingGammaIonPump)
+        mode            Permissions of the sockets (default 0o600)
+    '''
+    def __init__(self, hosts, socketDir=".", timeout=2, pumpFactory=None, mode=0o600):
+        self.hosts = list(hosts)
+        self.socketDir = socketDir
+        self.timeout = timeout
+        self.mode = mode
+        self.pumpFactory = pumpFactory if pumpFactory is not None else self._connect
+        self.pumps = {}
+        self._servers = []
+        self._threads = []
+
+    @staticmethod
+    def _connect(host, timeout):
+        address, port = splitHost(host)
+        return ThreadSafeReconnectingGammaIonPump(address, timeout=timeout, port=port)
+
+    def socketPath(self, host):
+        return os.path.join(self.socketDir, host.replace(":", "_") + ".sock")
+
+    def start(self):
+        for host in self.hosts:
+            pump = self.pumpFactory(host, self.timeout)
+            self.pumps[host] = pump
+            server = BrokerServer(self.socketPath(host), pump, self.mode)
+            thread = threading.Thread(target=server.serve_forever, name="broker-" + host, daemon=True)
+            thread.start()
+            self._servers.append(server)
+            self._threads.append(thread)
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+            try:
+                os.unlink(server.server_address)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join()
+        for pump in self.pumps.values():
+            pump.close()
+        self._servers = []
+        self._threads = []
+        self.pumps = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def brokerConnection(path, timeout=2):
+    '''Returns a socket connected to a broker that can be passed as
+    ``connection`` to GammaIonPump'''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+class BrokerGammaIonPump(GammaIonPump):
+    '''GammaIonPump using a broker socket instead of a direct connection'''
+    def __init__(self, path, timeout=2, pipelining=True):
+        self.path = path
+        super().__init__(None, timeout=timeout, connection=brokerConnection(path, timeout), pipelining=pipelining)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shares Gamma QPC controller sessions between local clients")
+    parser.add_argument("hosts", nargs="+", help="Controller addresses (address or address:port)")
+    parser.add_argument("--socket-dir", default=".", help="Directory for the Unix sockets (one per controller)")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Socket timeout in seconds")
+    parser.add_argument("--socket-mode", type=lambda value: int(value, 8), default=0o600, help="Permissions of the Unix sockets in octal (default 600)")
+    args = parser.parse_args(argv)
+
+    broker = Broker(args.hosts, args.socket_dir, args.timeout, mode=args.socket_mode)
+    broker.start()
+    for host in broker.hosts:
+        print("{} -> {}".format(host, broker.socketPath(host)))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+'''TTL cache for slowly changing controller values
+
+``CommandCache`` stores raw reply frames keyed by the complete ``spc``
+command (for example ``"11 2"``) for a per command code time to live. The
+cache is consulted by ``GammaIonPump`` before a command is transmitted when
+attached with ``setCache``. Only successful (``OK``) replies are cached.
+``enable`` and ``disable`` invalidate all cached replies of the affected
+channel.
+
+By default only the identity (``01``), the pump size (``11``) and the
+supply status (``0D``) are cached - measured values are never cached unless
+configured explicitly.
+'''
+import time
+from collections import OrderedDict
+
+from .decoders import commandCode
+
+DEFAULT_TTLS = {
+    "01" : 3600.0,
+    "11" : 3600.0,
+    "0D" : 5.0
+}
+
+# Commands that change the state of the channel given as argument
+INVALIDATING = frozenset(("37", "38"))
+
+class CommandCache:
+    '''Bounded LRU cache of reply frames with per command code TTLs
+
+    Parameters:
+        ttls        Dictionary command code -> time to live in seconds.
+                    Codes not contained are not cached.
+        maxEntries  Maximum number of cached replies
+        clock       Monotonic time source (for testing)
+    '''
+    def __init__(self, ttls=None, maxEntries=64, clock=time.monotonic):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.maxEntries = maxEntries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def cacheable(self, command):
+        return self.ttls.get(commandCode(command), 0) > 0
+
+    def get(self, command):
+        '''Returns the cached frame or None
+
+        Commands that are not cacheable are not counted as misses.
+        '''
+        entry = self._entries.get(command)
+        if entry is not None:
+            expires, frame = entry
+            if expires > self.clock():
+                self._entries.move_to_end(command)
+                self.hits = self.hits + 1
+                return frame
+            del self._entries[command]
+        if self.cacheable(command):
+            self.misses = self.misses + 1
+        return None
+
+    def store(self, command, frame):
+        '''Processes a reply received from the controller'''
+        code = commandCode(command)
+        if code in INVALIDATING:
+            parts = command.split(" ", 1)
+            if len(parts) > 1:
+                self.invalidateChannel(parts[1])
+            return
+
+        ttl = self.ttls.get(code, 0)
+        if ttl <= 0 or frame is False or not frame.lstrip(b'>\n ').startswith(b'OK'):
+            return
+        self._entries[command] = (self.clock() + ttl, frame)
+        self._entries.move_to_end(command)
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+    def invalidateChannel(self, pumpIndex):
+        suffix = " " + str(pumpIndex).strip()
+        for command in [ c for c in self._entries if c.endswith(suffix) ]:
+            del self._entries[command]
+            self.invalidations = self.invalidations + 1
+
+    def clear(self):
+        self.invalidations = self.invalidations + len(self._entries)
+        self._entries.clear()
+
+    def statistics(self):
+        return {
+            "entries" : len(self._entries),
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "evictions" : self.evictions,
+            "invalidations" : self.invalidations
+        }
@@ -0,0 +1,297 @@
+'''Recording and deterministic replay of controller sessions
+
+``RecordingConnection`` wraps the socket of a session and writes every
+``send`` and every chunk returned by ``recv`` (plus timeouts and the end of
+the session) into a capture file. ``ReplayConnection`` feeds a capture back
+to a client - either as fast as possible or with the original timing - so
+parsing and performance problems seen on real controllers can be
+reproduced and client changes can be benchmarked on real traffic without
+hardware. Both are passed as ``connection`` to ``GammaIonPump``:
+
+    pump = GammaIonPump(None, connection=recordConnection("10.0.0.11", "session.qcap"))
+    ...
+    pump = GammaIonPump(None, connection=ReplayConnection("session.qcap", realtime=True))
+
+File layout: a 24 byte header (``MAGIC``, format version, reserved, start
+time in seconds since the epoch) followed by variable size little endian
+events
+
+    offset  size  field
+    0       8     offset (double, seconds since the start of the capture)
+    8       1     kind (``EVENT_*``)
+    9       4     payload length
+    13      n     payload (sent or received bytes, error name)
+'''
+import socket
+import struct
+import time
+
+from .decoders import DECODERS, commandCode
+
+MAGIC = b'GQPCCAP\x00'
+VERSION = 1
+
+HEADER = struct.Struct('<8sIId')
+EVENT = struct.Struct('<dBI')
+
+EVENT_SEND = 1
+EVENT_RECV = 2
+EVENT_TIMEOUT = 3
+EVENT_CLOSE = 4
+
+class ReplayMismatch(ValueError):
+    '''The replayed client sent something else than the recorded one'''
+    pass
+
+class CaptureEvent:
+    __slots__ = ('offset', 'kind', 'data')
+
+    def __init__(self, offset, kind, data):
+        self.offset = offset
+        self.kind = kind
+        self.data = data
+
+    def __repr__(self):
+        return "CaptureEvent({:.6f}, {}, {!r})".format(self.offset, self.kind, self.data)
+
+class CaptureWriter:
+    '''Appends events to a new capture file'''
+    def __init__(self, filename, clock=time.monotonic):
+        self.filename = filename
+        self.clock = clock
+        self.start = time.time()
+        self._origin = clock()
+        self._file = open(filename, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, self.start))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, kind, data=b''):
+        self._file.write(EVENT.pack(self.clock() - self._origin, kind, len(data)))
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+class Capture:
+    '''Events of a capture file'''
+    def __init__(self, start, events):
+        self.start = start
+        self.events = events
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    @property
+    def duration(self):
+        return self.events[-1].offset if self.events else 0.0
+
+    def sent(self):
+        '''All bytes sent by the client'''
+        return b''.join(e.data for e in self.events if e.kind == EVENT_SEND)
+
+    def requests(self):
+        '''Commands of every send call, for example [ ["01"], ["0B 1", "0C 1"] ]'''
+        requests = []
+        for event in self.events:
+            if event.kind != EVENT_SEND:
+                continue
+            commands = []
+            for line in event.data.decode("ascii", "replace").split("\r\n"):
+                if line.startswith("spc "):
+                    commands.append(line[4:])
+            if commands:
+                requests.append(commands)
+        return requests
+
+def readCapture(filename):
+    '''Reads a capture file, returns a Capture'''
+    with open(filename, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated capture header")
+    magic, version, _, start = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unsupported capture format")
+
+    events = []
+    position = HEADER.size
+    while position + EVENT.size <= len(data):
+        offset, kind, length = EVENT.unpack_from(data, position)
+        position = position + EVENT.size
+        if position + length > len(data):
+            # Session interrupted while writing, drop the partial event
+            break
+        events.append(CaptureEvent(offset, kind, data[position:position + length]))
+        position = position + length
+    return Capture(start, events)
+
+class RecordingConnection:
+    '''Socket wrapper writing all traffic into a capture
+
+    ``capture`` is a file name or a CaptureWriter. A capture opened from a
+    file name is closed together with the connection.
+    '''
+    def __init__(self, sock, capture):
+        self.sock = sock
+        if isinstance(capture, CaptureWriter):
+            self.capture = capture
+            self._owned = False
+        else:
+            self.capture = CaptureWriter(capture)
+            self._owned = True
+
+    def send(self, data):
+        self.capture.record(EVENT_SEND, bytes(data))
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        self.capture.record(EVENT_SEND, bytes(data))
+        return self.sock.sendall(data)
+
+    def recv(self, bufsize):
+        try:
+            data = self.sock.recv(bufsize)
+        except socket.timeout as e:
+            self.capture.record(EVENT_TIMEOUT, type(e).__name__.encode())
+            raise
+        self.capture.record(EVENT_RECV if data else EVENT_CLOSE, data)
+        return data
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
+        if self._owned:
+            self.capture.close()
+        else:
+            self.capture.flush()
+
+def recordConnection(host, capture, port=23, timeout=2):
+    '''Connects to a controller, returns a RecordingConnection that can be
+    passed as ``connection`` to GammaIonPump'''
+    return RecordingConnection(socket.create_connection((host, port), timeout), capture)
+
+class ReplayConnection:
+    '''Plays back the received side of a capture
+
+    Parameters:
+        capture     Capture or file name
+        realtime    Keep the original timing: every chunk is delivered with
+                    the delay it had after the preceding event of the
+                    recording (measured from the last send or recv call)
+        speed       Time scale for realtime replay (2 replays twice as fast)
+        strict      Raise ReplayMismatch as soon as the client sends
+                    something else than the recorded client did (otherwise
+                    only ``mismatches`` is counted)
+        clock       Monotonic time source
+        sleep       Sleep function
+
+    Recorded timeouts are raised as ``socket.timeout``, the end of the
+    recording is reported as a closed connection.
+    '''
+    def __init__(self, capture, realtime=False, speed=1.0, strict=False, clock=time.monotonic, sleep=time.sleep):
+        if not isinstance(capture, Capture):
+            capture = readCapture(capture)
+        self.capture = capture
+        self.realtime = realtime
+        self.speed = speed
+        self.strict = strict
+        self.clock = clock
+        self.sleep = sleep
+
+        self.mismatches = 0
+        self.closed = False
+        self._expected = capture.sent()
+        self._sent = 0
+        self._events = [ (n, e) for n, e in enumerate(capture.events) if e.kind != EVENT_SEND ]
+        self._next = 0
+        self._pending = b''
+        self._lastActivity = clock()
+
+    @property
+    def exhausted(self):
+        return self._next >= len(self._events) and not self._pending
+
+    def send(self, data):
+        data = bytes(data)
+        expected = self._expected[self._sent:self._sent + len(data)]
+        self._sent = self._sent + len(data)
+        if expected != data:
+            self.mismatches = self.mismatches + 1
+            if self.strict:
+                raise ReplayMismatch("Sent {!r}, recorded {!r}".format(data, expected))
+        self._lastActivity = self.clock()
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def _wait(self, index):
+        if not self.realtime or index == 0:
+            return
+        events = self.capture.events
+        delay = (events[index].offset - events[index - 1].offset) / self.speed
+        remaining = self._lastActivity + delay - self.clock()
+        if remaining > 0:
+            self.sleep(remaining)
+
+    def recv(self, bufsize):
+        if not self._pending:
+            if self._next >= len(self._events):
+                return b''
+            index, event = self._events[self._next]
+            self._next = self._next + 1
+            self._wait(index)
+            self._lastActivity = self.clock()
+            if event.kind == EVENT_TIMEOUT:
+                raise socket.timeout("timed out (recorded)")
+            if event.kind == EVENT_CLOSE:
+                self._next = len(self._events)
+                return b''
+            self._pending = event.data
+
+        data = self._pending[:bufsize]
+        self._pending = self._pending[bufsize:]
+        return data
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def replayRequests(capture, pump):
+    '''Re-issues the recorded requests on a pump (usually one connected to a
+    ReplayConnection of the same capture)
+
+    Every send of the recording is repeated the same way - single commands
+    using one exchange, several commands as one pipelined batch - and the
+    replies are decoded. Returns a list of (command, decoded value) tuples.
+    '''
+    if not isinstance(capture, Capture):
+        capture = readCapture(capture)
+    results = []
+    for commands in capture.requests():
+        if not pump.sock:
+            break
+        if len(commands) == 1:
+            frames = [ pump._transact(commands[0]) ]
+        else:
+            frames = pump._sendBatch(commands)
+        for command, frame in zip(commands, frames):
+            code = commandCode(command)
+            results.append((command, pump._decode(code, frame) if code in DECODERS else frame))
+    return results
@@ -0,0 +1,59 @@
+'''Coalescing of identical concurrent requests
+
+``RequestCoalescer.execute(key, function)`` runs ``function`` only once for
+all threads that request the same key at the same time: the first thread
+executes it, every thread arriving while that call is still running (or
+waiting for the connection) waits for and receives the same result - or
+the same exception. Once the call has finished the next request for the
+key triggers a new call, so results are never older than the request.
+Only side effect free requests may be coalesced - callers pass commands
+that change controller state (or that are unknown) directly instead.
+'''
+import threading
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class RequestCoalescer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def execute(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls = self.calls + 1
+            else:
+                self.coalesced = self.coalesced + 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def inflight(self):
+        with self._lock:
+            return len(self._calls)
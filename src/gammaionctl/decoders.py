@@ -0,0 +1,155 @@
+'''Table driven decoding of QPC replies
+
+Every ``spc`` command code has a ``ReplyDecoder`` in ``DECODERS`` that
+parses the raw reply frame (bytes as received, including the trailing
+``\\r\\r>``) directly into a typed value without decoding the whole reply
+into a string first. Decoders return ``None`` for error replies (anything
+not starting with ``OK``) as well as for malformed replies - they never
+raise on short or garbled input.
+
+Replies have the layout ``OK <status> <value> [<unit>]``.
+'''
+
+# Pressure reported by the controller for disabled or unavailable pumps
+PRESSURE_UNAVAILABLE = 1.3e-11
+
+# Characters that may precede a reply (remains of the previous prompt)
+_LEADING = b'>\n '
+# Characters following the value (frame delimiter and prompt)
+_TRAILING = b'\r\n >'
+
+def _fields(frame, minimum):
+    '''Splits a frame into whitespace separated fields
+
+    Returns None if the reply is no OK reply or has less than the required
+    number of fields. The prompt at the end of the frame is not included.
+    '''
+    fields = frame.rstrip(_TRAILING).split()
+    if len(fields) < minimum or fields[0] != b'OK':
+        return None
+    return fields
+
+def _isOk(frame):
+    return frame.startswith(b'OK') or frame.lstrip(_LEADING).startswith(b'OK')
+
+class ReplyDecoder:
+    '''Decoder for the reply of one command code
+
+    ``kind`` selects the reply layout:
+
+        text        free text after the status field (identity, supply status)
+        integer     integer value (voltage)
+        number      float value followed by the unit given in ``unit``
+        pressure    float value followed by the configured pressure unit
+        yesno       reply ending in YES or NO
+        ack         plain acknowledge, the value is True
+
+    The decode function for the layout is resolved once on construction.
+    '''
+    __slots__ = ('code', 'kind', 'unit', 'decode')
+
+    def __init__(self, code, kind, unit=None):
+        self.code = code
+        self.kind = kind
+        self.unit = unit
+        self.decode = getattr(self, "_decode_" + kind)
+
+    def __call__(self, frame):
+        return self.decode(frame)
+
+    def _decode_text(self, frame):
+        if not _isOk(frame):
+            return None
+        return frame.lstrip(_LEADING)[6:].rstrip(_TRAILING).strip().decode("utf-8", "replace")
+
+    def _decode_integer(self, frame):
+        fields = _fields(frame, 3)
+        if fields is None:
+            return None
+        try:
+            return int(fields[2])
+        except ValueError:
+            return None
+
+    def _decode_number(self, frame):
+        fields = _fields(frame, 4)
+        if (fields is None) or (fields[3] != self.unit):
+            return None
+        try:
+            return float(fields[2])
+        except ValueError:
+            return None
+
+    def _decode_pressure(self, frame):
+        fields = _fields(frame, 4)
+        if fields is None:
+            return None
+        try:
+            pressure = float(fields[2])
+        except ValueError:
+            return None
+        if pressure == PRESSURE_UNAVAILABLE:
+            pressure = None
+        return pressure, fields[3].decode("ascii", "replace")
+
+    def _decode_yesno(self, frame):
+        if not _isOk(frame):
+            return None
+        frame = frame.rstrip(_TRAILING)
+        if frame.endswith(b'YES'):
+            return True
+        if frame.endswith(b'NO'):
+            return False
+        return None
+
+    def _decode_ack(self, frame):
+        if not _isOk(frame):
+            return None
+        return True
+
+DECODERS = {
+    "01" : ReplyDecoder("01", "text"),
+    "0A" : ReplyDecoder("0A", "number", b'AMPS'),
+    "0B" : ReplyDecoder("0B", "pressure"),
+    "0C" : ReplyDecoder("0C", "integer"),
+    "0D" : ReplyDecoder("0D", "text"),
+    "11" : ReplyDecoder("11", "number", b'L/S'),
+    "37" : ReplyDecoder("37", "ack"),
+    "38" : ReplyDecoder("38", "ack"),
+    "61" : ReplyDecoder("61", "yesno")
+}
+
+def commandCode(command):
+    '''Returns the command code of an spc command string like "0B 1"'''
+    return command.split(" ", 1)[0]
+
+# Queries that do not change controller state. Only these may be repeated
+# or answered by the reply of another identical request
+READ_CODES = frozenset(("01", "0A", "0B", "0C", "0D", "11", "61"))
+
+def isRead(command):
+    '''True if the spc command string is a query that may safely be repeated'''
+    return commandCode(command).upper() in READ_CODES
+
+# Pressure unit (lower case, as reported by the controller) -> mbar
+PRESSURE_UNITS = {
+    "mbar" : 1.0,
+    "torr" : 1.33322368,
+    "pa" : 0.01,
+    "pascal" : 0.01
+}
+
+def convertPressure(pressure, units, target):
+    '''Converts a pressure between units, raises ValueError for unknown units'''
+    try:
+        return pressure * PRESSURE_UNITS[units.lower()] / PRESSURE_UNITS[target.lower()]
+    except KeyError:
+        raise ValueError("Unsupported pressure unit {} (or {})".format(units, target))
+
+def decode(code, frame):
+    '''Decodes a raw reply frame of the given command code
+
+    Returns the typed value or None for error replies and malformed frames.
+    Raises KeyError for unknown command codes.
+    '''
+    return DECODERS[code].decode(frame)
@@ -0,0 +1,125 @@
+'''Discovery of populated pump channels
+
+A QPC has four channels but often only some of them have a pump attached.
+``ChannelMap`` probes every channel once (pump size, supply status and high
+voltage status in a single pipelined batch) and remembers which channels
+are populated so pollers only query those. Refreshing is incremental: only
+channels that have never been probed, whose probe failed or whose
+information is older than ``maxAge`` are probed again.
+
+A channel is considered populated if its high voltage is on, if it reports
+a pump size above zero or - in case the size could not be read - if the
+supply status does not report a missing pump. Channels whose state is not
+known (for example because the probe failed) are treated as populated so
+they are never silently dropped.
+'''
+import time
+
+CHANNELS = (1, 2, 3, 4)
+
+class ChannelInfo:
+    __slots__ = ('pumpIndex', 'size', 'supplyStatus', 'highVoltage', 'probedAt')
+
+    def __init__(self, pumpIndex, size=None, supplyStatus=None, highVoltage=None, probedAt=None):
+        self.pumpIndex = pumpIndex
+        self.size = size
+        self.supplyStatus = supplyStatus
+        self.highVoltage = highVoltage
+        self.probedAt = probedAt
+
+    @property
+    def populated(self):
+        '''True, False or None if the probe did not yield any information'''
+        if self.highVoltage:
+            return True
+        if self.size is not None:
+            return self.size > 0
+        if self.supplyStatus is not None:
+            return "NO PUMP" not in self.supplyStatus.upper()
+        return None
+
+    def __repr__(self):
+        return "ChannelInfo({}, size={}, supplyStatus={!r}, highVoltage={}, populated={})".format(
+            self.pumpIndex, self.size, self.supplyStatus, self.highVoltage, self.populated)
+
+class ChannelMap:
+    '''Populated channels of a single controller
+
+    Parameters:
+        host        Controller address (informational)
+        channels    Channels that may be populated
+        maxAge      Seconds after which a channel is probed again (None to
+                    never re-probe successfully probed channels)
+        clock       Monotonic time source (for testing)
+    '''
+    def __init__(self, host=None, channels=CHANNELS, maxAge=3600.0, clock=time.monotonic):
+        self.host = host
+        self.channels = tuple(channels)
+        self.maxAge = maxAge
+        self.clock = clock
+        self.probes = 0
+        self._info = {}
+
+    def info(self, pumpIndex):
+        return self._info.get(pumpIndex)
+
+    def update(self, info):
+        self._info[info.pumpIndex] = info
+
+    def invalidate(self, pumpIndex=None):
+        '''Forces a probe of one (or all) channels on the next refresh'''
+        if pumpIndex is None:
+            self._info.clear()
+        else:
+            self._info.pop(pumpIndex, None)
+
+    def due(self):
+        '''Channels that have to be probed on the next refresh'''
+        now = self.clock()
+        result = []
+        for pumpIndex in self.channels:
+            info = self._info.get(pumpIndex)
+            if info is None or info.populated is None:
+                result.append(pumpIndex)
+            elif self.maxAge is not None and now - info.probedAt >= self.maxAge:
+                result.append(pumpIndex)
+        return result
+
+    @property
+    def populated(self):
+        '''Channels that are populated (or whose state is not known)'''
+        return tuple(i for i in self.channels if (i not in self._info) or (self._info[i].populated is not False))
+
+    def probe(self, pump, channels=None):
+        '''Probes the given channels (default: all channels) in one batch'''
+        if channels is None:
+            channels = self.channels
+        requests = []
+        for pumpIndex in channels:
+            requests.extend((("getPumpSize", pumpIndex), ("getSupplyStatus", pumpIndex), ("getHighVoltageStatus", pumpIndex)))
+        if not requests:
+            return []
+        results = pump.batch(requests)
+        now = self.clock()
+        self.probes = self.probes + 1
+
+        probed = []
+        for n, pumpIndex in enumerate(channels):
+            size, supplyStatus, highVoltage = results[3*n:3*n+3]
+            info = ChannelInfo(pumpIndex, size, supplyStatus, highVoltage, now)
+            self._info[pumpIndex] = info
+            probed.append(info)
+        return probed
+
+    def refresh(self, pump):
+        '''Probes only the channels that are due, returns the probed ChannelInfos'''
+        due = self.due()
+        if not due:
+            return []
+        return self.probe(pump, due)
+
+def discover(pump, channels=CHANNELS, maxAge=3600.0):
+    '''Probes all channels of a connected GammaIonPump and returns a ChannelMap'''
+    channelMap = ChannelMap(pump.host, channels, maxAge)
+    channelMap.probe(pump)
+    return channelMap
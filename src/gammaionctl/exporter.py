@@ -0,0 +1,272 @@
+'''Prometheus exporter for QPC controllers
+
+Keeps one persistent ``ReconnectingGammaIonPump`` session per controller
+and polls every controller from its own background thread on a fixed
+schedule. The readings (a pipelined ``snapshot`` per poll) are kept in
+memory, ``/metrics`` is rendered from those cached readings only, so a
+scrape never touches a controller and takes the same time independent of
+the number or state of the controllers.
+
+    gammaion-exporter --listen 127.0.0.1 --port 9523 --interval 10 10.0.0.11 10.0.0.12:2323
+
+Exported metrics (label ``host`` for all, ``pump`` for per channel values):
+
+* ``gammaion_up`` - 1 if the last poll reached the controller
+* ``gammaion_pressure`` (label ``units``), ``gammaion_voltage_volts``,
+  ``gammaion_current_amperes``, ``gammaion_high_voltage``
+* ``gammaion_supply_status`` - 1 with the status as ``status`` label
+* ``gammaion_last_poll_timestamp_seconds``, ``gammaion_poll_duration_seconds``,
+  ``gammaion_polls_total``, ``gammaion_poll_failures_total``
+* ``gammaion_command_latency_seconds`` histogram and
+  ``gammaion_command_errors_total`` per command code
+'''
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .session import ReconnectingGammaIonPump
+from .discovery import ChannelMap
+from .instrumentation import Instrumentation
+from .hosts import splitHost, readHostsFile
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join("{}=\"{}\"".format(name, _escape(value)) for name, value in labels.items()) + "}"
+
+def _number(value):
+    if value is True:
+        return "1"
+    if value is False:
+        return "0"
+    return repr(float(value))
+
+class HostState:
+    '''Most recent poll result of one controller'''
+    __slots__ = ('host', 'snapshot', 'duration', 'polls', 'failures')
+
+    def __init__(self, host):
+        self.host = host
+        self.snapshot = None
+        self.duration = None
+        self.polls = 0
+        self.failures = 0
+
+class Exporter:
+    '''Background poller and metrics renderer
+
+    Parameters:
+        hosts           Controller addresses ("address" or "address:port")
+        interval        Polling interval per controller in seconds
+        timeout         Socket timeout of the sessions
+        discovery       Only poll populated channels (see ChannelMap)
+        pumpFactory     Callable ``(host, timeout)`` returning a GammaIonPump
+                        like object (defaults to a ReconnectingGammaIonPump)
+    '''
+    def __init__(self, hosts, interval=10.0, timeout=2, discovery=False, pumpFactory=None):
+        self.hosts = list(hosts)
+        self.interval = interval
+        self.timeout = timeout
+        self.discovery = discovery
+        self.pumpFactory = pumpFactory if pumpFactory is not None else self._connect
+
+        self._states = { host : HostState(host) for host in self.hosts }
+        self._instrumentation = { host : Instrumentation() for host in self.hosts }
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._rendered = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    @staticmethod
+    def _connect(host, timeout):
+        address, port = splitHost(host)
+        return ReconnectingGammaIonPump(address, timeout=timeout, port=port)
+
+    def _session(self, host):
+        pump = self._sessions.get(host)
+        if pump is None:
+            pump = self.pumpFactory(host, self.timeout)
+            pump.setInstrumentation(self._instrumentation[host])
+            if self.discovery:
+                pump.setChannelMap(ChannelMap(host))
+            self._sessions[host] = pump
+        return pump
+
+    def pollHost(self, host):
+        '''Polls a single controller and updates the cached state'''
+        start = time.monotonic()
+        try:
+            snapshot = self._session(host).snapshot()
+        except Exception:
+            snapshot = None
+        duration = time.monotonic() - start
+
+        with self._lock:
+            state = self._states[host]
+            state.polls = state.polls + 1
+            state.duration = duration
+            if snapshot is None or not snapshot.connected:
+                state.failures = state.failures + 1
+            state.snapshot = snapshot
+            self._rendered = None
+        return snapshot
+
+    def _run(self, host):
+        # Absolute deadlines, missed ticks are skipped
+        start = time.monotonic()
+        tick = 0
+        while not self._stop.is_set():
+            self.pollHost(host)
+            now = time.monotonic()
+            tick = max(tick + 1, int((now - start) / self.interval) + 1)
+            self._stop.wait(start + tick * self.interval - now)
+
+    def start(self):
+        for host in self.hosts:
+            thread = threading.Thread(target=self._run, args=(host,), name="exporter-" + host, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for pump in self._sessions.values():
+            try:
+                pump.close()
+            except OSError:
+                pass
+        self._sessions = {}
+
+    def metrics(self):
+        '''Returns the rendered exposition document (re-rendered only after a poll)'''
+        with self._lock:
+            if self._rendered is None:
+                self._rendered = self.render().encode("utf-8")
+            return self._rendered
+
+    def render(self):
+        families = []
+        states = [ self._states[host] for host in self.hosts ]
+        _family(families, "gammaion_up", "gauge", "1 if the last poll reached the controller",
+                [ (_labels(host=s.host), "1" if (s.snapshot is not None and s.snapshot.connected) else "0") for s in states ])
+        _family(families, "gammaion_polls_total", "counter", "Number of polls",
+                [ (_labels(host=s.host), s.polls) for s in states ])
+        _family(families, "gammaion_poll_failures_total", "counter", "Number of polls that did not reach the controller",
+                [ (_labels(host=s.host), s.failures) for s in states ])
+        _family(families, "gammaion_poll_duration_seconds", "gauge", "Duration of the last poll",
+                [ (_labels(host=s.host), _number(s.duration)) for s in states if s.duration is not None ])
+        _family(families, "gammaion_last_poll_timestamp_seconds", "gauge", "Time of the last poll",
+                [ (_labels(host=s.host), _number(s.snapshot.timestamp)) for s in states if s.snapshot is not None ])
+
+        pressure, voltage, current, highVoltage, status = [], [], [], [], []
+        for s in states:
+            if s.snapshot is None or not s.snapshot.connected:
+                continue
+            for channel in s.snapshot:
+                labels = _labels(host=s.host, pump=channel.pumpIndex)
+                if channel.pressure is not None:
+                    pressure.append((_labels(host=s.host, pump=channel.pumpIndex, units=channel.units), _number(channel.pressure)))
+                if channel.voltage is not None:
+                    voltage.append((labels, _number(channel.voltage)))
+                if channel.current is not None:
+                    current.append((labels, _number(channel.current)))
+                if channel.highVoltage is not None:
+                    highVoltage.append((labels, _number(channel.highVoltage)))
+                if channel.supplyStatus is not None:
+                    status.append((_labels(host=s.host, pump=channel.pumpIndex, status=channel.supplyStatus), "1"))
+        _family(families, "gammaion_pressure", "gauge", "Estimated pressure in the reported units", pressure)
+        _family(families, "gammaion_voltage_volts", "gauge", "Pump voltage", voltage)
+        _family(families, "gammaion_current_amperes", "gauge", "Pump current", current)
+        _family(families, "gammaion_high_voltage", "gauge", "1 if the high voltage is enabled", highVoltage)
+        _family(families, "gammaion_supply_status", "gauge", "Supply status of the pump", status)
+
+        # Per command statistics collected by the sessions
+        latency, errors = [], []
+        for host in self.hosts:
+            for entry in self._instrumentation[host].snapshot()["hosts"].values():
+                for code, statistics in entry["commands"].items():
+                    histogram = statistics["latency"]
+                    cumulative = 0
+                    for bound, count in zip(histogram["bounds"] + [ "+Inf" ], histogram["counts"]):
+                        cumulative = cumulative + count
+                        latency.append(("_bucket", _labels(host=host, code=code, le=bound), cumulative))
+                    latency.append(("_sum", _labels(host=host, code=code), _number(histogram["sum"])))
+                    latency.append(("_count", _labels(host=host, code=code), histogram["count"]))
+                    errors.append((_labels(host=host, code=code), statistics["errors"] + statistics["failures"]))
+        families.append("\n".join([
+            "# HELP gammaion_command_latency_seconds Command round trip time",
+            "# TYPE gammaion_command_latency_seconds histogram"
+        ] + [ "gammaion_command_latency_seconds{}{} {}".format(suffix, labels, value) for suffix, labels, value in latency ]))
+        _family(families, "gammaion_command_errors_total", "counter", "Error replies and failed commands", errors)
+
+        return "\n".join(families) + "\n"
+
+def _family(families, name, kind, help, samples):
+    lines = [ "# HELP {} {}".format(name, help), "# TYPE {} {}".format(name, kind) ]
+    lines.extend("{}{} {}".format(name, labels, value) for labels, value in samples)
+    families.append("\n".join(lines))
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.exporter.metrics()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, exporter, address="127.0.0.1", port=9523, verbose=False):
+        self.exporter = exporter
+        self.verbose = verbose
+        super().__init__((address, port), MetricsHandler)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prometheus exporter for Gamma QPC ion pump controllers")
+    parser.add_argument("hosts", nargs="*", help="Controller addresses (address or address:port)")
+    parser.add_argument("--hosts-file", default=None, help="File with one controller address per line")
+    parser.add_argument("--listen", default="127.0.0.1", help="Address the HTTP server listens on")
+    parser.add_argument("--port", type=int, default=9523, help="Port the HTTP server listens on")
+    parser.add_argument("--interval", type=float, default=10.0, help="Polling interval per controller in seconds")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Socket timeout in seconds")
+    parser.add_argument("--discovery", action="store_true", help="Only poll populated channels")
+    parser.add_argument("--verbose", action="store_true", help="Log HTTP requests")
+    args = parser.parse_args(argv)
+
+    hosts = list(args.hosts)
+    if args.hosts_file is not None:
+        hosts.extend(readHostsFile(args.hosts_file))
+    if not hosts:
+        parser.error("No controllers given")
+
+    exporter = Exporter(hosts, interval=args.interval, timeout=args.timeout, discovery=args.discovery)
+    server = MetricsServer(exporter, args.listen, args.port, args.verbose)
+    exporter.start()
+    print("Serving metrics of {} controllers on http://{}:{}/metrics".format(len(hosts), args.listen, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        exporter.stop()
+
+if __name__ == "__main__":
+    main()
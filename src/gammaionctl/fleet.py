@@ -0,0 +1,222 @@
+'''Concurrent polling of many QPC controllers
+
+``GammaFleet`` keeps one persistent ``GammaIonPump`` session per host and
+polls all of them concurrently from a bounded thread pool. Every cycle
+returns a single timestamped ``FleetSnapshot``. Each host runs in its own
+worker with its own socket timeout, so a dead or slow controller only
+delays its own entry - the cycle takes as long as the slowest controller
+(bounded by ``cycleTimeout``), not the sum of all of them.
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .gammaionctl import GammaIonPump
+from .discovery import ChannelMap
+from .hosts import splitHost
+
+# Metric name -> GammaIonPump getter
+METRICS = {
+    "pressure" : "getPressure",
+    "voltage" : "getVoltage",
+    "current" : "getCurrent",
+    "size" : "getPumpSize",
+    "hv" : "getHighVoltageStatus",
+    "status" : "getSupplyStatus"
+}
+
+class HostReading:
+    '''Readings of a single controller during one cycle
+
+    ``values`` maps ``(metric, pumpIndex)`` to the value returned by the
+    corresponding ``GammaIonPump`` getter. ``error`` is ``None`` on success
+    or a short description why the controller could not be polled.
+    '''
+    __slots__ = ('host', 'values', 'error', 'duration')
+
+    def __init__(self, host, values=None, error=None, duration=None):
+        self.host = host
+        self.values = values if values is not None else {}
+        self.error = error
+        self.duration = duration
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def get(self, metric, pumpIndex, default=None):
+        return self.values.get((metric, pumpIndex), default)
+
+class FleetSnapshot:
+    __slots__ = ('timestamp', 'duration', 'hosts')
+
+    def __init__(self, timestamp, duration, hosts):
+        self.timestamp = timestamp
+        self.duration = duration
+        self.hosts = hosts
+
+    def __getitem__(self, host):
+        return self.hosts[host]
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def __iter__(self):
+        return iter(self.hosts.values())
+
+    @property
+    def failed(self):
+        return [ r.host for r in self.hosts.values() if not r.ok ]
+
+class GammaFleet:
+    '''Polls a set of metrics on many controllers concurrently
+
+    Parameters:
+        hosts           Iterable of controller addresses. A host may be given
+                        as "address:port" to use a port other than 23.
+                        Hosts listed more than once (also with a different
+                        spelling of the same port) are polled once
+        metrics         Iterable of metric names (see ``METRICS``)
+        pumps           Pump indices to query on every controller
+        timeout         Socket timeout per controller (connect and per reply)
+        cycleTimeout    Upper bound for a whole cycle. Controllers that did not
+                        finish in time are reported as failed. Defaults to
+                        a value derived from ``timeout``
+        maxWorkers      Size of the thread pool
+        pumpFactory     Callable ``(host, timeout)`` returning a connected
+                        ``GammaIonPump`` like object
+        discovery       Only poll the populated channels of every controller.
+                        Channels are probed once and re-probed after
+                        ``discoveryMaxAge`` seconds (see ``ChannelMap``),
+                        values of unpopulated channels are not reported
+    '''
+    def __init__(self, hosts, metrics=("pressure",), pumps=(1, 2, 3, 4), timeout=2,
+                 cycleTimeout=None, maxWorkers=16, pumpFactory=None, discovery=False,
+                 discoveryMaxAge=3600.0):
+        self.hosts = []
+        seen = set()
+        for host in hosts:
+            if splitHost(host) not in seen:
+                seen.add(splitHost(host))
+                self.hosts.append(host)
+        for metric in metrics:
+            if metric not in METRICS:
+                raise ValueError("Unknown metric {}".format(metric))
+        self.metrics = tuple(metrics)
+        self.pumps = tuple(pumps)
+        self.timeout = timeout
+        if cycleTimeout is None:
+            cycleTimeout = timeout * (2 + len(self.metrics) * len(self.pumps))
+        self.cycleTimeout = cycleTimeout
+        self.pumpFactory = pumpFactory if pumpFactory is not None else self._connect
+        self.discovery = discovery
+        self.discoveryMaxAge = discoveryMaxAge
+        self.channelMaps = {}
+
+        self._sessions = {}
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(self.hosts))))
+
+    @staticmethod
+    def _connect(host, timeout):
+        address, port = splitHost(host)
+        return GammaIonPump(address, timeout=timeout, port=port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for pump in self._sessions.values():
+            try:
+                pump.close()
+            except OSError:
+                pass
+        self._sessions = {}
+
+    def _dropSession(self, host):
+        pump = self._sessions.pop(host, None)
+        if pump is not None:
+            try:
+                pump.close()
+            except OSError:
+                pass
+
+    def _pollHost(self, host):
+        start = time.monotonic()
+        values = {}
+        try:
+            pump = self._sessions.get(host)
+            if pump is None or not pump.sock:
+                pump = self.pumpFactory(host, self.timeout)
+                self._sessions[host] = pump
+
+            pumps = self.pumps
+            if self.discovery:
+                channelMap = self.channelMaps.get(host)
+                if channelMap is None:
+                    channelMap = ChannelMap(host, self.pumps, self.discoveryMaxAge)
+                    self.channelMaps[host] = channelMap
+                channelMap.refresh(pump)
+                if not pump.sock:
+                    raise ConnectionError("Connection to controller lost")
+                pumps = channelMap.populated
+
+            for metric in self.metrics:
+                getter = getattr(pump, METRICS[metric])
+                for pumpIndex in pumps:
+                    values[(metric, pumpIndex)] = getter(pumpIndex)
+                    if not pump.sock:
+                        raise ConnectionError("Connection to controller lost")
+        except Exception as e:
+            self._dropSession(host)
+            return HostReading(host, values, "{}: {}".format(type(e).__name__, e), time.monotonic() - start)
+
+        return HostReading(host, values, None, time.monotonic() - start)
+
+    def poll(self):
+        '''Runs a single polling cycle over all controllers
+
+        Controllers whose previous cycle is still running (for example
+        because they are stuck in a connect timeout) are skipped and reported
+        as busy instead of queueing up more work.
+        '''
+        timestamp = time.time()
+        start = time.monotonic()
+
+        hosts = {}
+        futures = {}
+        for host in self.hosts:
+            previous = self._inflight.get(host)
+            if previous is not None and not previous.done():
+                hosts[host] = HostReading(host, error="Previous cycle still running")
+                continue
+            futures[host] = self._executor.submit(self._pollHost, host)
+            self._inflight[host] = futures[host]
+
+        wait(futures.values(), timeout=self.cycleTimeout)
+        for host, future in futures.items():
+            if future.done():
+                hosts[host] = future.result()
+            else:
+                hosts[host] = HostReading(host, error="Cycle timeout exceeded")
+
+        # Keep the order of the host list
+        hosts = { host : hosts[host] for host in self.hosts }
+        return FleetSnapshot(timestamp, time.monotonic() - start, hosts)
+
+    def run(self, interval, cycles=None):
+        '''Generator yielding one snapshot every ``interval`` seconds'''
+        nextCycle = time.monotonic()
+        n = 0
+        while (cycles is None) or (n < cycles):
+            yield self.poll()
+            n = n + 1
+            nextCycle = nextCycle + interval
+            delay = nextCycle - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                nextCycle = time.monotonic()
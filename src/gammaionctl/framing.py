@@ -0,0 +1,84 @@
+'''Receive buffering and reply framing for the QPC telnet protocol
+
+The controller terminates every reply with ``\\r\\r`` followed by the
+``>`` prompt. Instead of reading a single byte per ``recv`` call and
+concatenating strings this module reads in large chunks into a
+``bytearray``, searches for the frame delimiter incrementally and keeps any
+surplus bytes for the next reply.
+'''
+
+REPLY_DELIMITER = b'\r\r>'
+PROMPT_DELIMITER = b'>'
+
+
+class ReplyBuffer:
+    '''Incremental frame extractor on top of a bytearray
+
+    Data is appended using ``feed``. ``nextFrame`` returns the next complete
+    frame (including its delimiter) or ``None`` in case the delimiter has not
+    been seen yet. Already scanned bytes are remembered so every byte is only
+    searched once, independent of how the data is split across chunks.
+    '''
+    __slots__ = ('_buffer', '_scanned')
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        self._buffer += data
+
+    def clear(self):
+        del self._buffer[:]
+        self._scanned = 0
+
+    def pending(self):
+        '''Returns a copy of the bytes currently buffered but not consumed'''
+        return bytes(self._buffer)
+
+    def nextFrame(self, delimiter=REPLY_DELIMITER):
+        start = self._scanned - len(delimiter) + 1
+        if start < 0:
+            start = 0
+        pos = self._buffer.find(delimiter, start)
+        if pos < 0:
+            self._scanned = len(self._buffer)
+            return None
+
+        end = pos + len(delimiter)
+        frame = bytes(memoryview(self._buffer)[:end])
+        del self._buffer[:end]
+        self._scanned = 0
+        return frame
+
+
+class FramedReader:
+    '''Reads delimited frames from a socket like object
+
+    The connection only has to provide ``recv(bufsize)``. Returns ``None``
+    from ``readFrame`` in case the peer closed the connection before a
+    complete frame has been received. Timeouts raised by the underlying
+    connection are passed through unchanged.
+    '''
+    def __init__(self, connection, chunkSize=4096):
+        self.connection = connection
+        self.chunkSize = chunkSize
+        self.buffer = ReplyBuffer()
+        self.recvCalls = 0
+
+    def readFrame(self, delimiter=REPLY_DELIMITER):
+        frame = self.buffer.nextFrame(delimiter)
+        while frame is None:
+            chunk = self.connection.recv(self.chunkSize)
+            self.recvCalls = self.recvCalls + 1
+            if not chunk:
+                return None
+            self.buffer.feed(chunk)
+            frame = self.buffer.nextFrame(delimiter)
+        return frame
+
+    def discard(self):
+        self.buffer.clear()
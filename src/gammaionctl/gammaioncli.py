@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import time, sys
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 
 from gammaionctl import gammaionctl
+from gammaionctl.watch import Watcher, RotatingOutput, WATCH_METRICS
+from gammaionctl.hosts import splitHost, readHostsFile
 
 def printUsage():
     print(textwrap.dedent("""
@@ -14,7 +17,22 @@ def printUsage():
         \t{} [settings] <commands>
 
         Settings:
-        \t--host ADDRESS\tSets the remote hostname or IP
+        \t--host ADDRESS\tSets the remote hostname or IP (ADDRESS:PORT or
+        \t\t\t[ADDRESS]:PORT to use a different port). Can be given
+        \t\t\tseveral times
+        \t--hosts-file FILE\tReads additional hosts from FILE (one per line)
+        \t--parallel N\tNumber of controllers processed at once (default 8)
+        \t--port N\tSets the remote TCP port (default 23)
+        \t--script FILE\tExecutes the commands in FILE (- for stdin)
+        \t--timing\tReports the execution time of every command
+
+        Settings (watch mode):
+        \t--interval S\tSampling interval in seconds (default 1)
+        \t--count N\tStop after N samples
+        \t--format F\tOutput format csv or json (default csv)
+        \t--output FILE\tWrite samples to FILE instead of stdout
+        \t--max-bytes N\tRotate FILE after N bytes
+        \t--backup-count N\tNumber of rotated files to keep (default 5)
 
         Commands (status, controller):
         \tid\t\tIdentifies the remote QPC
@@ -31,252 +49,408 @@ def printUsage():
         \toff N\t\tDisabled pump N
         Commands (actions, local):
         \tsleep N\tSleeps N seconds
+        \twatch\t\tContinuously samples the given status commands (no
+        \t\t\tother commands are allowed)
+        \tshell\t\tReads commands interactively (exit with quit)
+
+        Scripts contain the same commands as the command line, any number
+        per line. Everything following a # is ignored.
+
+        With more than one host the commands are executed on all controllers
+        concurrently, the output is grouped per host and every line is
+        prefixed with [host]. watch and shell require a single host.
         """).format(sys.argv[0]))
 
+class UsageError(Exception):
+    pass
 
-def gammaioncli():
-    host = None
+def parseNumericSetting(name, value, convert, minimum):
+    try:
+        value = convert(value)
+    except ValueError:
+        print("Failed to interpret {} {}".format(name, value))
+        sys.exit(2)
+    if value < minimum:
+        print("Invalid {} {}".format(name, value))
+        sys.exit(2)
+    return value
 
-    if len(sys.argv) < 2:
-        printUsage()
+def _outputFormat(name, value):
+    if value not in ("csv", "json"):
+        print("Unsupported output format "+value)
+        sys.exit(2)
+    return value
+
+def _readHostsFile(filename):
+    try:
+        return readHostsFile(filename)
+    except OSError as e:
+        print("Failed to read hosts file: {}".format(e))
+        sys.exit(2)
+
+# Setting -> (attribute, parser(name, value)). List valued attributes are
+# extended by every occurrence of the setting
+SETTINGS = {
+    "--host" : ("hosts", lambda name, value: [ value ]),
+    "--hosts-file" : ("hosts", lambda name, value: _readHostsFile(value)),
+    "--parallel" : ("parallel", lambda name, value: parseNumericSetting("parallelism", value, int, 1)),
+    "--port" : ("port", lambda name, value: parseNumericSetting("port", value, int, 1)),
+    "--script" : ("script", lambda name, value: value),
+    "--interval" : ("interval", lambda name, value: parseNumericSetting("interval", value, float, 0.01)),
+    "--count" : ("count", lambda name, value: parseNumericSetting("sample count", value, int, 1)),
+    "--format" : ("fmt", _outputFormat),
+    "--output" : ("output", lambda name, value: value),
+    "--max-bytes" : ("maxBytes", lambda name, value: parseNumericSetting("maximum file size", value, int, 0)),
+    "--backup-count" : ("backupCount", lambda name, value: parseNumericSetting("backup count", value, int, 0))
+}
+
+# Settings without value
+FLAGS = {
+    "--timing" : "timing"
+}
+
+def _report(emit, label, res, fmt, unavailable=None):
+    '''Prints a reading. ``unavailable`` is printed for None if None means
+    that there is no value (pressure of a disabled pump) instead of an error'''
+    if (res is None) and (unavailable is not None):
+        emit("{}: {}".format(label, unavailable))
+        return True
+    # Zero is a valid reading (for example the current of a disabled pump)
+    if (res is not None) and (res is not False):
+        emit("{}: {}".format(label, fmt.format(res)))
+        return True
+    emit("{}: Failed to query".format(label))
+    return False
+
+def _identify(pump, arg, emit):
+    res = pump.identify()
+    if res:
+        emit("QPC Identity: {}".format(res))
+        return True
+    emit("QPC Identity: Failed to query")
+    return False
 
-    # First gather all settings
+def _switch(pump, pumpidx, enable, emit):
+    if enable:
+        res = pump.enable(pumpidx)
+        emit("Power pump {}: {}".format(pumpidx, "enabled" if res else "failed to enable"))
+    else:
+        res = pump.disable(pumpidx)
+        emit("Power pump {}: {}".format(pumpidx, "standby" if res else "failed to disable"))
+    return res
 
-    skipArg = 0;
-    for i in range(1, len(sys.argv)):
-        if skipArg > 0:
-            skipArg = skipArg - 1
+def _sleep(pump, duration, emit):
+    time.sleep(duration)
+    return True
+
+class CliCommand:
+    '''Entry of the command table
+
+    ``argument`` is None, "pump" (pump index 1 to 4) or "seconds", ``run``
+    is called with the pump, the parsed argument and the function used to
+    print a line and returns True on success.
+    '''
+    __slots__ = ('name', 'argument', 'description', 'run')
+
+    def __init__(self, name, argument, description, run):
+        self.name = name
+        self.argument = argument
+        self.description = description
+        self.run = run
+
+COMMANDS = { command.name : command for command in (
+    CliCommand("id", None, "identity query", _identify),
+    CliCommand("pres", "pump", "preassure query",
+               lambda pump, i, emit: _report(emit, "Pressure pump {}".format(i), pump.getPressure(i), "{:e} mbar",
+                                             "not available (pump disabled or not fitted)")),
+    CliCommand("volt", "pump", "voltage query",
+               lambda pump, i, emit: _report(emit, "Voltage pump {}".format(i), pump.getVoltage(i), "{} V")),
+    CliCommand("cur", "pump", "current query",
+               lambda pump, i, emit: _report(emit, "Current pump {}".format(i), pump.getCurrent(i), "{} mA")),
+    CliCommand("size", "pump", "size query",
+               lambda pump, i, emit: _report(emit, "Size of pump {}".format(i), pump.getPumpSize(i), "{} L/S")),
+    CliCommand("status", "pump", "status query",
+               lambda pump, i, emit: _report(emit, "Supply status of pump {}".format(i), pump.getSupplyStatus(i), "{}")),
+    CliCommand("on", "pump", "pump startup", lambda pump, i, emit: _switch(pump, i, True, emit)),
+    CliCommand("off", "pump", "pump shutdown", lambda pump, i, emit: _switch(pump, i, False, emit)),
+    CliCommand("sleep", "seconds", "sleep period (in seconds)", _sleep)
+) }
+
+# Commands that change the mode of the CLI instead of being executed
+MODES = ( "watch", "shell" )
+
+def parseCommands(tokens):
+    '''Validates a sequence of command tokens in a single pass
+
+    Returns a list of (CliCommand or mode name, argument) tuples, raises
+    UsageError on the first invalid token.
+    '''
+    commands = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i].strip()
+        i = i + 1
+        if token in MODES:
+            commands.append((token, None))
             continue
-        if sys.argv[i].strip() == "--host":
-            if i == (len(sys.argv)-1):
-                print("Missing host specification")
-                sys.exit(2)
-                break
-            host = sys.argv[i+1]
-            skipArg = 1
-        elif sys.argv[i].strip() == "id":
-            pass
-        elif sys.argv[i].strip() == "pres":
-            if i == (len(sys.argv)-1):
-                print("Missing pump index for preassure query")
-                sys.exit(2)
-                break
-            pumpidx = 0
-            try:
-                pumpidx = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (pumpidx > 4) or (pumpidx < 1):
-                print("Invalid pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            skipArg = 1
-        elif sys.argv[i].strip() == "volt":
-            if i == (len(sys.argv)-1):
-                print("Missing pump index for voltage query")
-                sys.exit(2)
-                break
-            pumpidx = 0
-            try:
-                pumpidx = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (pumpidx > 4) or (pumpidx < 1):
-                print("Invalid pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            skipArg = 1
-        elif sys.argv[i].strip() == "cur":
-            if i == (len(sys.argv)-1):
-                print("Missing pump index for current query")
-                sys.exit(2)
-                break
-            pumpidx = 0
-            try:
-                pumpidx = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (pumpidx > 4) or (pumpidx < 1):
-                print("Invalid pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            skipArg = 1
-        elif sys.argv[i].strip() == "size":
-            if i == (len(sys.argv)-1):
-                print("Missing pump index for size query")
-                sys.exit(2)
-                break
-            pumpidx = 0
-            try:
-                pumpidx = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (pumpidx > 4) or (pumpidx < 1):
-                print("Invalid pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            skipArg = 1
-        elif sys.argv[i].strip() == "status":
-            if i == (len(sys.argv)-1):
-                print("Missing pump index for status query")
-                sys.exit(2)
-                break
-            pumpidx = 0
-            try:
-                pumpidx = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (pumpidx > 4) or (pumpidx < 1):
-                print("Invalid pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            skipArg = 1
-        elif sys.argv[i].strip() == "on":
-            if i == (len(sys.argv)-1):
-                print("Missing pump index for pump startup")
-                sys.exit(2)
-                break
-            pumpidx = 0
-            try:
-                pumpidx = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (pumpidx > 4) or (pumpidx < 1):
-                print("Invalid pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            skipArg = 1
-        elif sys.argv[i].strip() == "off":
-            if i == (len(sys.argv)-1):
-                print("Missing pump index for pump shutdown")
-                sys.exit(2)
-                break
-            pumpidx = 0
+        command = COMMANDS.get(token)
+        if command is None:
+            raise UsageError("Unsupported command or setting "+token)
+        if command.argument is None:
+            commands.append((command, None))
+            continue
+
+        if i == len(tokens):
+            if command.argument == "pump":
+                raise UsageError("Missing pump index for "+command.description)
+            raise UsageError("Missing duration of "+command.description)
+        value = tokens[i]
+        i = i + 1
+        if command.argument == "pump":
             try:
-                pumpidx = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (pumpidx > 4) or (pumpidx < 1):
-                print("Invalid pump index "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            skipArg = 1
-        elif sys.argv[i].strip() == "sleep":
-            if i == (len(sys.argv)-1):
-                print("Missing duration of sleep period (in seconds)")
-                sys.exit(2)
-                break
-            duration = 0
+                arg = int(value)
+            except ValueError:
+                raise UsageError("Failed to interpret pump index "+value)
+            if (arg > 4) or (arg < 1):
+                raise UsageError("Invalid pump index "+value)
+        else:
             try:
-                duration = int(sys.argv[i+1])
-            except:
-                print("Failed to interpret sleep duration "+sys.argv[i+1])
-                sys.exit(2)
-                break
-            if (duration < 1):
-                print("Invalid sleep duration "+sys.argv[i+1])
+                arg = float(value)
+            except ValueError:
+                raise UsageError("Failed to interpret sleep duration "+value)
+            if arg <= 0:
+                raise UsageError("Invalid sleep duration "+value)
+        commands.append((command, arg))
+    return commands
+
+def parseArguments(argv):
+    '''Splits the command line into settings and validated commands'''
+    settings = {
+        "hosts" : [], "parallel" : 8, "port" : 23, "script" : None, "timing" : False, "interval" : 1.0, "count" : None,
+        "fmt" : "csv", "output" : None, "maxBytes" : 0, "backupCount" : 5
+    }
+    tokens = []
+    i = 0
+    while i < len(argv):
+        token = argv[i].strip()
+        if token in SETTINGS:
+            if i == (len(argv)-1):
+                print("Missing value for "+token)
                 sys.exit(2)
-                break
-            skipArg = 1
+            attribute, parse = SETTINGS[token]
+            if isinstance(settings[attribute], list):
+                settings[attribute].extend(parse(token, argv[i+1]))
+            else:
+                settings[attribute] = parse(token, argv[i+1])
+            i = i + 2
+        elif token in FLAGS:
+            settings[FLAGS[token]] = True
+            i = i + 1
         else:
-            print("Unsupported command or setting "+sys.argv[i])
+            tokens.append(argv[i])
+            i = i + 1
+    try:
+        commands = parseCommands(tokens)
+    except UsageError as e:
+        print(e)
+        sys.exit(2)
+    return settings, commands
+
+class CommandTimer:
+    '''Collects per command execution times'''
+    def __init__(self, enabled, emit=print):
+        self.enabled = enabled
+        self.emit = emit
+        self.times = {}
+        self.failures = 0
+
+    def execute(self, pump, command, arg):
+        start = time.perf_counter()
+        ok = command.run(pump, arg, self.emit)
+        elapsed = time.perf_counter() - start
+        if not ok:
+            self.failures = self.failures + 1
+        if self.enabled:
+            self.times.setdefault(command.name, []).append(elapsed)
+            self.emit("  [{} {:.3f} ms]".format(command.name, elapsed * 1e3))
+        return ok
+
+    def printSummary(self):
+        if not self.enabled or not self.times:
+            return
+        total = sum(len(t) for t in self.times.values())
+        self.emit("Executed {} commands in {:.3f} s".format(total, sum(sum(t) for t in self.times.values())))
+        for name, times in self.times.items():
+            self.emit("  {:<8} {:>6} x  mean {:.3f} ms  max {:.3f} ms".format(
+                name, len(times), sum(times) / len(times) * 1e3, max(times) * 1e3))
+
+def runCommands(pump, commands, timer):
+    for command, arg in commands:
+        if command in MODES:
+            continue
+        timer.execute(pump, command, arg)
+        if not pump.sock:
+            raise ConnectionError("Connection to controller lost")
+
+def runLines(pump, lines, timer):
+    '''Executes script lines, invalid lines are reported and skipped
+
+    Returns the number of invalid lines.
+    '''
+    invalid = 0
+    for number, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if line in ("quit", "exit"):
+            break
+        if line:
+            try:
+                commands = parseCommands(line.split())
+            except UsageError as e:
+                timer.emit("Line {}: {}".format(number, e))
+                invalid = invalid + 1
+                continue
+            runCommands(pump, commands, timer)
+    return invalid
 
-    if host == None:
+def _interactiveLines(prompt):
+    while True:
+        try:
+            yield input(prompt)
+        except EOFError:
+            print()
+            return
+
+def runWatch(pump, metrics, interval, count, fmt, output, maxBytes, backupCount):
+    watcher = Watcher(pump, metrics, interval=interval, fmt=fmt)
+    if output is None:
+        header = watcher.header()
+        if header is not None:
+            sys.stdout.write(header)
+        target = sys.stdout
+    else:
+        target = RotatingOutput(output, maxBytes=maxBytes, backupCount=backupCount, header=watcher.header())
+    try:
+        watcher.run(target, count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not None:
+            target.close()
+
+def runSession(host, port, commands, script, interactive, timing, emit=print):
+    '''Executes commands, script lines and the interactive shell on one controller
+
+    Returns True if all commands succeeded.
+    '''
+    timer = CommandTimer(timing, emit)
+    invalid = 0
+    try:
+        with gammaionctl.GammaIonPump(host, port=port) as pump:
+            runCommands(pump, commands, timer)
+            if script is not None:
+                invalid = runLines(pump, script, timer)
+            if interactive:
+                invalid = invalid + runLines(pump, _interactiveLines("qpc> "), timer)
+    except (ConnectionError, OSError) as e:
+        emit("Communication with controller failed: {}".format(e))
+        timer.printSummary()
+        return False
+
+    timer.printSummary()
+    return timer.failures == 0 and invalid == 0
+
+def runHosts(hosts, port, commands, script, timing, parallel):
+    '''Runs the same commands on many controllers concurrently
+
+    The output of every controller is collected and printed as one block
+    (in the order of the hosts), each line prefixed with the host. Returns
+    the list of hosts that failed.
+    '''
+    def run(host):
+        lines = []
+        emit = lambda line: lines.append("[{}] {}".format(host, line))
+        address, hostPort = splitHost(host, port)
+        try:
+            ok = runSession(address, hostPort, commands, script, False, timing, emit)
+        except Exception as e:
+            emit("Failed: {}: {}".format(type(e).__name__, e))
+            ok = False
+        return ok, lines
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(parallel, len(hosts))) as executor:
+        for host, (ok, lines) in zip(hosts, executor.map(run, hosts)):
+            for line in lines:
+                print(line)
+            sys.stdout.flush()
+            if not ok:
+                failed.append(host)
+    return failed
+
+def gammaioncli(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) < 1:
+        printUsage()
+
+    settings, commands = parseArguments(argv)
+    modes = [ command for command, _ in commands if command in MODES ]
+    commands = [ (command, arg) for command, arg in commands if command not in MODES ]
+    hosts = settings["hosts"]
+
+    if len(hosts) == 0:
         print("Missing host specification.")
         print("This is required to connect to the controller")
         sys.exit(1)
+    if len(hosts) > 1 and len(modes) > 0:
+        print("{} requires a single host".format(modes[0]))
+        sys.exit(2)
+
+    if "watch" in modes:
+        others = [ command.name for command, _ in commands if command.name not in WATCH_METRICS ]
+        if others:
+            print("Watch mode only accepts status commands (pres, volt, cur, size, status), not {}".format(" ".join(others)))
+            sys.exit(2)
+        metrics = [ (command.name, arg) for command, arg in commands ]
+        if len(metrics) == 0:
+            print("Watch mode requires at least one status command (pres, volt, cur, size, status)")
+            sys.exit(2)
+        address, port = splitHost(hosts[0], settings["port"])
+        try:
+            with gammaionctl.GammaIonPump(address, port=port) as pump:
+                runWatch(pump, metrics, settings["interval"], settings["count"], settings["fmt"],
+                         settings["output"], settings["maxBytes"], settings["backupCount"])
+        except (ConnectionError, OSError) as e:
+            print("Watch failed: {}".format(e))
+            sys.exit(1)
+        return
+
+    script = None
+    if settings["script"] is not None:
+        try:
+            if settings["script"] == "-":
+                script = sys.stdin if len(hosts) == 1 else sys.stdin.readlines()
+            else:
+                with open(settings["script"]) as f:
+                    script = f.readlines()
+        except OSError as e:
+            print("Failed to open script: {}".format(e))
+            sys.exit(2)
 
     try:
-        with gammaionctl.GammaIonPump(host) as pump:
-                skipArg = 0;
-                for i in range(1, len(sys.argv)):
-                    if skipArg > 0:
-                        skipArg = skipArg - 1
-                        continue
-                    if sys.argv[i].strip() == "--host":
-                        skipArg = 1
-                    if sys.argv[i].strip() == "id":
-                        res = pump.identify()
-                        if res:
-                            print("QPC Identity: {}".format(res))
-                        else:
-                            print("QPC Identity: Failed to query")
-                    if sys.argv[i].strip() == "pres":
-                        pumpidx = int(sys.argv[i+1])
-                        res = pump.getPressure(pumpidx)
-                        if res:
-                            print("Pressure pump {}: {:e} mbar".format(pumpidx, res))
-                        else:
-                            print("Pressure pump {}: Failed to query".format(pumpidx))
-                        skipArg = 1
-                    if sys.argv[i].strip() == "volt":
-                        pumpidx = int(sys.argv[i+1])
-                        res = pump.getVoltage(pumpidx)
-                        if res:
-                            print("Voltage pump {}: {} V".format(pumpidx, res))
-                        else:
-                            print("Voltage pump {}: Failed to query".format(pumpidx))
-                        skipArg = 1
-                    if sys.argv[i].strip() == "cur":
-                        pumpidx = int(sys.argv[i+1])
-                        res = pump.getCurrent(pumpidx)
-                        if res:
-                            print("Current pump {}: {} mA".format(pumpidx, res))
-                        else:
-                            print("Current pump {}: Failed to query".format(pumpidx))
-                        skipArg = 1
-                    if sys.argv[i].strip() == "size":
-                        pumpidx = int(sys.argv[i+1])
-                        res = pump.getPumpSize(pumpidx)
-                        if res:
-                            print("Size of pump {}: {} L/S".format(pumpidx, res))
-                        else:
-                            print("Size of pump {}: Failed to query".format(pumpidx))
-                        skipArg = 1
-                    if sys.argv[i].strip() == "status":
-                        pumpidx = int(sys.argv[i+1])
-                        res = pump.getSupplyStatus(pumpidx)
-                        if res:
-                            print("Supply status of pump {}: {}".format(pumpidx, res))
-                        else:
-                            print("Supply status of pump {}: Failed to query".format(pumpidx))
-                        skipArg = 1
-                    if sys.argv[i].strip() == "on":
-                        pumpidx = int(sys.argv[i+1])
-                        res = pump.enable(pumpidx)
-                        if res:
-                            print("Power pump {}: enabled".format(pumpidx))
-                        else:
-                            print("Power pump {}: failed to enable".format(pumpidx))
-                        skipArg = 1
-                    if sys.argv[i].strip() == "off":
-                        pumpidx = int(sys.argv[i+1])
-                        res = pump.disable(pumpidx)
-                        if res:
-                            print("Power pump {}: standby".format(pumpidx))
-                        else:
-                            print("Power pump {}: failed to disable".format(pumpidx))
-                        skipArg = 1
-                    if sys.argv[i].strip() == "sleep":
-                        duration = int(sys.argv[i+1])
-                        time.sleep(duration)
-                        skipArg = 1
-    except Exception as e:
-        pass
+        if len(hosts) == 1:
+            address, port = splitHost(hosts[0], settings["port"])
+            ok = runSession(address, port, commands, script, "shell" in modes, settings["timing"])
+        else:
+            failed = runHosts(hosts, settings["port"], commands, script, settings["timing"], settings["parallel"])
+            if failed:
+                print("Failed on {} of {} controllers: {}".format(len(failed), len(hosts), " ".join(failed)))
+            ok = not failed
+    except KeyboardInterrupt:
+        ok = False
+
+    if not ok:
+        sys.exit(1)
 
 if __name__ == "__main__":
     gammaioncli()
@@ -1,34 +1,219 @@
 import socket
+import time
+
+from .framing import FramedReader, REPLY_DELIMITER, PROMPT_DELIMITER
+from .decoders import DECODERS, commandCode, isRead
+from .cache import INVALIDATING as CACHE_INVALIDATING
+from .snapshot import ChannelSnapshot, ControllerSnapshot, FIELD_PRESSURE, FIELD_VOLTAGE, \
+    FIELD_CURRENT, FIELD_HIGHVOLTAGE, FIELD_SUPPLYSTATUS
+
+# Getters whose readings are recorded into an attached PumpHistory
+HISTORY_METRICS = {
+    "getPressureWithUnits" : "pressure",
+    "getPressure" : "pressure",
+    "getVoltage" : "voltage",
+    "getCurrent" : "current"
+}
+
+class GammaIonPumpProtocol:
+    '''Transport independent part of the QPC protocol
+
+    Contains the reply decoding shared by the blocking and the asyncio
+    based client. The parse methods receive the raw reply frame as returned
+    by ``_transact`` (bytes including the trailing prompt) or ``False`` in
+    case no reply has been received. Decoding itself is done by the
+    command specific decoders in ``gammaionctl.decoders``.
+    '''
+    verbose = False
+
+    # Getter name -> (command code, parse method). Used to execute getters
+    # whose replies have been received by other means than sendCommand (for
+    # example as part of a pipelined batch)
+    QUERIES = {
+        "identify" : ("01", "_parseIdentity"),
+        "getPressureWithUnits" : ("0B", "_parsePressureWithUnits"),
+        "getPressure" : ("0B", "_parsePressure"),
+        "getVoltage" : ("0C", "_parseVoltage"),
+        "getCurrent" : ("0A", "_parseCurrent"),
+        "getPumpSize" : ("11", "_parsePumpSize"),
+        "getHighVoltageStatus" : ("61", "_parseHighVoltageStatus"),
+        "getSupplyStatus" : ("0D", "_parseSupplyStatus"),
+        "enable" : ("37", "_parseEnable"),
+        "disable" : ("38", "_parseDisable")
+    }
 
-class GammaIonPump:
-    def __init__(self, host, timeout=2, connection=None):
+    def setVerbose(self, verboseState):
+        self.verbose = verboseState
+
+    def _decodeReply(self, frame):
+        if frame is False:
+            return False
+
+        repl = frame[:-1].decode("utf-8").strip('>\n ')
+        if not repl.startswith("OK"):
+            if self.verbose:
+                print(f"Received error {repl}")
+            return False
+
+        return repl
+
+    def _decode(self, code, frame):
+        if frame is False:
+            return None
+
+        value = DECODERS[code].decode(frame)
+        if value is None and self.verbose:
+            print("Failed to decode reply {!r}".format(frame))
+        return value
+
+    def _parseIdentity(self, frame):
+        res = self._decode("01", frame)
+        if res is None:
+            return False
+        return res
+
+    def _parsePressureWithUnits(self, frame):
+        res = self._decode("0B", frame)
+        if res is None:
+            if self.verbose:
+                print("Failed to receive pressure information")
+            return False
+
+        pressure, units = res
+        if self.verbose:
+            print(f"Gamma QPC set to {units}")
+            if pressure is None:
+                print("Pump disabled or unavailable")
+            print(f"Received {pressure} {units}")
+        return res
+
+    def _checkPressureUnits(self, response, require_units):
+        if not isinstance(response, tuple):
+            return response
+        pressure, units = response
+
+        if units.lower() != require_units.lower():
+            if self.verbose:
+                print(f"Gamma QPC not set to {require_units}")
+            return False
+        return pressure
+
+    def _parsePressure(self, frame, require_units='mBar'):
+        return self._checkPressureUnits(self._parsePressureWithUnits(frame), require_units)
+
+    def _prepareQuery(self, request):
+        '''Translates a batch request into (command, parser, parser arguments)
+
+        A request is either a getter name (for controller wide queries like
+        ``identify``) or a tuple ``(getter, pumpIndex, *extra)`` - extra
+        arguments are passed to the parser (for example the required units
+        of ``getPressure``).
+        '''
+        if isinstance(request, str):
+            request = (request,)
+        name = request[0]
+        if name not in self.QUERIES:
+            raise ValueError("Unsupported batch command {}".format(name))
+        code, parser = self.QUERIES[name]
+        if len(request) > 1:
+            code = code + " " + str(request[1])
+        return code, getattr(self, parser), request[2:]
+
+    def _parseEnable(self, frame):
+        res = self._decode("37", frame)
+        if self.verbose:
+            if res is None:
+                print("Enabling pump failed")
+
+        return res is not None
+
+    def _parseDisable(self, frame):
+        res = self._decode("38", frame)
+        if self.verbose:
+            if res is None:
+                print("Disabling pump failed")
+
+        return res is not None
+
+    def _parseVoltage(self, frame):
+        res = self._decode("0C", frame)
+        if res is None:
+            if self.verbose:
+                print("Requesting voltage failed")
+        return res
+
+    def _parseCurrent(self, frame):
+        res = self._decode("0A", frame)
+        if res is None:
+            if self.verbose:
+                print("Requesting current failed")
+        return res
+
+    def _parsePumpSize(self, frame):
+        res = self._decode("11", frame)
+        if res is None:
+            if self.verbose:
+                print("Requesting pump size failed")
+        return res
+
+    def _parseHighVoltageStatus(self, frame):
+        status = self._decode("61", frame)
+        if status is None:
+            if self.verbose:
+                print("Request if high voltage is enabled failed")
+            return None
+
+        if self.verbose:
+            print(f"High voltage {'is' if status else 'is not'} on")
+
+        return status
+
+    def _parseSupplyStatus(self, frame):
+        res = self._decode("0D", frame)
+        if res is None:
+            if self.verbose:
+                print("Requesting supply status failed")
+        return res
+
+class GammaIonPump(GammaIonPumpProtocol):
+    def __init__(self, host, timeout=2, connection=None, pipelining=True, port=23):
         self.sock = False
         self.host = host
+        self.port = port
         self.verbose = False
-
-        if host is not None:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(timeout)
-            self.sock.connect((host, 23))
-        elif connection is not None:
-            self.sock = connection
-        else:
+        self.reader = None
+        self.pipelining = pipelining
+        self.history = None
+        self.cache = None
+        self.channelMap = None
+        self.instrumentation = None
+        self.timeout = timeout
+
+        if host is None and connection is None:
             raise ConnectionError("Failed to Connect to ion pump:\
                                               No host or connection provided")
 
-        # Wait for initial prompt
-        while True:
-            chunk = self.sock.recv(1)
-            if chunk == b'':
-                self.sock.close()
+        self._connect(connection)
+
+    def _connect(self, connection=None):
+        '''Opens the connection (or adopts the passed one) and waits for the prompt'''
+        if self.host is not None:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), self.timeout)
+            except OSError:
                 self.sock = False
-                raise ConnectionError("Failed to Connect to ion pump:\
-                                Failed to connect to pump at specified IP")
-            if chunk.decode("utf-8") == ">":
-                break
+                raise
+        else:
+            self.sock = connection
 
-    def setVerbose(self, verboseState):
-        self.verbose = verboseState
+        self.reader = FramedReader(self.sock)
+
+        # Wait for initial prompt
+        if self.reader.readFrame(PROMPT_DELIMITER) is None:
+            self.sock.close()
+            self.sock = False
+            raise ConnectionError("Failed to Connect to ion pump:\
+                                Failed to connect to pump at specified IP")
 
     def __enter__(self):
         return self
@@ -48,6 +233,49 @@ class GammaIonPump:
             self.sock = False
 
     def sendCommand(self, command):
+        '''Transmits a raw spc command and returns the reply
+
+        Returns:
+            the reply string (starting with OK) or
+            False in case of an error reply or communication error
+        '''
+        return self._decodeReply(self._transact(command))
+
+    def sendCommands(self, commands):
+        '''Transmits raw spc commands as one batch (pipelined if enabled)
+
+        Unlike sendCommand error replies are returned as well, so callers can
+        tell a rejected command from one that has not been answered.
+
+        Returns:
+            list with one entry per command - the reply string (starting with
+            OK or ER) or False if no reply has been received
+        '''
+        replies = []
+        for frame in self._sendBatch(list(commands)):
+            if frame is False:
+                replies.append(False)
+            else:
+                replies.append(frame[:-1].decode("utf-8", "replace").strip('>\r\n '))
+        return replies
+
+    def _transact(self, command):
+        '''Returns the raw reply frame for a command or False
+
+        The reply is served from the attached cache if possible, otherwise
+        the command is transmitted to the controller.
+        '''
+        if self.cache is None:
+            return self._exchange(command)
+
+        frame = self.cache.get(command)
+        if frame is None:
+            frame = self._exchange(command)
+            self.cache.store(command, frame)
+        return frame
+
+    def _exchange(self, command):
+        '''Transmits a command and returns the raw reply frame or False'''
         if self.verbose:
             print("Sending command {}".format(command))
         if not self.sock:
@@ -56,41 +284,294 @@ class GammaIonPump:
             raise ConnectionError("Failed to Connect to ion pump:\
                                             Pump controller not connected")
 
-        # Transmit command:
-        self.sock.send(('spc '+command+"\r\n").encode())
-
-        # Wait for reply and read till next prompt
-        repl = ''
-        while True:
-            chunk = self.sock.recv(1)
-            if chunk == b'':
-                if self.verbose:
-                    print('Failed to receive')
-                self.sock.close()
-                self.sock = False
-                return False
-            if repl.endswith('\r\r'):
-                break
-            repl = repl + chunk.decode("utf-8")
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
+            recvCalls = self.reader.recvCalls
 
-        repl = repl.strip('>\n ')
-        if not repl.startswith("OK"):
+        # Transmit command:
+        request = ('spc '+command+"\r\n").encode()
+        try:
+            self.sock.send(request)
+
+            # Wait for reply and read till next prompt
+            frame = self.reader.readFrame(REPLY_DELIMITER)
+        except OSError as e:
+            if instrumentation is not None:
+                instrumentation.commandFailed(self.host, command, time.perf_counter() - start, len(request),
+                                              self.reader.recvCalls - recvCalls, "{}: {}".format(type(e).__name__, e))
+            raise
+
+        if frame is None:
             if self.verbose:
-                print(f"Received error {repl}")
+                print('Failed to receive')
+            if instrumentation is not None:
+                instrumentation.commandFailed(self.host, command, time.perf_counter() - start, len(request),
+                                              self.reader.recvCalls - recvCalls, "Connection closed")
+                instrumentation.disconnected(self.host, "Connection closed")
+            self.sock.close()
+            self.sock = False
             return False
 
-        return repl
+        if instrumentation is not None:
+            instrumentation.commandCompleted(self.host, command, time.perf_counter() - start, len(request),
+                                             frame, self.reader.recvCalls - recvCalls)
+        return frame
+
+    def setPipelining(self, enabled):
+        self.pipelining = enabled
+
+    def setCache(self, cache):
+        '''Attaches a CommandCache (or None to disable caching)'''
+        self.cache = cache
+
+    def setChannelMap(self, channelMap):
+        '''Attaches a ChannelMap (or None to detach). ``snapshot`` then only
+        reads the populated channels, the map is refreshed incrementally'''
+        self.channelMap = channelMap
+
+    def setInstrumentation(self, instrumentation):
+        '''Attaches an Instrumentation collector (or None to disable)'''
+        self.instrumentation = instrumentation
+
+    def setHistory(self, history):
+        '''Attaches a PumpHistory (or None to detach) that records all
+        pressure, current and voltage readings of this session'''
+        self.history = history
+
+    def _record(self, metric, pumpIndex, value, units=None):
+        self.history.append(metric, pumpIndex, time.time(), value, units)
+
+    def _recordReading(self, metric, pumpIndex, code, frame):
+        '''Records the reply frame of a getter
+
+        Only replies that decode (OK replies) are recorded - error replies,
+        timeouts and malformed replies are not, so a missing value (NaN) in
+        the history always means the reading was not available, for example
+        for a disabled pump. Pressures are recorded as reported by the
+        controller together with their units - independent of the units
+        required by getPressure - so direct and batched getters record the
+        same values.
+        '''
+        reading = self._decode(code, frame)
+        if reading is None:
+            return
+        units = None
+        if isinstance(reading, tuple):
+            reading, units = reading
+        self._record(metric, pumpIndex, reading, units)
+
+    def _recordSnapshot(self, snapshot):
+        self.history.recordSnapshot(snapshot)
+
+    def _sendPipelined(self, commands):
+        '''Transmits all commands at once and collects their replies in order
+
+        Returns the list of raw reply frames. In case the controller stops
+        answering (i.e. the socket times out) pipelining is assumed to be
+        unsupported by the firmware: it gets disabled for this session, late
+        replies are drained until the line stays quiet for one timeout and the
+        unanswered queries are repeated in strict request/response mode.
+        Unanswered enable / disable commands are never repeated (the
+        controller may have executed them), they are reported as failed.
+        '''
+        if self.verbose:
+            print("Sending {} pipelined commands".format(len(commands)))
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
+            recvCalls = self.reader.recvCalls
+        self.sock.send(b''.join([ ('spc '+command+"\r\n").encode() for command in commands ]))
+
+        replies = []
+        try:
+            while len(replies) < len(commands):
+                frame = self.reader.readFrame(REPLY_DELIMITER)
+                if frame is None:
+                    if self.verbose:
+                        print('Failed to receive')
+                    if instrumentation is not None:
+                        self._instrumentPipelined(commands[len(replies):], None, start, recvCalls)
+                        instrumentation.disconnected(self.host, "Connection closed")
+                    self.sock.close()
+                    self.sock = False
+                    return replies + [ False ] * (len(commands) - len(replies))
+                replies.append(frame)
+                if instrumentation is not None:
+                    recvCalls = self._instrumentPipelined(commands[len(replies)-1:len(replies)], frame, start, recvCalls)
+        except socket.timeout:
+            if self.verbose:
+                print("Pipelined request timed out, falling back to request/response mode")
+            if instrumentation is not None:
+                self._instrumentPipelined(commands[len(replies):], None, start, recvCalls)
+            self.pipelining = False
+            self._drain()
+            for command in commands[len(replies):]:
+                if self.sock and isRead(command):
+                    replies.append(self._exchange(command))
+                else:
+                    replies.append(False)
+
+        return replies
+
+    def _drain(self):
+        '''Discards buffered and late replies until the controller has been
+        quiet for one socket timeout'''
+        self.reader.discard()
+        try:
+            while True:
+                if not self.sock.recv(4096):
+                    self.sock.close()
+                    self.sock = False
+                    return
+        except socket.timeout:
+            pass
+
+    def _instrumentPipelined(self, commands, frame, start, recvCalls):
+        '''Records pipelined commands, the latency is measured from the common
+        send. Returns the current recv call counter.'''
+        latency = time.perf_counter() - start
+        current = self.reader.recvCalls
+        for command in commands:
+            sent = len(command) + 6
+            if frame is None:
+                self.instrumentation.commandFailed(self.host, command, latency, sent, current - recvCalls, "No reply")
+            else:
+                self.instrumentation.commandCompleted(self.host, command, latency, sent, frame, current - recvCalls)
+            recvCalls = current
+        return current
+
+    def batch(self, requests):
+        '''Executes a sequence of getters with as few round trips as possible
+
+        Requests are given as getter names or tuples ``(getter, pumpIndex)``
+        like ``[ "identify", ("getPressure", 1), ("getCurrent", 1) ]``. All
+        commands are written to the controller at once and the replies are
+        matched to the commands in order (unless pipelining has been
+        disabled, then every command is executed on its own).
+
+        Returns:
+            list with one result per request - exactly what the corresponding
+            getter would have returned, so failures of single commands do
+            not affect the other results.
+        '''
+        queries = [ self._prepareQuery(request) for request in requests ]
+        replies = self._sendBatch([ command for command, _, _ in queries ])
+        results = [ parser(repl, *extra) for (_, parser, extra), repl in zip(queries, replies) ]
+
+        if self.history is not None:
+            for request, (command, _, _), repl in zip(requests, queries, replies):
+                if isinstance(request, tuple) and len(request) > 1 and request[0] in HISTORY_METRICS:
+                    self._recordReading(HISTORY_METRICS[request[0]], request[1], commandCode(command), repl)
+        return results
+
+    def _sendBatch(self, commands):
+        if not self.sock:
+            if self.verbose:
+                print("Pump controller not connected")
+            raise ConnectionError("Failed to Connect to ion pump:\
+                                            Pump controller not connected")
+
+        if self.cache is None:
+            return self._sendUncached(commands)
+
+        # Serve what is possible from the cache. Commands following an
+        # enable or disable of the same channel are always transmitted
+        replies = []
+        missing = []
+        switched = set()
+        for n, command in enumerate(commands):
+            code, _, channel = command.partition(" ")
+            frame = None
+            if code in CACHE_INVALIDATING:
+                switched.add(channel)
+            elif channel not in switched:
+                frame = self.cache.get(command)
+            if frame is None:
+                missing.append(n)
+            replies.append(frame)
+
+        if missing:
+            fetched = self._sendUncached([ commands[n] for n in missing ])
+            for n, frame in zip(missing, fetched):
+                self.cache.store(commands[n], frame)
+                replies[n] = frame
+        return replies
+
+    def _sendUncached(self, commands):
+        if self.pipelining and len(commands) > 1:
+            return self._sendPipelined(commands)
+
+        replies = []
+        for command in commands:
+            replies.append(self._exchange(command) if self.sock else False)
+        return replies
+
+    def snapshot(self, pumps=None):
+        '''Reads pressure, voltage, current, high voltage and supply status of
+        all given pumps as a single pipelined batch
+
+        If no pumps are given the populated channels of the attached
+        ChannelMap (all four channels without a map) are read.
+
+        Returns:
+            ControllerSnapshot with one ChannelSnapshot per pump. Values that
+            could not be read are None, failed replies are flagged in the
+            errors bitmask of the channel.
+        '''
+        if pumps is None:
+            if self.channelMap is not None:
+                self.channelMap.refresh(self)
+                pumps = self.channelMap.populated
+            else:
+                pumps = (1, 2, 3, 4)
+
+        timestamp = time.time()
+        commands = []
+        for pumpIndex in pumps:
+            idx = str(pumpIndex)
+            commands.extend(('0B '+idx, '0C '+idx, '0A '+idx, '61 '+idx, '0D '+idx))
+        replies = self._sendBatch(commands)
+
+        channels = []
+        for n, pumpIndex in enumerate(pumps):
+            repl = replies[5*n:5*n+5]
+
+            pressure = self._parsePressureWithUnits(repl[0])
+            if isinstance(pressure, tuple):
+                pressure, units = pressure
+            else:
+                pressure, units = None, None
+            channel = ChannelSnapshot(
+                pumpIndex,
+                pressure = pressure,
+                units = units,
+                voltage = self._parseVoltage(repl[1]),
+                current = self._parseCurrent(repl[2]),
+                highVoltage = self._parseHighVoltageStatus(repl[3]),
+                supplyStatus = self._parseSupplyStatus(repl[4])
+            )
+
+            # Every field except the pressure (None for disabled pumps) is
+            # only None in case of a failed or malformed reply
+            if units is None:
+                channel.errors = FIELD_PRESSURE
+            for bit, value in ((FIELD_VOLTAGE, channel.voltage), (FIELD_CURRENT, channel.current),
+                               (FIELD_HIGHVOLTAGE, channel.highVoltage), (FIELD_SUPPLYSTATUS, channel.supplyStatus)):
+                if value is None:
+                    channel.errors = channel.errors | bit
+            channels.append(channel)
+
+        snap = ControllerSnapshot(self.host, timestamp, tuple(channels), bool(self.sock))
+        if self.history is not None:
+            self._recordSnapshot(snap)
+        return snap
 
     def identify(self):
         if self.verbose:
             print("Requesting identity of pump controller")
 
-        res = self.sendCommand('01')
-        if res is False:
-            return False
-
-        # Parse result
-        return res[6:].strip()
+        return self._parseIdentity(self._transact('01'))
 
     def getPressureWithUnits(self, pumpIndex):
         '''Reads ion pump pressure
@@ -103,115 +584,50 @@ class GammaIonPump:
         if self.verbose:
             print("Requesting pressure for pump {}".format(pumpIndex))
 
-        repl = self.sendCommand('0B '+str(pumpIndex))
-
-        if repl is False:
-            if self.verbose:
-                print("Failed to receive pressure information")
-            return False
-
-        repl = repl.split(" ")
-
-        if len(repl) < 4:
-            if self.verbose:
-                print("Failed to read response from GammaQPC")
-            return False
-
-        units = repl[3].strip()
-        if self.verbose:
-            print(f"Gamma QPC set to {units}")
-
-        pressure = float(repl[2])
-        if pressure == 1.3e-11:
-            if self.verbose:
-                print("Pump disabled or unavailable")
-            pressure = None
+        frame = self._transact('0B '+str(pumpIndex))
+        if self.history is not None:
+            self._recordReading("pressure", pumpIndex, "0B", frame)
+        return self._parsePressureWithUnits(frame)
 
-        if self.verbose:
-            print(f"Received {pressure} {units}")
-        return pressure, units
-    
     def getPressure(self, pumpIndex, require_units='mBar'):
         '''Returns pump pressure in requred units'''
-        response = self.getPressureWithUnits(pumpIndex)
-        if not isinstance(response, tuple):
-            return response
-        pressure, units = response
-
-        if units.lower() != require_units.lower():
-            if self.verbose:
-                print(f"Gamma QPC not set to {require_units}")
-            return False
-        return pressure
+        return self._checkPressureUnits(self.getPressureWithUnits(pumpIndex), require_units)
 
     def enable(self, pumpIndex):
         if self.verbose:
             print("Request enabling pump {}".format(pumpIndex))
 
-        repl = self.sendCommand('37 '+str(pumpIndex))
-        if self.verbose:
-            if repl is False:
-                print("Enabling pump failed")
-
-        return repl is not False
+        return self._parseEnable(self._transact('37 '+str(pumpIndex)))
 
     def disable(self, pumpIndex):
         if self.verbose:
             print("Request disabling pump {}".format(pumpIndex))
 
-        repl = self.sendCommand('38 '+str(pumpIndex))
-        if self.verbose:
-            if repl is False:
-                print("Disabling pump failed")
-
-        return repl is not False
+        return self._parseDisable(self._transact('38 '+str(pumpIndex)))
 
     def getVoltage(self, pumpIndex):
         if self.verbose:
             print("Requesting voltage for pump {}".format(pumpIndex))
 
-        repl = self.sendCommand('0C '+str(pumpIndex))
-        if repl is False:
-            if self.verbose:
-                print("Requesting voltage failed")
-            return None
-
-        # Parse response
-        return int(repl[6:])
+        frame = self._transact('0C '+str(pumpIndex))
+        if self.history is not None:
+            self._recordReading("voltage", pumpIndex, "0C", frame)
+        return self._parseVoltage(frame)
 
     def getCurrent(self, pumpIndex):
         if self.verbose:
             print("Requesting current for pump {}".format(pumpIndex))
 
-        repl = self.sendCommand('0A '+str(pumpIndex))
-        if repl is False:
-            if self.verbose:
-                print("Requesting current failed")
-            return None
-
-        repl = repl.split(" ")
-        if (repl[3].strip()) != "AMPS":
-            if self.verbose:
-                print("Failed to decode QPC reply, unit was "+repl[3])
-            return None
-        return float(repl[2].strip())
+        frame = self._transact('0A '+str(pumpIndex))
+        if self.history is not None:
+            self._recordReading("current", pumpIndex, "0A", frame)
+        return self._parseCurrent(frame)
 
     def getPumpSize(self, pumpIndex):
         if self.verbose:
             print("Requesting pump size for pump {}".format(pumpIndex))
 
-        repl = self.sendCommand('11 '+str(pumpIndex))
-        if repl is False:
-            if self.verbose:
-                print("Requesting pump size")
-            return None
-
-        repl = repl.split(" ")
-        if (repl[3].strip()) != "L/S":
-            if self.verbose:
-                print("QPC unit for pump size not L/S but "+repl[3])
-            return None
-        return float(repl[2].strip())
+        return self._parsePumpSize(self._transact('11 '+str(pumpIndex)))
 
     def getHighVoltageStatus(self, pumpIndex):
         '''Reads ion pump high voltages status
@@ -223,33 +639,10 @@ class GammaIonPump:
         if self.verbose:
             print("Requesting if high voltage is enabled for pump {}".format(pumpIndex))
 
-        repl = self.sendCommand(f"61 {pumpIndex}")
-        if repl is False:
-            if self.verbose:
-                print("Request if high voltage is enabled failed")
-            return None
-
-        repl = repl.strip()
-        if repl.endswith("YES"):
-            status = True
-        elif repl.endswith("NO"):
-            status = False
-        else:
-            return None
-
-        if self.verbose and status is not None:
-            print(f"High voltage {'is' if status else 'is not'} on")
-
-        return status
+        return self._parseHighVoltageStatus(self._transact(f"61 {pumpIndex}"))
 
     def getSupplyStatus(self, pumpIndex):
         if self.verbose:
             print("Requesting supply status for pump {}".format(pumpIndex))
 
-        repl = self.sendCommand('0D '+str(pumpIndex))
-        if repl is False:
-            if self.verbose:
-                print("Requesting pump size")
-            return None
-
-        return repl[6:].strip()
+        return self._parseSupplyStatus(self._transact('0D '+str(pumpIndex)))
@@ -0,0 +1,275 @@
+'''Bounded in-memory history of pump readings
+
+``PumpHistory`` keeps the readings of every (metric, channel) pair in two
+fixed size ring buffers backed by ``array('d')``:
+
+* ``RingSeries`` holds the raw samples (timestamp and value, 16 bytes per
+  sample) of the most recent ``capacity`` readings
+* ``RollupSeries`` aggregates the readings into fixed width buckets
+  (min, max, mean and count, 40 bytes per bucket) for long term history
+
+With the defaults (one hour of raw 1 Hz samples, one week of one minute
+buckets) pressure, current and voltage of four channels use less than
+7 MB independent of how long the process runs. Appending is O(1), windows
+are returned as ``memoryview`` segments of the underlying arrays without
+copying. Readings that are not available (``None``, for example disabled
+pumps) are stored as NaN and ignored by all statistics, failed reads are
+not stored at all. Pressures are stored
+in the units reported by the controller, the units of the latest reading
+are available from ``units``.
+'''
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .snapshot import FIELD_PRESSURE, FIELD_CURRENT, FIELD_VOLTAGE
+
+DEFAULT_METRICS = ("pressure", "current", "voltage")
+
+class RingSeries:
+    '''Fixed capacity ring buffer of (timestamp, value) samples
+
+    Timestamps are expected to be appended in non decreasing order.
+    '''
+    __slots__ = ('capacity', 'timestamps', 'values', '_head', '_count')
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Capacity has to be at least 1")
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        self.timestamps[self._head] = timestamp
+        self.values[self._head] = math.nan if value is None else value
+        self._head = self._head + 1
+        if self._head == self.capacity:
+            self._head = 0
+        if self._count < self.capacity:
+            self._count = self._count + 1
+
+    def latest(self):
+        '''Returns the most recent (timestamp, value) or None'''
+        if self._count == 0:
+            return None
+        n = self._head - 1 if self._head > 0 else self.capacity - 1
+        return self.timestamps[n], self.values[n]
+
+    def _ranges(self):
+        '''Index ranges of the stored samples in chronological order'''
+        if self._count < self.capacity:
+            return ((0, self._count),)
+        if self._head == 0:
+            return ((0, self.capacity),)
+        return ((self._head, self.capacity), (0, self._head))
+
+    def segments(self, start=None, end=None):
+        '''Returns the samples with start <= timestamp <= end
+
+        The result is a list of up to two (timestamps, values) memoryview
+        pairs in chronological order. The views reference the ring buffer
+        directly - they are only valid until the next append overwrites
+        the referenced slots.
+        '''
+        ts = memoryview(self.timestamps)
+        vs = memoryview(self.values)
+        result = []
+        for lo, hi in self._ranges():
+            if start is not None:
+                lo = bisect_left(ts, start, lo, hi)
+            if end is not None:
+                hi = bisect_right(ts, end, lo, hi)
+            if hi > lo:
+                result.append((ts[lo:hi], vs[lo:hi]))
+        return result
+
+    def window(self, start=None, end=None):
+        '''Returns copies (timestamps, values) as contiguous arrays'''
+        timestamps, values = array('d'), array('d')
+        for ts, vs in self.segments(start, end):
+            timestamps.frombytes(ts.tobytes())
+            values.frombytes(vs.tobytes())
+        return timestamps, values
+
+    def stats(self, start=None, end=None):
+        '''Returns (min, max, mean, count) of the valid values in the window
+
+        min, max and mean are None if there is no valid value.
+        '''
+        lo, hi, total, count = math.inf, -math.inf, 0.0, 0
+        for _, vs in self.segments(start, end):
+            for v in vs:
+                if v == v:
+                    if v < lo:
+                        lo = v
+                    if v > hi:
+                        hi = v
+                    total = total + v
+                    count = count + 1
+        if count == 0:
+            return None, None, None, 0
+        return lo, hi, total / count, count
+
+    def downsample(self, width, start=None, end=None):
+        '''Aggregates the window into buckets of width seconds
+
+        Returns a list of (bucketStart, min, max, mean, count) for all
+        buckets containing at least one valid value.
+        '''
+        result = []
+        bucket = None
+        for ts, vs in self.segments(start, end):
+            for t, v in zip(ts, vs):
+                if v != v:
+                    continue
+                b = math.floor(t / width) * width
+                if bucket is None or b != bucket[0]:
+                    if bucket is not None:
+                        result.append((bucket[0], bucket[1], bucket[2], bucket[3] / bucket[4], bucket[4]))
+                    bucket = [ b, v, v, 0.0, 0 ]
+                if v < bucket[1]:
+                    bucket[1] = v
+                if v > bucket[2]:
+                    bucket[2] = v
+                bucket[3] = bucket[3] + v
+                bucket[4] = bucket[4] + 1
+        if bucket is not None:
+            result.append((bucket[0], bucket[1], bucket[2], bucket[3] / bucket[4], bucket[4]))
+        return result
+
+    def nbytes(self):
+        return (len(self.timestamps) + len(self.values)) * 8
+
+class RollupSeries:
+    '''Ring buffer of fixed width aggregation buckets (min, max, mean, count)'''
+    __slots__ = ('width', 'capacity', 'starts', 'mins', 'maxs', 'sums', 'counts', '_head', '_count')
+
+    def __init__(self, width, capacity):
+        if capacity < 1:
+            raise ValueError("Capacity has to be at least 1")
+        self.width = width
+        self.capacity = capacity
+        self.starts = array('d', bytes(8 * capacity))
+        self.mins = array('d', bytes(8 * capacity))
+        self.maxs = array('d', bytes(8 * capacity))
+        self.sums = array('d', bytes(8 * capacity))
+        self.counts = array('d', bytes(8 * capacity))
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        if value is None or value != value:
+            return
+        bucket = math.floor(timestamp / self.width) * self.width
+        current = self._head - 1 if self._head > 0 else self.capacity - 1
+        if self._count > 0 and self.starts[current] == bucket:
+            if value < self.mins[current]:
+                self.mins[current] = value
+            if value > self.maxs[current]:
+                self.maxs[current] = value
+            self.sums[current] = self.sums[current] + value
+            self.counts[current] = self.counts[current] + 1
+            return
+
+        n = self._head
+        self.starts[n] = bucket
+        self.mins[n] = value
+        self.maxs[n] = value
+        self.sums[n] = value
+        self.counts[n] = 1
+        self._head = n + 1 if n + 1 < self.capacity else 0
+        if self._count < self.capacity:
+            self._count = self._count + 1
+
+    def buckets(self, start=None, end=None):
+        '''Returns (bucketStart, min, max, mean, count) tuples in chronological order'''
+        if self._count < self.capacity:
+            order = range(0, self._count)
+        else:
+            order = list(range(self._head, self.capacity)) + list(range(0, self._head))
+        result = []
+        for n in order:
+            t = self.starts[n]
+            if (start is not None and t + self.width <= start) or (end is not None and t > end):
+                continue
+            result.append((t, self.mins[n], self.maxs[n], self.sums[n] / self.counts[n], int(self.counts[n])))
+        return result
+
+    def nbytes(self):
+        return 5 * 8 * self.capacity
+
+class PumpHistory:
+    '''Bounded history of readings per metric and channel
+
+    Parameters:
+        capacity        Number of raw samples kept per series
+        channels        Pump indices to keep history for
+        metrics         Metric names (pressure, current, voltage)
+        rollupWidth     Width of the aggregation buckets in seconds (None to
+                        disable aggregation)
+        rollupCapacity  Number of buckets kept per series
+    '''
+    def __init__(self, capacity=3600, channels=(1, 2, 3, 4), metrics=DEFAULT_METRICS,
+                 rollupWidth=60, rollupCapacity=7*24*60):
+        self.channels = tuple(channels)
+        self.metrics = tuple(metrics)
+        self._series = {}
+        self._rollups = {}
+        self._units = {}
+        for metric in self.metrics:
+            for channel in self.channels:
+                self._series[(metric, channel)] = RingSeries(capacity)
+                if rollupWidth is not None:
+                    self._rollups[(metric, channel)] = RollupSeries(rollupWidth, rollupCapacity)
+
+    def append(self, metric, channel, timestamp, value, units=None):
+        '''Records a reading, ignores metrics and channels not tracked'''
+        series = self._series.get((metric, channel))
+        if series is None:
+            return
+        series.append(timestamp, value)
+        if units is not None:
+            self._units[(metric, channel)] = units
+        rollup = self._rollups.get((metric, channel))
+        if rollup is not None:
+            rollup.append(timestamp, value)
+
+    def recordSnapshot(self, snapshot):
+        '''Records all channels of a ControllerSnapshot, fields that failed
+        to read are skipped'''
+        for channel in snapshot.channels:
+            if not channel.errors & FIELD_PRESSURE:
+                self.append("pressure", channel.pumpIndex, snapshot.timestamp, channel.pressure, channel.units)
+            if not channel.errors & FIELD_CURRENT:
+                self.append("current", channel.pumpIndex, snapshot.timestamp, channel.current)
+            if not channel.errors & FIELD_VOLTAGE:
+                self.append("voltage", channel.pumpIndex, snapshot.timestamp, channel.voltage)
+
+    def series(self, metric, channel):
+        return self._series[(metric, channel)]
+
+    def rollup(self, metric, channel):
+        return self._rollups[(metric, channel)]
+
+    def units(self, metric, channel):
+        '''Units of the latest reading that reported units (or None)'''
+        return self._units.get((metric, channel))
+
+    def latest(self, metric, channel):
+        return self._series[(metric, channel)].latest()
+
+    def stats(self, metric, channel, start=None, end=None):
+        return self._series[(metric, channel)].stats(start, end)
+
+    def nbytes(self):
+        '''Memory used by the sample buffers in bytes'''
+        return sum(s.nbytes() for s in self._series.values()) + sum(r.nbytes() for r in self._rollups.values())
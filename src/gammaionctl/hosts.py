@@ -0,0 +1,43 @@
+'''Controller addresses as given on the command line or in hosts files
+
+A controller is specified as ``address``, ``address:port`` or - for IPv6
+literals - ``[address]:port``. A bare IPv6 literal (more than one colon
+without brackets) never carries a port:
+
+    splitHost("10.0.0.11:2323")     -> ("10.0.0.11", 2323)
+    splitHost("[fd00::11]:2323")    -> ("fd00::11", 2323)
+    splitHost("fd00::11")           -> ("fd00::11", 23)
+'''
+DEFAULT_PORT = 23
+
+def splitHost(host, port=DEFAULT_PORT):
+    '''Splits a host specification, returns (address, port)
+
+    ``port`` is used if the specification does not contain a port.
+    Specifications that cannot be split are returned unchanged.
+    '''
+    if host.startswith("["):
+        address, sep, rest = host[1:].partition("]")
+        if sep and not rest:
+            return address, port
+        if sep and rest.startswith(":") and rest[1:].isdigit():
+            return address, int(rest[1:])
+        return host, port
+
+    address, sep, hostPort = host.partition(":")
+    if sep and (":" not in hostPort) and hostPort.isdigit():
+        return address, int(hostPort)
+    return host, port
+
+def readHostsFile(filename):
+    '''Reads one host per line, empty lines and everything after # are ignored
+
+    Raises OSError if the file cannot be read.
+    '''
+    hosts = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                hosts.append(line)
+    return hosts
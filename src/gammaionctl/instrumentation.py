@@ -0,0 +1,201 @@
+'''Structured per command instrumentation
+
+``Instrumentation`` collects, per controller and command code, a latency
+histogram, the number of commands, error replies (anything not starting
+with ``OK``), failures (timeouts and socket errors), bytes sent and
+received and the number of ``recv`` calls, plus the number of disconnects
+per controller. It is attached to one or more ``GammaIonPump`` sessions
+with ``setInstrumentation`` - without an attached instance the only cost
+is a single attribute check per command.
+
+Hooks are callables receiving a ``CommandEvent`` after every command (and
+on every disconnect with ``code`` set to None), for example to forward
+slow commands to a logger. ``snapshot`` returns all counters as a plain
+dictionary that can be serialized as JSON.
+'''
+import threading
+from bisect import bisect_left
+
+from .decoders import commandCode
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class LatencyHistogram:
+    '''Latency histogram with fixed bucket bounds
+
+    The counts are per bucket (not cumulative): ``counts[n]`` counts the
+    latencies <= ``bounds[n]`` that did not fit into a previous bucket, the
+    last entry counts everything above the last bound. Exporters that need
+    cumulative buckets (Prometheus ``_bucket`` series) sum them up.
+    '''
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'maximum')
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [ 0 ] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, latency):
+        self.counts[bisect_left(self.bounds, latency)] += 1
+        self.count = self.count + 1
+        self.total = self.total + latency
+        if latency > self.maximum:
+            self.maximum = latency
+
+    def percentile(self, p):
+        '''Upper bound of the bucket containing the p-th percentile (or None)'''
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen = seen + count
+            if seen >= rank and count > 0:
+                return self.bounds[n] if n < len(self.bounds) else self.maximum
+        return self.maximum
+
+    def asDict(self):
+        return {
+            "bounds" : list(self.bounds),
+            "counts" : list(self.counts),
+            "count" : self.count,
+            "sum" : self.total,
+            "max" : self.maximum,
+            "p50" : self.percentile(50),
+            "p99" : self.percentile(99)
+        }
+
+class CommandStatistics:
+    '''Counters of one command code on one controller'''
+    __slots__ = ('latency', 'commands', 'errors', 'failures', 'bytesSent', 'bytesReceived', 'recvCalls')
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.latency = LatencyHistogram(bounds)
+        self.commands = 0
+        self.errors = 0
+        self.failures = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.recvCalls = 0
+
+    def asDict(self):
+        return {
+            "commands" : self.commands,
+            "errors" : self.errors,
+            "failures" : self.failures,
+            "bytesSent" : self.bytesSent,
+            "bytesReceived" : self.bytesReceived,
+            "recvCalls" : self.recvCalls,
+            "latency" : self.latency.asDict()
+        }
+
+class CommandEvent:
+    '''Passed to the hooks after every command and on disconnects
+
+    ``ok`` is True for OK replies, False for error replies and None if no
+    reply has been received (``error`` then describes the failure).
+    '''
+    __slots__ = ('host', 'code', 'latency', 'bytesSent', 'bytesReceived', 'recvCalls', 'ok', 'error')
+
+    def __init__(self, host, code, latency=None, bytesSent=0, bytesReceived=0, recvCalls=0, ok=None, error=None):
+        self.host = host
+        self.code = code
+        self.latency = latency
+        self.bytesSent = bytesSent
+        self.bytesReceived = bytesReceived
+        self.recvCalls = recvCalls
+        self.ok = ok
+        self.error = error
+
+class Instrumentation:
+    '''Thread safe collector shared by any number of pump sessions
+
+    Parameters:
+        bounds      Latency histogram bucket bounds in seconds
+    '''
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.hooks = []
+        self._lock = threading.Lock()
+        self._commands = {}
+        self._disconnects = {}
+
+    def addHook(self, hook):
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        self.hooks.remove(hook)
+
+    def _statistics(self, host, code):
+        key = (host, code)
+        statistics = self._commands.get(key)
+        if statistics is None:
+            statistics = CommandStatistics(self.bounds)
+            self._commands[key] = statistics
+        return statistics
+
+    def commandCompleted(self, host, command, latency, bytesSent, frame, recvCalls):
+        '''Records a command that received a reply frame'''
+        code = commandCode(command)
+        ok = frame.lstrip(b'>\n ').startswith(b'OK')
+        with self._lock:
+            statistics = self._statistics(host, code)
+            statistics.commands = statistics.commands + 1
+            statistics.bytesSent = statistics.bytesSent + bytesSent
+            statistics.bytesReceived = statistics.bytesReceived + len(frame)
+            statistics.recvCalls = statistics.recvCalls + recvCalls
+            statistics.latency.observe(latency)
+            if not ok:
+                statistics.errors = statistics.errors + 1
+        if self.hooks:
+            self._fire(CommandEvent(host, code, latency, bytesSent, len(frame), recvCalls, ok))
+
+    def commandFailed(self, host, command, latency, bytesSent, recvCalls, error):
+        '''Records a command that did not receive a reply (timeout, socket error, EOF)'''
+        code = commandCode(command)
+        with self._lock:
+            statistics = self._statistics(host, code)
+            statistics.commands = statistics.commands + 1
+            statistics.failures = statistics.failures + 1
+            statistics.bytesSent = statistics.bytesSent + bytesSent
+            statistics.recvCalls = statistics.recvCalls + recvCalls
+        if self.hooks:
+            self._fire(CommandEvent(host, code, latency, bytesSent, 0, recvCalls, None, error))
+
+    def disconnected(self, host, error=None):
+        with self._lock:
+            self._disconnects[host] = self._disconnects.get(host, 0) + 1
+        if self.hooks:
+            self._fire(CommandEvent(host, None, error=error))
+
+    def _fire(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def statistics(self, host, code):
+        '''Returns the CommandStatistics of a controller and command code or None'''
+        return self._commands.get((host, code))
+
+    def disconnects(self, host):
+        return self._disconnects.get(host, 0)
+
+    def snapshot(self):
+        '''Returns all counters as ``{"hosts" : {host : {"disconnects" : n,
+        "commands" : {code : {...}}}}}``'''
+        with self._lock:
+            hosts = {}
+            for (host, code), statistics in self._commands.items():
+                entry = hosts.setdefault(str(host), { "disconnects" : 0, "commands" : {} })
+                entry["commands"][code] = statistics.asDict()
+            for host, count in self._disconnects.items():
+                entry = hosts.setdefault(str(host), { "disconnects" : 0, "commands" : {} })
+                entry["disconnects"] = count
+        return { "bounds" : list(self.bounds), "hosts" : hosts }
+
+    def reset(self):
+        with self._lock:
+            self._commands = {}
+            self._disconnects = {}
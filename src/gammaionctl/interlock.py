@@ -0,0 +1,261 @@
+'''Threshold interlocks that disable (and optionally re-enable) pumps
+
+An ``InterlockEngine`` evaluates readings against ``InterlockRule``s and
+switches pumps as soon as a rule trips:
+
+* hysteresis - a rule trips when the value passes ``limit`` and clears
+  only after it returned past ``clearLimit``
+* debounce - a rule only trips (or clears) after ``debounce`` consecutive
+  readings beyond the limit, single outliers are ignored
+* pressure readings that are not available (None, for example a disabled
+  pump) do not change the state of a rule; error replies (False, or None
+  for current and voltage) count as a breach for rules created with
+  ``tripOnError``
+* pressures are read with their units and converted into the unit of the
+  engine (``units``, mbar by default) the limits are given in. A pressure
+  in an unknown unit is treated like an error reply
+
+Pending actions always run before the next routine poll. An action that
+failed (error reply or lost connection) stays pending and is retried on
+the next step. For every action the detection-to-actuation latency (from
+receiving the reading that tripped the rule to the acknowledgement of the
+controller) is recorded in an ``InterlockEvent``.
+
+Readings are either polled by the engine itself (``step`` / ``run``, all
+readings required by the rules in one pipelined batch) or fed from any
+other source using ``feed``, for example the callback of an
+``AdaptiveScheduler``.
+'''
+import time
+
+from .decoders import PRESSURE_UNITS, convertPressure
+
+# Metric -> GammaIonPump getter
+INTERLOCK_METRICS = {
+    "pressure" : "getPressureWithUnits",
+    "current" : "getCurrent",
+    "voltage" : "getVoltage"
+}
+
+# Metrics whose getters return None on error replies (pressure reports None
+# for disabled pumps and False on errors)
+NONE_IS_ERROR = frozenset(("current", "voltage"))
+
+class InterlockRule:
+    '''Threshold rule on one metric of one channel
+
+    Parameters:
+        name            Name used in events
+        metric          "pressure", "current" or "voltage"
+        pumpIndex       Channel the reading is taken from
+        limit           Threshold that trips the rule
+        clearLimit      Threshold the value has to return past to clear the
+                        rule (defaults to limit, i.e. no hysteresis)
+        above           Trip if the value is above (True) or below the limit
+        debounce        Consecutive readings required to trip or clear
+        pumps           Channels to disable when tripped (default pumpIndex)
+        restore         Re-enable the pumps when the rule clears
+        tripOnError     Treat error replies as limit violations
+    '''
+    def __init__(self, name, metric, pumpIndex, limit, clearLimit=None, above=True, debounce=1,
+                 pumps=None, restore=False, tripOnError=False):
+        if metric not in INTERLOCK_METRICS:
+            raise ValueError("Unknown metric {}".format(metric))
+        if clearLimit is None:
+            clearLimit = limit
+        if (above and clearLimit > limit) or ((not above) and clearLimit < limit):
+            raise ValueError("clearLimit has to be on the safe side of limit")
+        self.name = name
+        self.metric = metric
+        self.pumpIndex = pumpIndex
+        self.limit = limit
+        self.clearLimit = clearLimit
+        self.above = above
+        self.debounce = max(1, debounce)
+        self.pumps = tuple(pumps) if pumps is not None else (pumpIndex,)
+        self.restore = restore
+        self.tripOnError = tripOnError
+
+        self.tripped = False
+        self._count = 0
+
+    def _breached(self, value):
+        return value > self.limit if self.above else value < self.limit
+
+    def _cleared(self, value):
+        return value < self.clearLimit if self.above else value > self.clearLimit
+
+    def evaluate(self, value):
+        '''Processes a reading, returns "trip", "clear" or None'''
+        if value is False or (value is None and self.metric in NONE_IS_ERROR):
+            if not self.tripOnError:
+                return None
+            beyond = not self.tripped
+        elif value is None:
+            return None
+        elif self.tripped:
+            beyond = self._cleared(value)
+        else:
+            beyond = self._breached(value)
+
+        if not beyond:
+            self._count = 0
+            return None
+        self._count = self._count + 1
+        if self._count < self.debounce:
+            return None
+        self._count = 0
+        self.tripped = not self.tripped
+        return "trip" if self.tripped else "clear"
+
+class InterlockEvent:
+    __slots__ = ('rule', 'action', 'pumpIndex', 'value', 'detected', 'actuated', 'attempts', 'success')
+
+    def __init__(self, rule, action, pumpIndex, value, detected):
+        self.rule = rule
+        self.action = action
+        self.pumpIndex = pumpIndex
+        self.value = value
+        self.detected = detected
+        self.actuated = None
+        self.attempts = 0
+        self.success = False
+
+    @property
+    def latency(self):
+        '''Seconds from detection to the acknowledged action (None if pending)'''
+        if self.actuated is None:
+            return None
+        return self.actuated - self.detected
+
+    def __repr__(self):
+        return "InterlockEvent({}, {} pump {}, value={}, latency={}, success={})".format(
+            self.rule.name, self.action, self.pumpIndex, self.value, self.latency, self.success)
+
+class InterlockEngine:
+    '''Evaluates rules and actuates pumps
+
+    Parameters:
+        pump        Connected GammaIonPump
+        rules       Iterable of InterlockRule
+        interval    Polling interval of ``run`` in seconds
+        units       Pressure unit of the limits of pressure rules
+        clock       Monotonic time source used for the latencies
+    '''
+    def __init__(self, pump, rules, interval=0.1, units="mBar", clock=time.monotonic):
+        convertPressure(1.0, units, units)
+        self.pump = pump
+        self.rules = list(rules)
+        self.interval = interval
+        self.units = units
+        self.clock = clock
+        self.events = []
+        self.pending = []
+
+        self.requests = []
+        for rule in self.rules:
+            request = (INTERLOCK_METRICS[rule.metric], rule.pumpIndex)
+            if request not in self.requests:
+                self.requests.append(request)
+
+    def feed(self, readings, detected=None):
+        '''Evaluates (metric, pumpIndex, value) readings and runs resulting actions
+
+        Pressures are given in the unit of the engine or as (pressure, units)
+        tuples as returned by ``getPressureWithUnits``. Returns the events
+        created by these readings.
+        '''
+        if detected is None:
+            detected = self.clock()
+        created = []
+        try:
+            for metric, pumpIndex, value in readings:
+                if isinstance(value, tuple):
+                    value = self._convert(value)
+                for rule in self.rules:
+                    if rule.metric != metric or rule.pumpIndex != pumpIndex:
+                        continue
+                    transition = rule.evaluate(value)
+                    if transition == "trip":
+                        action = "disable"
+                    elif transition == "clear" and rule.restore:
+                        action = "enable"
+                    else:
+                        continue
+                    for target in rule.pumps:
+                        if action == "enable" and self._held(target, rule):
+                            continue
+                        event = InterlockEvent(rule, action, target, value, detected)
+                        # A newer action for the same pump supersedes a pending one
+                        self.pending = [ e for e in self.pending if e.pumpIndex != target ]
+                        self.pending.append(event)
+                        self.events.append(event)
+                        created.append(event)
+        finally:
+            # Actions of rules that already tripped must never be lost
+            self.actuate()
+        return created
+
+    def _convert(self, reading):
+        '''Converts a (pressure, units) tuple into the unit of the engine,
+        False (an error reading) for unknown units'''
+        pressure, units = reading
+        if pressure is None:
+            return None
+        try:
+            return convertPressure(pressure, units, self.units)
+        except ValueError:
+            return False
+
+    def _held(self, pumpIndex, rule):
+        '''True if another tripped rule keeps the pump disabled'''
+        return any(other.tripped and pumpIndex in other.pumps for other in self.rules if other is not rule)
+
+    def actuate(self):
+        '''Runs all pending actions, disables first'''
+        if not self.pending:
+            return
+        pending = sorted(self.pending, key=lambda e: e.action != "disable")
+        self.pending = []
+        for event in pending:
+            event.attempts = event.attempts + 1
+            try:
+                if event.action == "disable":
+                    ok = self.pump.disable(event.pumpIndex)
+                else:
+                    ok = self.pump.enable(event.pumpIndex)
+            except (ConnectionError, OSError):
+                ok = False
+            if ok:
+                event.actuated = self.clock()
+                event.success = True
+            else:
+                self.pending.append(event)
+
+    def step(self):
+        '''Retries pending actions, reads all values required by the rules in
+        one batch and evaluates them'''
+        self.actuate()
+        values = self.pump.batch(self.requests)
+        detected = self.clock()
+        readings = []
+        for (getter, pumpIndex), value in zip(self.requests, values):
+            for metric, name in INTERLOCK_METRICS.items():
+                if name == getter:
+                    readings.append((metric, pumpIndex, value))
+        return self.feed(readings, detected)
+
+    def run(self, duration=None, count=None):
+        '''Steps every interval seconds until duration seconds or count steps passed'''
+        start = time.monotonic()
+        n = 0
+        while ((count is None) or (n < count)) and ((duration is None) or (time.monotonic() - start < duration)):
+            self.step()
+            n = n + 1
+            delay = start + n * self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def latencies(self):
+        '''Detection-to-actuation latencies of all successful actions'''
+        return [ e.latency for e in self.events if e.success ]
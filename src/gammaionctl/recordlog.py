@@ -0,0 +1,333 @@
+'''Append only binary log of controller readings
+
+File layout: a 16 byte header (``MAGIC``, format version, record size)
+followed by fixed size little endian records
+
+    offset  size  field
+    0       8     timestamp (double, seconds since the epoch)
+    8       2     host id (unsigned, see the ``.hosts`` sidecar file)
+    10      1     channel (pump index)
+    11      1     metric (``METRIC_*``)
+    12      1     status flags (``FLAG_*``)
+    13      3     padding
+    16      8     value (double, NaN if not available)
+
+Host names are mapped to ids by a plain text sidecar file (``<log>.hosts``,
+one host per line, the line number being the id).
+
+``RecordLogWriter`` appends records, ``RecordLogReader`` maps the file with
+``mmap`` and keeps a sparse index (the timestamp of every ``stride``-th
+record) so time range lookups only need a binary search on the index and a
+short scan inside one block. Records have to be appended in non decreasing
+timestamp order for range lookups to be exact. ``PumpRecorder`` writes the
+readings of a ``GammaIonPump`` into a log.
+'''
+import math
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .snapshot import FIELD_PRESSURE, FIELD_CURRENT, FIELD_VOLTAGE
+
+MAGIC = b'GQPCLOG\x00'
+VERSION = 1
+
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<dHBBB3xd')
+
+METRIC_PRESSURE = 1
+METRIC_CURRENT = 2
+METRIC_VOLTAGE = 3
+
+METRICS = {
+    "pressure" : METRIC_PRESSURE,
+    "current" : METRIC_CURRENT,
+    "voltage" : METRIC_VOLTAGE
+}
+
+FLAG_MISSING = 0x01
+FLAG_ERROR = 0x02
+FLAG_HIGHVOLTAGE = 0x04
+
+# Equivalent numpy dtype for zero copy access to RecordLogReader.rawRange():
+# numpy.frombuffer(view, dtype=numpy.dtype(RECORD_DTYPE))
+RECORD_DTYPE = [
+    ("timestamp", "<f8"), ("host", "<u2"), ("channel", "u1"), ("metric", "u1"),
+    ("flags", "u1"), ("pad", "V3"), ("value", "<f8")
+]
+
+class LogRecord:
+    __slots__ = ('timestamp', 'host', 'channel', 'metric', 'flags', 'value')
+
+    def __init__(self, timestamp, host, channel, metric, flags, value):
+        self.timestamp = timestamp
+        self.host = host
+        self.channel = channel
+        self.metric = metric
+        self.flags = flags
+        self.value = value
+
+    def __repr__(self):
+        return "LogRecord({}, host={}, channel={}, metric={}, flags={:#x}, value={})".format(
+            self.timestamp, self.host, self.channel, self.metric, self.flags, self.value)
+
+class HostTable:
+    '''Host name to id mapping stored next to the log'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.hosts = []
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.hosts = [ line.rstrip("\n") for line in f ]
+        self._ids = { host : n for n, host in enumerate(self.hosts) }
+
+    def id(self, host, create=True):
+        if host in self._ids:
+            return self._ids[host]
+        if not create:
+            return None
+        if len(self.hosts) > 0xFFFF:
+            raise ValueError("Too many hosts in log")
+        with open(self.filename, "a") as f:
+            f.write(host + "\n")
+        self._ids[host] = len(self.hosts)
+        self.hosts.append(host)
+        return self._ids[host]
+
+    def name(self, hostId):
+        return self.hosts[hostId]
+
+class RecordLogWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.hostTable = HostTable(filename + ".hosts")
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        if exists:
+            with open(filename, "rb+") as f:
+                _checkHeader(f.read(HEADER.size))
+                # Drop a record torn by an interrupted write, otherwise all
+                # records appended after it would be misaligned
+                size = os.fstat(f.fileno()).st_size
+                complete = HEADER.size + (size - HEADER.size) // RECORD.size * RECORD.size
+                if complete != size:
+                    f.truncate(complete)
+        self._file = open(filename, "ab")
+        if not exists:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.lastTimestamp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, timestamp, host, channel, metric, value, flags=0):
+        '''Appends a single record
+
+        ``host`` is a host name (mapped through the host table) or an id,
+        ``metric`` a metric name or ``METRIC_*`` constant. A value of None
+        is stored as NaN with FLAG_MISSING set.
+        '''
+        if isinstance(host, str):
+            host = self.hostTable.id(host)
+        if isinstance(metric, str):
+            metric = METRICS[metric]
+        if value is None:
+            value = math.nan
+            flags = flags | FLAG_MISSING
+        self._file.write(RECORD.pack(timestamp, host, channel, metric, flags, value))
+        self.lastTimestamp = timestamp
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def _checkHeader(header):
+    if len(header) < HEADER.size:
+        raise ValueError("Truncated log header")
+    magic, version, recordSize = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or recordSize != RECORD.size:
+        raise ValueError("Unsupported log format")
+
+class RecordLogReader:
+    '''Memory mapped read access to a record log
+
+    Parameters:
+        filename    Log file
+        stride      Distance (in records) between sparse index entries
+    '''
+    def __init__(self, filename, stride=1024):
+        self.filename = filename
+        self.stride = stride
+        self.hostTable = HostTable(filename + ".hosts")
+        self._file = open(filename, "rb")
+        self._map = None
+        self.count = 0
+        self._index = array('d')
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _release(self):
+        if self._map is None:
+            return
+        try:
+            self._map.close()
+        except BufferError:
+            # Views returned by rawRange are still in use. They keep the old
+            # mapping alive, it is unmapped once the last of them is released
+            pass
+        self._map = None
+
+    def close(self):
+        self._release()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def refresh(self):
+        '''Remaps the file to include records appended since opening
+
+        The sparse index is only extended for the new records.
+        '''
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError("Truncated log header")
+        self._release()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _checkHeader(self._map[:HEADER.size])
+
+        # Ignore a partially written record at the end
+        self.count = (size - HEADER.size) // RECORD.size
+        unpack = RECORD.unpack_from
+        for n in range(len(self._index) * self.stride, self.count, self.stride):
+            self._index.append(unpack(self._map, HEADER.size + n * RECORD.size)[0])
+
+    def _timestamp(self, n):
+        return struct.unpack_from('<d', self._map, HEADER.size + n * RECORD.size)[0]
+
+    def _lowerBound(self, timestamp):
+        '''Index of the first record with a timestamp >= timestamp'''
+        block = bisect_left(self._index, timestamp)
+        lo = max(0, (block - 1) * self.stride)
+        hi = min(self.count, block * self.stride)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _upperBound(self, timestamp):
+        '''Index of the first record with a timestamp > timestamp'''
+        block = bisect_right(self._index, timestamp)
+        lo = max(0, (block - 1) * self.stride)
+        hi = min(self.count, block * self.stride)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp(mid) <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def indexRange(self, start=None, end=None):
+        '''Returns (first, last) record indices (last exclusive) of start <= t <= end'''
+        first = 0 if start is None else self._lowerBound(start)
+        last = self.count if end is None else self._upperBound(end)
+        return first, max(first, last)
+
+    def rawRange(self, start=None, end=None):
+        '''Returns a read only memoryview over the records in the time range
+
+        The view is not copied from the mapping. It stays valid after
+        ``refresh`` and ``close`` (without the records appended since), the
+        mapping it belongs to is kept until the view is released.
+        '''
+        first, last = self.indexRange(start, end)
+        return memoryview(self._map)[HEADER.size + first * RECORD.size:HEADER.size + last * RECORD.size]
+
+    def records(self, start=None, end=None, host=None, channel=None, metric=None):
+        '''Iterates over the matching records as LogRecord objects'''
+        for record in self._iterate(start, end, host, channel, metric):
+            yield LogRecord(*record)
+
+    def values(self, start=None, end=None, host=None, channel=None, metric=None):
+        '''Returns (timestamps, values) arrays of the matching records'''
+        timestamps, values = array('d'), array('d')
+        for t, _, _, _, _, v in self._iterate(start, end, host, channel, metric):
+            timestamps.append(t)
+            values.append(v)
+        return timestamps, values
+
+    def _iterate(self, start, end, host, channel, metric):
+        if isinstance(host, str):
+            host = self.hostTable.id(host, create=False)
+            if host is None:
+                return
+        if isinstance(metric, str):
+            metric = METRICS[metric]
+        for t, h, c, m, flags, v in RECORD.iter_unpack(self.rawRange(start, end)):
+            if (host is not None and h != host) or (channel is not None and c != channel) or (metric is not None and m != metric):
+                continue
+            yield t, h, c, m, flags, v
+
+class PumpRecorder:
+    '''Records pressure, current and voltage of a GammaIonPump into a log
+
+    Every call of ``record`` reads a full pipelined snapshot of the given
+    pumps (the populated channels of the pump's ChannelMap if None) and
+    appends one record per channel and metric. Values that failed to read
+    are stored with FLAG_ERROR (in addition to FLAG_MISSING), values that
+    are not available (pressure of a disabled pump) only with FLAG_MISSING.
+    '''
+    def __init__(self, pump, writer, hostName=None, pumps=None):
+        self.pump = pump
+        self.writer = writer
+        self.pumps = tuple(pumps) if pumps is not None else None
+        if hostName is None:
+            hostName = pump.host if pump.host is not None else "local"
+        self.hostId = writer.hostTable.id(hostName)
+
+    def recordSnapshot(self, snapshot):
+        for channel in snapshot.channels:
+            flags = FLAG_HIGHVOLTAGE if channel.highVoltage else 0
+            voltage = None if channel.voltage is None else float(channel.voltage)
+            for metric, field, value in ((METRIC_PRESSURE, FIELD_PRESSURE, channel.pressure),
+                                         (METRIC_CURRENT, FIELD_CURRENT, channel.current),
+                                         (METRIC_VOLTAGE, FIELD_VOLTAGE, voltage)):
+                self.writer.append(snapshot.timestamp, self.hostId, channel.pumpIndex, metric, value,
+                                   flags | (FLAG_ERROR if channel.errors & field else 0))
+
+    def record(self):
+        snapshot = self.pump.snapshot(self.pumps)
+        self.recordSnapshot(snapshot)
+        return snapshot
+
+    def run(self, interval, count=None):
+        '''Records every interval seconds until count snapshots have been written'''
+        start = time.monotonic()
+        n = 0
+        while (count is None) or (n < count):
+            self.record()
+            self.writer.flush()
+            n = n + 1
+            delay = start + n * interval - time.monotonic()
+            if delay > 0 and ((count is None) or (n < count)):
+                time.sleep(delay)
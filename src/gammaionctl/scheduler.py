@@ -0,0 +1,235 @@
+'''Adaptive polling of pressure and current
+
+``AdaptiveScheduler`` polls every (metric, channel) pair of one controller
+at its own interval instead of a fixed rate. After every reading the
+interval is derived from how fast the value is currently changing: the
+rate of change (relative, pressure in decades) plus the recent variability
+of that rate. The interval is chosen so that a value is expected to change
+by at most ``tolerance`` between two readings, bounded by ``minInterval``
+and ``maxInterval``. Intervals shrink immediately and grow by at most a
+factor of two per reading.
+
+Channels are polled at ``minInterval`` while a value is within a factor of
+``nearFactor`` of a configured threshold and for ``boostDuration`` seconds
+after the pump has been enabled or disabled through the scheduler (or
+``boost`` has been called). All readings that are due are fetched as one
+pipelined batch, but never more commands than the ``budget`` (commands per
+second, token bucket with one second burst) allows - readings that do not
+fit are served first on the next step, ordered by how overdue they are.
+
+Pressures are read with their units and reported (and compared against the
+thresholds) in the unit of the scheduler (``units``, mbar by default), a
+pressure in an unknown unit is reported like an error reply (False).
+'''
+import math
+import time
+
+from .decoders import convertPressure
+
+# Metric -> GammaIonPump getter
+SCHEDULED_METRICS = {
+    "pressure" : "getPressureWithUnits",
+    "current" : "getCurrent",
+    "voltage" : "getVoltage"
+}
+
+class MetricSchedule:
+    '''Scheduling state of one (metric, channel) pair'''
+    __slots__ = ('metric', 'pumpIndex', 'interval', 'nextDue', 'lastValue', 'lastTime', 'rate', 'variance', 'polls')
+
+    def __init__(self, metric, pumpIndex, interval, nextDue):
+        self.metric = metric
+        self.pumpIndex = pumpIndex
+        self.interval = interval
+        self.nextDue = nextDue
+        self.lastValue = None
+        self.lastTime = None
+        self.rate = None
+        self.variance = 0.0
+        self.polls = 0
+
+    def __repr__(self):
+        return "MetricSchedule({}, {}, interval={:.3f}, rate={})".format(self.metric, self.pumpIndex, self.interval, self.rate)
+
+def _change(metric, previous, value):
+    '''Relative change between two readings (decades for pressure)'''
+    if metric == "pressure":
+        return math.log10(value / previous) if (value > 0 and previous > 0) else 1.0
+    return abs(value - previous) / max(abs(previous), abs(value), 1e-12)
+
+class AdaptiveScheduler:
+    '''Rate of change driven polling of one controller
+
+    Parameters:
+        pump            Connected GammaIonPump
+        channels        Pump indices to poll
+        metrics         Metric names (see SCHEDULED_METRICS)
+        minInterval     Shortest polling interval in seconds
+        maxInterval     Longest polling interval in seconds
+        tolerance       Expected change between two readings (relative, or
+                        decades for pressure)
+        budget          Maximum commands per second
+        thresholds      Dictionary metric -> value or (metric, pumpIndex) ->
+                        value. Channels close to a threshold are polled at
+                        minInterval
+        nearFactor      Factor defining "close to a threshold"
+        boostDuration   Seconds of fastest polling after enable / disable
+        smoothing       Weight of the newest rate in the variability average
+        units           Pressure unit of the results and thresholds
+        clock           Monotonic time source (for testing)
+    '''
+    def __init__(self, pump, channels=(1, 2, 3, 4), metrics=("pressure", "current"), minInterval=0.5,
+                 maxInterval=30.0, tolerance=0.05, budget=10.0, thresholds=None, nearFactor=2.0,
+                 boostDuration=30.0, smoothing=0.3, units="mBar", clock=time.monotonic):
+        for metric in metrics:
+            if metric not in SCHEDULED_METRICS:
+                raise ValueError("Unknown metric {}".format(metric))
+        convertPressure(1.0, units, units)
+        self.pump = pump
+        self.units = units
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.tolerance = tolerance
+        self.budget = budget
+        self.thresholds = dict(thresholds) if thresholds is not None else {}
+        self.nearFactor = nearFactor
+        self.boostDuration = boostDuration
+        self.smoothing = smoothing
+        self.clock = clock
+
+        now = clock()
+        self.schedules = [ MetricSchedule(metric, pumpIndex, minInterval, now) for pumpIndex in channels for metric in metrics ]
+        self._boostUntil = {}
+        self._tokens = float(budget)
+        self._refilled = now
+        self.commands = 0
+
+    def schedule(self, metric, pumpIndex):
+        for entry in self.schedules:
+            if entry.metric == metric and entry.pumpIndex == pumpIndex:
+                return entry
+        raise KeyError((metric, pumpIndex))
+
+    def boost(self, pumpIndex, duration=None):
+        '''Polls all metrics of a channel at minInterval for duration seconds'''
+        now = self.clock()
+        self._boostUntil[pumpIndex] = now + (self.boostDuration if duration is None else duration)
+        for entry in self.schedules:
+            if entry.pumpIndex == pumpIndex:
+                entry.interval = self.minInterval
+                entry.nextDue = min(entry.nextDue, now)
+
+    def enable(self, pumpIndex):
+        result = self.pump.enable(pumpIndex)
+        self.boost(pumpIndex)
+        return result
+
+    def disable(self, pumpIndex):
+        result = self.pump.disable(pumpIndex)
+        self.boost(pumpIndex)
+        return result
+
+    def _threshold(self, metric, pumpIndex):
+        threshold = self.thresholds.get((metric, pumpIndex))
+        return self.thresholds.get(metric) if threshold is None else threshold
+
+    def _refill(self, now):
+        self._tokens = min(float(self.budget), self._tokens + (now - self._refilled) * self.budget)
+        self._refilled = now
+
+    def _nextInterval(self, entry, value, now):
+        if value is None or value is False:
+            # No reading (pump disabled or error reply): nothing to track
+            entry.rate = None
+            return self.maxInterval if value is None else entry.interval
+
+        if entry.lastValue is not None and now > entry.lastTime:
+            rate = abs(_change(entry.metric, entry.lastValue, value)) / (now - entry.lastTime)
+            if entry.rate is not None:
+                deviation = rate - entry.rate
+                entry.variance = (1 - self.smoothing) * (entry.variance + self.smoothing * deviation * deviation)
+            entry.rate = rate if entry.rate is None else (1 - self.smoothing) * entry.rate + self.smoothing * rate
+        entry.lastValue = value
+        entry.lastTime = now
+
+        threshold = self._threshold(entry.metric, entry.pumpIndex)
+        if threshold is not None and threshold > 0 and value > 0:
+            if threshold / self.nearFactor <= value <= threshold * self.nearFactor:
+                return self.minInterval
+        if entry.rate is None:
+            return self.minInterval
+
+        speed = entry.rate + math.sqrt(entry.variance)
+        interval = self.tolerance / speed if speed > 0 else self.maxInterval
+        return min(interval, entry.interval * 2.0)
+
+    def due(self, now=None):
+        '''Entries that are due, most overdue (relative to their interval) first'''
+        if now is None:
+            now = self.clock()
+        entries = [ e for e in self.schedules if e.nextDue <= now ]
+        entries.sort(key=lambda e: (e.nextDue - now) / e.interval)
+        return entries
+
+    def poll(self):
+        '''Reads all due values the budget allows in a single batch
+
+        Returns a list of (metric, pumpIndex, value) tuples.
+        '''
+        now = self.clock()
+        self._refill(now)
+        entries = self.due(now)[:int(self._tokens)]
+        if not entries:
+            return []
+        self._tokens = self._tokens - len(entries)
+        self.commands = self.commands + len(entries)
+
+        values = self.pump.batch([ (SCHEDULED_METRICS[e.metric], e.pumpIndex) for e in entries ])
+        now = self.clock()
+        results = []
+        for entry, value in zip(entries, values):
+            if isinstance(value, tuple):
+                value = self._convert(value)
+            interval = self._nextInterval(entry, value, now)
+            if self._boostUntil.get(entry.pumpIndex, 0) > now:
+                interval = self.minInterval
+            entry.interval = max(self.minInterval, min(self.maxInterval, interval))
+            entry.nextDue = now + entry.interval
+            entry.polls = entry.polls + 1
+            results.append((entry.metric, entry.pumpIndex, value))
+        return results
+
+    def _convert(self, reading):
+        pressure, units = reading
+        if pressure is None:
+            return None
+        try:
+            return convertPressure(pressure, units, self.units)
+        except ValueError:
+            return False
+
+    def nextWakeup(self):
+        '''Monotonic time of the next due reading (respecting the budget)'''
+        wakeup = min(e.nextDue for e in self.schedules)
+        if self._tokens < 1:
+            wakeup = max(wakeup, self._refilled + (1 - self._tokens) / self.budget)
+        return wakeup
+
+    def run(self, callback=None, duration=None):
+        '''Polls until duration seconds have passed (forever if None)
+
+        ``callback(results)`` is called after every step with readings.
+        Stops early if the connection to the controller has been lost.
+        '''
+        end = None if duration is None else self.clock() + duration
+        while (end is None) or (self.clock() < end):
+            results = self.poll()
+            if results and callback is not None:
+                callback(results)
+            if not self.pump.sock:
+                break
+            delay = self.nextWakeup() - self.clock()
+            if end is not None:
+                delay = min(delay, end - self.clock())
+            if delay > 0:
+                time.sleep(delay)
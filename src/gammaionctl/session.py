@@ -0,0 +1,182 @@
+'''Self healing controller sessions
+
+``ReconnectingGammaIonPump`` is a drop in replacement for ``GammaIonPump``
+for long running processes. When the connection drops it is re-established
+on the next command, with exponential backoff between failed attempts so a
+dead controller is not hammered with connection attempts. Queries
+(``decoders.READ_CODES``) that failed because the connection was lost are
+retried once on the new connection - all other commands (``enable``,
+``disable`` or anything passed to ``sendCommand``) are never retried since
+it is unknown whether the controller executed them before the connection
+dropped.
+'''
+import socket
+import time
+
+from .gammaionctl import GammaIonPump
+from .decoders import isRead
+
+class SessionStatistics:
+    __slots__ = ('reconnects', 'failedAttempts', 'retries', 'disconnects', 'downtime', 'lastError')
+
+    def __init__(self):
+        self.reconnects = 0
+        self.failedAttempts = 0
+        self.retries = 0
+        self.disconnects = 0
+        self.downtime = 0.0
+        self.lastError = None
+
+    def asDict(self):
+        return { name : getattr(self, name) for name in self.__slots__ }
+
+class ReconnectingGammaIonPump(GammaIonPump):
+    '''GammaIonPump that transparently reconnects after connection loss
+
+    Parameters (in addition to the ones of GammaIonPump):
+        backoffInitial  Delay after the first failed reconnect attempt
+        backoffFactor   Factor the delay grows with every failed attempt
+        backoffMax      Upper bound for the delay between attempts
+
+    While the backoff delay after a failed attempt has not elapsed commands
+    fail immediately (like on a dropped GammaIonPump) instead of blocking.
+    Construction succeeds even if the controller is not reachable at that
+    time, the connection is then established by the first command.
+    '''
+    def __init__(self, host, timeout=2, connection=None, pipelining=True, port=23,
+                 backoffInitial=0.5, backoffFactor=2.0, backoffMax=60.0):
+        self.stats = SessionStatistics()
+        self.backoffInitial = backoffInitial
+        self.backoffFactor = backoffFactor
+        self.backoffMax = backoffMax
+        self._backoff = 0
+        self._nextAttempt = 0
+        self._downSince = None
+
+        try:
+            super().__init__(host, timeout=timeout, connection=connection, pipelining=pipelining, port=port)
+        except (ConnectionError, OSError) as e:
+            if host is None:
+                raise
+            self._connectionLost(e)
+            self._attemptFailed(e)
+
+    @property
+    def connected(self):
+        return bool(self.sock)
+
+    @property
+    def downtime(self):
+        '''Accumulated time without connection including a running outage'''
+        if self._downSince is None:
+            return self.stats.downtime
+        return self.stats.downtime + (time.monotonic() - self._downSince)
+
+    def _connectionLost(self, error=None):
+        if self._downSince is None:
+            self._downSince = time.monotonic()
+            self.stats.disconnects = self.stats.disconnects + 1
+        if error is not None:
+            self.stats.lastError = "{}: {}".format(type(error).__name__, error)
+        if self.sock:
+            # A connection closed by the peer has already been reported
+            if self.instrumentation is not None:
+                self.instrumentation.disconnected(self.host, self.stats.lastError)
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = False
+
+    def _attemptFailed(self, error):
+        self.stats.failedAttempts = self.stats.failedAttempts + 1
+        self.stats.lastError = "{}: {}".format(type(error).__name__, error)
+        if self._backoff == 0:
+            self._backoff = self.backoffInitial
+        else:
+            self._backoff = min(self._backoff * self.backoffFactor, self.backoffMax)
+        self._nextAttempt = time.monotonic() + self._backoff
+        if self.verbose:
+            print("Reconnect failed ({}), next attempt in {} s".format(error, self._backoff))
+
+    def reconnect(self):
+        '''Tries to re-establish the connection respecting the backoff delay
+
+        Returns True if the session is connected afterwards.
+        '''
+        if self.sock:
+            return True
+        if self.host is None:
+            return False
+        if time.monotonic() < self._nextAttempt:
+            return False
+
+        if self.verbose:
+            print("Reconnecting to {}".format(self.host))
+        try:
+            self._connect()
+        except (ConnectionError, OSError) as e:
+            self._attemptFailed(e)
+            return False
+
+        self._backoff = 0
+        self._nextAttempt = 0
+        self.stats.reconnects = self.stats.reconnects + 1
+        if self._downSince is not None:
+            self.stats.downtime = self.stats.downtime + (time.monotonic() - self._downSince)
+            self._downSince = None
+        return True
+
+    def close(self):
+        super().close()
+        self._downSince = None
+
+    def _transact(self, command):
+        if not self.reconnect():
+            if self.verbose:
+                print("Pump controller not connected")
+            return False
+
+        retry = isRead(command)
+        try:
+            frame = super()._transact(command)
+        except (socket.timeout, OSError) as e:
+            self._connectionLost(e)
+            frame = False
+
+        if (frame is False) and (not self.sock):
+            self._connectionLost()
+            if retry and self.reconnect():
+                self.stats.retries = self.stats.retries + 1
+                try:
+                    frame = super()._transact(command)
+                except (socket.timeout, OSError) as e:
+                    self._connectionLost(e)
+                    frame = False
+        return frame
+
+    def _exchange(self, command):
+        # A failed exchange inside a batch drops the connection but keeps
+        # the replies that have already been received for that batch
+        try:
+            return super()._exchange(command)
+        except (socket.timeout, OSError) as e:
+            self._connectionLost(e)
+            return False
+
+    def _sendBatch(self, commands):
+        if not self.reconnect():
+            return [ False ] * len(commands)
+
+        try:
+            replies = super()._sendBatch(commands)
+        except (socket.timeout, OSError) as e:
+            self._connectionLost(e)
+            replies = [ False ] * len(commands)
+
+        if not self.sock:
+            # Repeat the queries that did not receive a reply
+            for n, command in enumerate(commands):
+                if (replies[n] is False) and isRead(command):
+                    replies[n] = self._transact(command)
+        return replies
@@ -0,0 +1,290 @@
+'''Local QPC simulator for load tests and benchmarks
+
+Runs a TCP server that speaks the ``spc`` subset used by ``GammaIonPump``
+(prompt ``>``, replies terminated by ``\\r\\r>``) and simulates a quad pump
+controller: enabled pumps pump down exponentially towards a base pressure
+with some noise, current follows the pressure, disabled pumps report the
+standby values of the real controller. Latency, jitter, disconnects and
+error replies can be injected to test clients under adverse conditions.
+
+All clients connected to one server share the same simulated controller.
+The server is based on asyncio so it handles many simultaneous clients
+from a single thread. It can be run in the background of a test or
+benchmark using ``start`` / ``stop`` or as a standalone process:
+
+    python -m gammaionctl.simulator --port 2323 --latency 0.01
+'''
+import argparse
+import asyncio
+import math
+import random
+import threading
+import time
+
+# Pressure the controller reports for disabled or unavailable pumps
+PRESSURE_UNAVAILABLE = 1.3e-11
+
+class SimulatedPump:
+    '''State of a single simulated ion pump
+
+    ``size`` is the pump capacity in L/S, a size of 0 simulates an
+    unpopulated channel. The high voltage is reported on ``rampTime``
+    seconds after the pump has been enabled.
+    '''
+    def __init__(self, size=40, enabled=True, basePressure=2e-9, startPressure=1e-5,
+                 timeConstant=60.0, noise=0.02, rng=None, rampTime=0.0):
+        self.size = size
+        self.rampTime = rampTime
+        self.basePressure = basePressure
+        self.startPressure = startPressure
+        self.timeConstant = timeConstant
+        self.noise = noise
+        self.rng = rng if rng is not None else random.Random()
+        self.enabled = False
+        self.enabledSince = None
+        if enabled and size > 0:
+            self.enable()
+            self.enabledSince = self.enabledSince - rampTime
+
+    @property
+    def populated(self):
+        return self.size > 0
+
+    def enable(self):
+        if self.populated and not self.enabled:
+            self.enabled = True
+            self.enabledSince = time.monotonic()
+
+    def disable(self):
+        self.enabled = False
+        self.enabledSince = None
+
+    def highVoltage(self):
+        return self.enabled and (time.monotonic() - self.enabledSince >= self.rampTime)
+
+    def pressure(self):
+        if not self.enabled:
+            return PRESSURE_UNAVAILABLE
+        t = time.monotonic() - self.enabledSince
+        p = self.basePressure + (self.startPressure - self.basePressure) * math.exp(-t / self.timeConstant)
+        return p * (1.0 + self.rng.gauss(0, self.noise))
+
+    def current(self):
+        if not self.enabled:
+            return 0.0
+        # Roughly linear relation between pumping current and pressure
+        return self.pressure() * self.size * 1.0
+
+    def voltage(self):
+        if not self.enabled:
+            return 30 if self.populated else 0
+        return int(5600 + self.rng.gauss(0, 5))
+
+    def supplyStatus(self):
+        if not self.populated:
+            return "NO PUMP"
+        return "RUNNING" if self.enabled else "STANDBY"
+
+class SimulatedController:
+    '''A simulated QPC with four pumps
+
+    Parameters:
+        pumps           Iterable of pump sizes (0 for unpopulated channels)
+                        or SimulatedPump instances
+        identity        String returned by command 01
+        units           Pressure units reported by command 0B
+        latency         Delay before every reply in seconds
+        jitter          Standard deviation added to the latency
+        errorRate       Probability of an error reply instead of a result
+        disconnectRate  Probability that the connection is dropped instead
+                        of replying
+        seed            Seed for the random number generator
+    '''
+    def __init__(self, pumps=(40, 40, 40, 40), identity="DIGITEL QPC", units="MBAR",
+                 latency=0.0, jitter=0.0, errorRate=0.0, disconnectRate=0.0, seed=None):
+        self.rng = random.Random(seed)
+        self.pumps = []
+        for pump in pumps:
+            if not isinstance(pump, SimulatedPump):
+                pump = SimulatedPump(size=pump, rng=self.rng)
+            self.pumps.append(pump)
+        self.identity = identity
+        self.units = units
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.disconnectRate = disconnectRate
+        self.commands = 0
+
+    def delay(self):
+        if self.jitter > 0:
+            return max(0.0, self.rng.gauss(self.latency, self.jitter))
+        return self.latency
+
+    def _pump(self, args):
+        try:
+            index = int(args[0])
+        except (IndexError, ValueError):
+            return None
+        if index < 1 or index > len(self.pumps):
+            return None
+        return self.pumps[index - 1]
+
+    def execute(self, line):
+        '''Executes a single command line and returns the reply body
+
+        Returns None in case the connection should be dropped (injected
+        disconnect).
+        '''
+        self.commands = self.commands + 1
+        if self.disconnectRate > 0 and self.rng.random() < self.disconnectRate:
+            return None
+        if self.errorRate > 0 and self.rng.random() < self.errorRate:
+            return "ER 01 SIMULATED ERROR"
+
+        parts = line.split()
+        if len(parts) < 2 or parts[0].lower() != "spc":
+            return "ER 02 INVALID COMMAND"
+        code, args = parts[1].upper(), parts[2:]
+
+        if code == "01":
+            return "OK 00 " + self.identity
+
+        pump = self._pump(args)
+        if pump is None:
+            return "ER 03 INVALID PUMP"
+
+        if code == "0A":
+            return "OK 00 {:.1E} AMPS".format(pump.current())
+        if code == "0B":
+            return "OK 00 {:.1E} {}".format(pump.pressure(), self.units)
+        if code == "0C":
+            return "OK 00 {}".format(pump.voltage())
+        if code == "0D":
+            return "OK 00 " + pump.supplyStatus()
+        if code == "11":
+            return "OK 00 {:05.1f} L/S".format(pump.size)
+        if code == "37":
+            pump.enable()
+            return "OK 00"
+        if code == "38":
+            pump.disable()
+            return "OK 00"
+        if code == "61":
+            return "OK 00 " + ("YES" if pump.highVoltage() else "NO")
+        return "ER 02 INVALID COMMAND"
+
+class QPCSimulator:
+    '''TCP server exposing a SimulatedController
+
+    ``port=0`` selects a free ephemeral port, the actual port is available
+    as ``port`` after the server has been started.
+    '''
+    def __init__(self, controller=None, host="127.0.0.1", port=0):
+        self.controller = controller if controller is not None else SimulatedController()
+        self.host = host
+        self.port = port
+        self.clients = 0
+        self.connections = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    async def _handle(self, reader, writer):
+        self.clients = self.clients + 1
+        self.connections = self.connections + 1
+        try:
+            writer.write(b"\r\n>")
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode("ascii", "replace").strip()
+                if not line:
+                    continue
+                delay = self.controller.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                reply = self.controller.execute(line)
+                if reply is None:
+                    break
+                writer.write(reply.encode("ascii") + b"\r\r>")
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.clients = self.clients - 1
+            writer.close()
+
+    async def serve(self):
+        '''Starts listening, returns the asyncio server'''
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        '''Runs the server in a background thread and returns the port'''
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.serve())
+            started.set()
+            self._loop.run_forever()
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="qpc-simulator", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Gamma QPC ion pump controller")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=2323, help="TCP port to listen on")
+    parser.add_argument("--pumps", default="40,40,40,40", help="Comma separated pump sizes in L/S, 0 for unpopulated channels")
+    parser.add_argument("--latency", type=float, default=0.0, help="Reply latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of error replies")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Probability of dropped connections")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    controller = SimulatedController(
+        pumps = [ int(size) for size in args.pumps.split(",") ],
+        latency = args.latency,
+        jitter = args.jitter,
+        errorRate = args.error_rate,
+        disconnectRate = args.disconnect_rate,
+        seed = args.seed
+    )
+    simulator = QPCSimulator(controller, host=args.host, port=args.port)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(simulator.serve())
+    print("Simulated QPC listening on {}:{}".format(args.host, simulator.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
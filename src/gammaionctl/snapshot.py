@@ -0,0 +1,93 @@
+'''Fixed layout result records for full controller reads
+
+``GammaIonPump.snapshot`` returns a ``ControllerSnapshot`` holding one
+``ChannelSnapshot`` per queried pump. Unlike the individual getters (that
+return ``False`` or ``None`` depending on the method) missing values are
+always ``None`` - which fields failed due to an error reply is recorded in
+the ``errors`` bitmask of each channel.
+'''
+import math
+from array import array
+
+FIELD_PRESSURE = 0x01
+FIELD_VOLTAGE = 0x02
+FIELD_CURRENT = 0x04
+FIELD_HIGHVOLTAGE = 0x08
+FIELD_SUPPLYSTATUS = 0x10
+
+# Numeric columns as returned by ChannelSnapshot.numeric
+NUMERIC_FIELDS = ("pressure", "voltage", "current", "highVoltage")
+
+class ChannelSnapshot:
+    __slots__ = ('pumpIndex', 'pressure', 'units', 'voltage', 'current', 'highVoltage', 'supplyStatus', 'errors')
+
+    def __init__(self, pumpIndex, pressure=None, units=None, voltage=None, current=None,
+                 highVoltage=None, supplyStatus=None, errors=0):
+        self.pumpIndex = pumpIndex
+        self.pressure = pressure
+        self.units = units
+        self.voltage = voltage
+        self.current = current
+        self.highVoltage = highVoltage
+        self.supplyStatus = supplyStatus
+        self.errors = errors
+
+    @property
+    def ok(self):
+        return self.errors == 0
+
+    def numeric(self):
+        '''Returns the numeric fields as tuple, missing values as NaN'''
+        return (
+            math.nan if self.pressure is None else self.pressure,
+            math.nan if self.voltage is None else float(self.voltage),
+            math.nan if self.current is None else self.current,
+            math.nan if self.highVoltage is None else float(self.highVoltage)
+        )
+
+    def __repr__(self):
+        return "ChannelSnapshot(pump={}, pressure={} {}, voltage={}, current={}, hv={}, status={!r}, errors={:#x})".format(
+            self.pumpIndex, self.pressure, self.units, self.voltage, self.current,
+            self.highVoltage, self.supplyStatus, self.errors)
+
+class ControllerSnapshot:
+    __slots__ = ('host', 'timestamp', 'channels', 'connected')
+
+    def __init__(self, host, timestamp, channels, connected=True):
+        self.host = host
+        self.timestamp = timestamp
+        self.channels = channels
+        self.connected = connected
+
+    @property
+    def ok(self):
+        return self.connected and all(channel.errors == 0 for channel in self.channels)
+
+    def channel(self, pumpIndex):
+        for channel in self.channels:
+            if channel.pumpIndex == pumpIndex:
+                return channel
+        raise KeyError(pumpIndex)
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def toArray(self, target=None):
+        '''Appends timestamp and the numeric fields of all channels to an
+        ``array('d')`` (a new one if no target is given) and returns it
+
+        The layout is ``timestamp`` followed by ``NUMERIC_FIELDS`` for every
+        channel in order, so fixed size records can be stored back to back.
+        '''
+        if target is None:
+            target = array('d')
+        target.append(self.timestamp)
+        for channel in self.channels:
+            target.extend(channel.numeric())
+        return target
+
+    def __repr__(self):
+        return "ControllerSnapshot(host={!r}, timestamp={}, channels={!r})".format(self.host, self.timestamp, self.channels)
@@ -0,0 +1,297 @@
+'''Coordinated enabling and disabling of many channels
+
+``BulkSwitch`` switches channels on many controllers at once and verifies
+that the high voltage actually reached the requested state:
+
+* every controller is handled by its own worker, so controllers switch
+  concurrently. Without staggering all commands of a controller are sent
+  as one pipelined batch
+* with ``stagger`` the commands are spread over time (one channel every
+  ``stagger`` seconds over all controllers, in the order of the targets)
+  to limit the inrush current of a rack
+* after the command the high voltage status (and supply status) of all
+  channels that have not been rejected by an error reply is read in one
+  batch - also of channels whose acknowledgement got lost, since the
+  controller may have executed the command anyway - backing
+  off from ``initialDelay`` to ``maxDelay`` between reads, until the state
+  is confirmed or ``verifyTimeout`` passed since the command
+
+Every channel is reported as a ``ChannelOutcome`` with the time from the
+command to the acknowledgement and to the confirmed state:
+
+    with BulkSwitch({ "10.0.0.11" : (1, 2, 3, 4), "10.0.0.12" : (1, 2) }) as rack:
+        result = rack.enable(stagger=0.5)
+        for outcome in result.failed:
+            print(outcome)
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .gammaionctl import GammaIonPump
+from .hosts import splitHost
+
+OUTCOME_CONFIRMED = "confirmed"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_REJECTED = "rejected"
+OUTCOME_NO_PUMP = "no pump"
+OUTCOME_FAILED = "failed"
+
+class ChannelOutcome:
+    '''Result of switching one channel
+
+    ``sent`` is the time the command has been sent (seconds after the start
+    of the operation), ``timeToAck`` and ``timeToConfirm`` are measured from
+    the command (``timeToAck`` is None if the acknowledgement got lost, the
+    channel is verified nevertheless). ``highVoltage`` and ``supplyStatus``
+    are the last values read during verification.
+    '''
+    __slots__ = ('host', 'pumpIndex', 'action', 'outcome', 'sent', 'timeToAck', 'timeToConfirm',
+                 'highVoltage', 'supplyStatus', 'polls', 'error', '_sentAt')
+
+    def __init__(self, host, pumpIndex, action):
+        self.host = host
+        self.pumpIndex = pumpIndex
+        self.action = action
+        self.outcome = None
+        self.sent = None
+        self.timeToAck = None
+        self.timeToConfirm = None
+        self.highVoltage = None
+        self.supplyStatus = None
+        self.polls = 0
+        self.error = None
+        self._sentAt = None
+
+    @property
+    def ok(self):
+        return self.outcome == OUTCOME_CONFIRMED
+
+    def __repr__(self):
+        return "ChannelOutcome({} pump {} {}: {}, timeToAck={}, timeToConfirm={}, status={}, error={})".format(
+            self.host, self.pumpIndex, self.action, self.outcome, self.timeToAck, self.timeToConfirm,
+            self.supplyStatus, self.error)
+
+class BulkResult:
+    __slots__ = ('action', 'outcomes', 'duration')
+
+    def __init__(self, action, outcomes, duration):
+        self.action = action
+        self.outcomes = outcomes
+        self.duration = duration
+
+    def __getitem__(self, key):
+        '''Outcome of (host, pumpIndex)'''
+        host, pumpIndex = key
+        for outcome in self.outcomes:
+            if outcome.host == host and outcome.pumpIndex == pumpIndex:
+                return outcome
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.outcomes)
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    @property
+    def ok(self):
+        return all(outcome.ok for outcome in self.outcomes)
+
+    @property
+    def failed(self):
+        return [ outcome for outcome in self.outcomes if not outcome.ok ]
+
+    @property
+    def slowest(self):
+        '''Longest time to a confirmed state (None if nothing was confirmed)'''
+        times = [ o.timeToConfirm for o in self.outcomes if o.timeToConfirm is not None ]
+        return max(times) if times else None
+
+class BulkSwitch:
+    '''Switches and verifies channels on many controllers
+
+    Parameters:
+        targets         Dictionary host -> pump indices, or an iterable of
+                        hosts (all four channels). A host may be given as
+                        "address:port" to use a port other than 23
+        timeout         Socket timeout per controller
+        maxWorkers      Size of the thread pool
+        pumpFactory     Callable ``(host, timeout)`` returning a connected
+                        ``GammaIonPump`` like object
+        clock           Monotonic time source
+        sleep           Sleep function
+    '''
+    def __init__(self, targets, timeout=2, maxWorkers=16, pumpFactory=None, clock=time.monotonic, sleep=time.sleep):
+        if isinstance(targets, dict):
+            self.targets = { host : tuple(channels) for host, channels in targets.items() }
+        else:
+            self.targets = { host : (1, 2, 3, 4) for host in targets }
+        self.timeout = timeout
+        self.pumpFactory = pumpFactory if pumpFactory is not None else self._connect
+        self.clock = clock
+        self.sleep = sleep
+
+        self._sessions = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(self.targets))))
+
+    @staticmethod
+    def _connect(host, timeout):
+        address, port = splitHost(host)
+        return GammaIonPump(address, timeout=timeout, port=port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for pump in self._sessions.values():
+            try:
+                pump.close()
+            except OSError:
+                pass
+        self._sessions = {}
+
+    def _dropSession(self, host):
+        pump = self._sessions.pop(host, None)
+        if pump is not None:
+            try:
+                pump.close()
+            except OSError:
+                pass
+
+    def enable(self, **kwargs):
+        '''Enables all target channels, see ``switch``'''
+        return self.switch(True, **kwargs)
+
+    def disable(self, **kwargs):
+        '''Disables all target channels, see ``switch``'''
+        return self.switch(False, **kwargs)
+
+    def switch(self, enable, stagger=0.0, verifyTimeout=10.0, initialDelay=0.05, maxDelay=1.0, backoff=2.0):
+        '''Switches all target channels and waits for the confirmation
+
+        Parameters:
+            enable          True to enable, False to disable
+            stagger         Seconds between two consecutive commands (0 sends
+                            all commands of a controller at once)
+            verifyTimeout   Seconds after the command until a channel that
+                            did not reach the state is reported as timeout
+            initialDelay    First delay between verification reads
+            maxDelay        Upper bound of the delay between reads
+            backoff         Factor the delay grows by after every read
+
+        Returns a BulkResult with one ChannelOutcome per channel in the order
+        of the targets.
+        '''
+        start = self.clock()
+        slot = 0
+        futures = []
+        for host, channels in self.targets.items():
+            slots = list(range(slot, slot + len(channels)))
+            slot = slot + len(channels)
+            futures.append(self._executor.submit(self._switchHost, host, channels, slots, enable, start, stagger,
+                                                 verifyTimeout, initialDelay, maxDelay, backoff))
+        outcomes = []
+        for future in futures:
+            outcomes.extend(future.result())
+        return BulkResult("enable" if enable else "disable", outcomes, self.clock() - start)
+
+    def _switchHost(self, host, channels, slots, enable, start, stagger, verifyTimeout, initialDelay, maxDelay, backoff):
+        action = "enable" if enable else "disable"
+        outcomes = [ ChannelOutcome(host, pumpIndex, action) for pumpIndex in channels ]
+        due = { outcome : start + n * stagger for outcome, n in zip(outcomes, slots) }
+        unsent = list(outcomes)
+        verifying = []
+        delay = initialDelay
+        nextPoll = None
+        try:
+            pump = self._sessions.get(host)
+            if pump is None or not pump.sock:
+                pump = self.pumpFactory(host, self.timeout)
+                self._sessions[host] = pump
+
+            while unsent or verifying:
+                now = self.clock()
+                ready = [ o for o in unsent if due[o] <= now ]
+                if ready:
+                    unsent = [ o for o in unsent if due[o] > now ]
+                    verifying.extend(self._command(pump, ready, enable, start))
+                    # Transitions are expected soon after a command
+                    delay = initialDelay
+                    nextPoll = self.clock() + delay
+                elif verifying and self.clock() >= nextPoll:
+                    verifying = self._verify(pump, verifying, enable, verifyTimeout)
+                    delay = min(delay * backoff, maxDelay)
+                    nextPoll = self.clock() + delay
+
+                wakeup = [ due[o] for o in unsent ]
+                if verifying:
+                    wakeup.append(nextPoll)
+                if wakeup:
+                    remaining = min(wakeup) - self.clock()
+                    if remaining > 0:
+                        self.sleep(remaining)
+        except Exception as e:
+            self._dropSession(host)
+            for outcome in outcomes:
+                if outcome.outcome is None:
+                    outcome.outcome = OUTCOME_FAILED
+                    outcome.error = "{}: {}".format(type(e).__name__, e)
+        return outcomes
+
+    def _command(self, pump, outcomes, enable, start):
+        '''Sends the commands of several channels in one batch, returns the
+        channels that have not been rejected (and thus have to be verified)'''
+        code = "37" if enable else "38"
+        sentAt = self.clock()
+        replies = pump.sendCommands([ "{} {}".format(code, o.pumpIndex) for o in outcomes ])
+        acknowledged = self.clock()
+        if not pump.sock:
+            raise ConnectionError("Connection to controller lost")
+
+        accepted = []
+        for outcome, reply in zip(outcomes, replies):
+            outcome._sentAt = sentAt
+            outcome.sent = sentAt - start
+            if reply is False:
+                # Unknown whether the controller executed the command
+                outcome.error = "Command not acknowledged"
+                accepted.append(outcome)
+            elif reply.startswith("OK"):
+                outcome.timeToAck = acknowledged - sentAt
+                accepted.append(outcome)
+            else:
+                outcome.outcome = OUTCOME_REJECTED
+                outcome.error = reply
+        return accepted
+
+    def _verify(self, pump, outcomes, enable, verifyTimeout):
+        '''Reads the state of all channels in one batch, returns the channels
+        that are still unconfirmed'''
+        requests = [ ("getHighVoltageStatus", o.pumpIndex) for o in outcomes ]
+        requests.extend(("getSupplyStatus", o.pumpIndex) for o in outcomes)
+        values = pump.batch(requests)
+        now = self.clock()
+        if not pump.sock:
+            raise ConnectionError("Connection to controller lost")
+
+        pending = []
+        for outcome, highVoltage, status in zip(outcomes, values, values[len(outcomes):]):
+            outcome.polls = outcome.polls + 1
+            outcome.highVoltage = highVoltage
+            outcome.supplyStatus = status
+            if highVoltage is enable:
+                outcome.outcome = OUTCOME_CONFIRMED
+                outcome.timeToConfirm = now - outcome._sentAt
+            elif enable and status == "NO PUMP":
+                outcome.outcome = OUTCOME_NO_PUMP
+                outcome.error = "Channel not populated"
+            elif now - outcome._sentAt >= verifyTimeout:
+                outcome.outcome = OUTCOME_TIMEOUT
+                outcome.error = "State not confirmed after {:.1f} s".format(now - outcome._sentAt)
+            else:
+                pending.append(outcome)
+        return pending
@@ -0,0 +1,75 @@
+'''GammaIonPump sessions that can be shared between threads
+
+``ThreadSafeGammaIonPump`` serializes all access to the connection with a
+lock, so any number of threads can use one session without a global lock.
+Identical queries requested by several threads at the same time are
+coalesced: while a query (for example pressure of pump 2) is in flight or
+waiting for the connection, other threads asking for the same reading wait
+for that single reply instead of queueing duplicate round trips. Every
+thread still gets a reply that was read after it issued its request.
+Only read queries (``decoders.READ_CODES``) are coalesced - ``enable``,
+``disable`` and any other command are always sent once per call. Whole
+batches (and thus ``snapshot``) are coalesced if they consist of the same
+queries.
+
+``ThreadSafeReconnectingGammaIonPump`` adds the same behaviour to
+``ReconnectingGammaIonPump``.
+'''
+import threading
+
+from .gammaionctl import GammaIonPump
+from .session import ReconnectingGammaIonPump
+from .coalesce import RequestCoalescer
+from .decoders import isRead
+
+class ThreadSafeMixin:
+    '''Locking and coalescing of _transact and _sendBatch'''
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.RLock()
+        self._owner = None
+        self._historyLock = threading.Lock()
+        self.coalescer = RequestCoalescer()
+        super().__init__(*args, **kwargs)
+
+    def _locked(self, function, *args):
+        with self._lock:
+            self._owner = threading.get_ident()
+            try:
+                return function(*args)
+            finally:
+                self._owner = None
+
+    def _transact(self, command):
+        transact = super()._transact
+        # Nested call from a batch that already owns the connection
+        if self._owner == threading.get_ident():
+            return transact(command)
+        if not isRead(command):
+            return self._locked(transact, command)
+        return self.coalescer.execute(command, lambda: self._locked(transact, command))
+
+    def _sendBatch(self, commands):
+        sendBatch = super()._sendBatch
+        if self._owner == threading.get_ident():
+            return sendBatch(commands)
+        if not all(isRead(command) for command in commands):
+            return self._locked(sendBatch, commands)
+        return list(self.coalescer.execute(tuple(commands), lambda: self._locked(sendBatch, commands)))
+
+    def close(self):
+        with self._lock:
+            super().close()
+
+    def _record(self, metric, pumpIndex, value, units=None):
+        with self._historyLock:
+            super()._record(metric, pumpIndex, value, units)
+
+    def _recordSnapshot(self, snapshot):
+        with self._historyLock:
+            super()._recordSnapshot(snapshot)
+
+class ThreadSafeGammaIonPump(ThreadSafeMixin, GammaIonPump):
+    pass
+
+class ThreadSafeReconnectingGammaIonPump(ThreadSafeMixin, ReconnectingGammaIonPump):
+    pass
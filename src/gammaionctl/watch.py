@@ -0,0 +1,148 @@
+'''Continuous sampling of controller readings
+
+``Watcher`` samples a fixed set of metrics over one persistent connection
+at a fixed interval. All metrics of a sample are fetched as one pipelined
+batch. The schedule is based on absolute deadlines (``start + n *
+interval``) so the cadence does not drift with the time spent on each
+sample; ticks that have been missed entirely (for example because the
+controller stalled) are skipped instead of being fired in a burst.
+
+Samples are written as CSV or JSON lines to a stream or to a size based
+rotating file.
+'''
+import json
+import os
+import time
+
+# CLI command -> (GammaIonPump getter, column prefix)
+WATCH_METRICS = {
+    "pres" : ("getPressure", "pres"),
+    "volt" : ("getVoltage", "volt"),
+    "cur" : ("getCurrent", "cur"),
+    "size" : ("getPumpSize", "size"),
+    "status" : ("getSupplyStatus", "status")
+}
+
+class RotatingOutput:
+    '''Text file that is rotated after reaching maxBytes
+
+    Rotated files are renamed to ``name.1`` ... ``name.N`` (``backupCount``),
+    the oldest one is removed. A ``header`` line is written at the start of
+    every new file.
+    '''
+    def __init__(self, filename, maxBytes=0, backupCount=5, header=None):
+        self.filename = filename
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.header = header
+        self._file = None
+        self._open()
+
+    def _open(self):
+        self._file = open(self.filename, "a")
+        if self.header is not None and self._file.tell() == 0:
+            self._file.write(self.header)
+
+    def _rotate(self):
+        self._file.close()
+        if self.backupCount > 0:
+            for n in range(self.backupCount - 1, 0, -1):
+                source = "{}.{}".format(self.filename, n)
+                if os.path.exists(source):
+                    os.replace(source, "{}.{}".format(self.filename, n + 1))
+            os.replace(self.filename, self.filename + ".1")
+        else:
+            os.remove(self.filename)
+        self._open()
+
+    def write(self, data):
+        if self.maxBytes > 0 and self._file.tell() + len(data) > self.maxBytes and self._file.tell() > 0:
+            self._rotate()
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class Watcher:
+    '''Samples metrics of one controller at a fixed interval
+
+    Parameters:
+        pump        Connected GammaIonPump
+        metrics     List of (command, pumpIndex) tuples, command being one
+                    of the keys of WATCH_METRICS
+        interval    Sampling interval in seconds
+        fmt         "csv" or "json"
+    '''
+    def __init__(self, pump, metrics, interval=1.0, fmt="csv"):
+        if fmt not in ("csv", "json"):
+            raise ValueError("Unsupported output format {}".format(fmt))
+        self.pump = pump
+        self.metrics = list(metrics)
+        self.interval = interval
+        self.fmt = fmt
+        self.columns = [ "{}{}".format(WATCH_METRICS[command][1], pumpIndex) for command, pumpIndex in self.metrics ]
+        self.requests = [ (WATCH_METRICS[command][0], pumpIndex) for command, pumpIndex in self.metrics ]
+        self.skipped = 0
+
+    def header(self):
+        if self.fmt == "csv":
+            return ",".join([ "timestamp" ] + self.columns) + "\n"
+        return None
+
+    def sample(self):
+        '''Returns (timestamp, values) of a single sample'''
+        timestamp = time.time()
+        return timestamp, self.pump.batch(self.requests)
+
+    @staticmethod
+    def _csvValue(value):
+        if value is None or value is False:
+            return ""
+        if value is True:
+            return "1"
+        if isinstance(value, float):
+            return "{:e}".format(value)
+        return str(value).replace(",", " ")
+
+    def format(self, timestamp, values):
+        if self.fmt == "csv":
+            return ",".join([ "{:.3f}".format(timestamp) ] + [ self._csvValue(v) for v in values ]) + "\n"
+        record = { "timestamp" : round(timestamp, 3) }
+        for column, value in zip(self.columns, values):
+            record[column] = None if value is False else value
+        return json.dumps(record) + "\n"
+
+    def run(self, output, count=None):
+        '''Samples until count samples have been written (forever if None)
+
+        Returns the number of samples written. Stops early if the
+        connection to the controller has been lost.
+        '''
+        start = time.monotonic()
+        tick = 0
+        written = 0
+        while (count is None) or (written < count):
+            timestamp, values = self.sample()
+            output.write(self.format(timestamp, values))
+            output.flush()
+            written = written + 1
+            if not self.pump.sock:
+                break
+
+            # Absolute deadlines avoid cumulative drift; missed ticks are skipped
+            tick = tick + 1
+            now = time.monotonic()
+            deadline = start + tick * self.interval
+            if deadline < now:
+                missed = int((now - deadline) / self.interval) + 1
+                self.skipped = self.skipped + missed
+                tick = tick + missed
+                deadline = start + tick * self.interval
+            if (count is None) or (written < count):
+                time.sleep(deadline - now)
+        return written
@@ -0,0 +1,121 @@
+'''Unit tests for the pump down and leak rate analysis
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import math
+import random
+import time
+import unittest
+from array import array
+from unittest import mock
+from gammaionctl import analysis
+from gammaionctl.analysis import (analyzeChannels, fitPumpDown, flagAnomalies, rateOfRise, timeToTarget,
+                                  FLAG_MISSING, FLAG_SPIKE, FLAG_STEP)
+
+START = 1700000000.0
+
+def pumpDown(count=3600, amplitude=1e-2, exponent=1.3, noise=0.01, seed=1):
+    '''One sample per second after START, every 10th reading missing'''
+    rng = random.Random(seed)
+    timestamps = [ START + n for n in range(1, count + 1) ]
+    pressures = [ amplitude * (t - START) ** (-exponent) * 10 ** rng.gauss(0, noise) for t in timestamps ]
+    for n in range(0, count, 10):
+        pressures[n] = None
+    return timestamps, pressures
+
+class TestAnalysis(unittest.TestCase):
+    def test_pump_down_fit(self):
+        timestamps, pressures = pumpDown()
+        fit = fitPumpDown(timestamps, pressures, start=START)
+        self.assertAlmostEqual(fit.exponent, 1.3, places=2)
+        self.assertAlmostEqual(math.log10(fit.amplitude), -2, places=1)
+        self.assertEqual(fit.samples, 3240)
+        self.assertLess(fit.rms, 0.02)
+        self.assertAlmostEqual(fit.predict(START + 100) / (1e-2 * 100 ** -1.3), 1.0, places=1)
+        self.assertIsNone(fit.predict(START))
+
+    def test_time_to_target(self):
+        timestamps, pressures = pumpDown()
+        # 1e-2 * t^-1.3 = 1e-7 at t = 1e5^(1/1.3)
+        expected = 1e5 ** (1 / 1.3) - 3600
+        remaining = timeToTarget(timestamps, pressures, 1e-7, start=START, since=START + 1800)
+        self.assertLess(abs(remaining - expected) / expected, 0.1)
+        self.assertEqual(timeToTarget(timestamps, pressures, 1.0), 0.0)
+        self.assertIsNone(timeToTarget(timestamps, [ None ] * len(timestamps), 1e-7))
+
+        # Pressure not falling
+        self.assertIsNone(timeToTarget(timestamps, [ 1e-6 + 1e-10 * n for n in range(len(timestamps)) ], 1e-7))
+
+    def test_rate_of_rise(self):
+        timestamps = [ START + 0.5 * n for n in range(600) ]
+        pressures = [ 1e-8 + 2e-10 * (t - START) for t in timestamps ]
+        pressures[17] = None
+        rise = rateOfRise(timestamps, pressures, volume=10.0)
+        self.assertAlmostEqual(rise.slope / 2e-10, 1.0, places=6)
+        self.assertAlmostEqual(rise.leakRate / 2e-9, 1.0, places=6)
+        self.assertAlmostEqual(rise.r2, 1.0, places=6)
+        self.assertEqual(rise.samples, 599)
+
+        rise = rateOfRise(timestamps, pressures, start=START + 100, end=START + 200)
+        self.assertEqual(rise.samples, 201)
+        self.assertIsNone(rise.leakRate)
+        self.assertIsNone(rateOfRise(timestamps[:1], pressures[:1]))
+
+    def test_flags(self):
+        rng = random.Random(2)
+        values = [ 1e-8 * 10 ** rng.gauss(0, 0.002) for _ in range(200) ]
+        values[50] = 1e-6
+        values[51] = None
+        values[120:] = [ v * 30 for v in values[120:] ]
+        flags = list(flagAnomalies(values))
+        self.assertEqual(flags[50], FLAG_SPIKE)
+        self.assertEqual(flags[51], FLAG_MISSING)
+        self.assertEqual(flags[120], FLAG_STEP)
+        self.assertEqual(sum(1 for f in flags if f), 3)
+
+        # Linear readings like currents, zero is a valid reading
+        flags = list(flagAnomalies([ 0.0, 1.0, 1.1, 1.0, 1.05, 9.0, 1.0, 1.02, 0.98 ], logarithmic=False, minDeviation=0.5))
+        self.assertEqual(flags, [ 0, 0, 0, 0, 0, FLAG_SPIKE, 0, 0, 0 ])
+
+    def test_channels(self):
+        timestamps, pressures = pumpDown(count=1200)
+        spiked = list(pressures)
+        spiked[601] = 1e-3
+        results = analyzeChannels(array('d', timestamps), { 1 : pressures, 2 : spiked, 4 : [ None ] * 1200 },
+                                  target=1e-7, volume=5.0)
+        self.assertEqual(set(results), { 1, 2, 4 })
+        self.assertFalse(results[4].available)
+        self.assertEqual(results[4].flags, FLAG_MISSING)
+        self.assertIsNone(results[4].fit)
+
+        self.assertTrue(results[1].available)
+        self.assertEqual(results[1].missing, 120)
+        self.assertEqual(results[2].spikes, 1)
+        self.assertEqual(results[2].flags, FLAG_MISSING | FLAG_SPIKE)
+        self.assertAlmostEqual(results[2].fit.exponent, results[1].fit.exponent, places=3)
+        self.assertGreater(results[1].timeToTarget, 0)
+        self.assertLess(results[1].rise.slope, 0)
+
+    def test_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            fitPumpDown([ 1.0, 2.0 ], [ 1.0 ])
+
+class TestAnalysisWithoutNumpy(TestAnalysis):
+    '''Same tests using the pure Python implementation'''
+    def setUp(self):
+        patcher = mock.patch.object(analysis, "numpy", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+@unittest.skipIf(analysis.numpy is None, "NumPy not installed")
+class TestAnalysisPerformance(unittest.TestCase):
+    def test_million_samples(self):
+        numpy = analysis.numpy
+        timestamps = START + numpy.arange(1, 1000001, dtype=numpy.float64)
+        pressures = 1e-2 * (timestamps - START) ** -1.3
+        pressures[::100] = numpy.nan
+        t = time.perf_counter()
+        results = analyzeChannels(timestamps, { 1 : pressures, 2 : pressures * 2 }, target=1e-10)
+        self.assertLess(time.perf_counter() - t, 2.0)
+        self.assertAlmostEqual(results[2].fit.exponent, 1.3, places=3)
@@ -0,0 +1,102 @@
+'''Unit tests for the asyncio client
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import asyncio
+import unittest
+from gammaionctl import AsyncGammaIonPump
+
+class FakeWriter:
+    def __init__(self, reader, replies):
+        self.reader = reader
+        self.replies = replies
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+        if self.replies:
+            self.reader.feed_data(self.replies.pop(0))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+class TestAsyncPump(unittest.TestCase):
+    async def _connect(self, replies, timeout=2):
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'>')
+        writer = FakeWriter(reader, [ bytes(r, 'ascii') for r in replies ])
+        pump = AsyncGammaIonPump(host=None, connection=(reader, writer), timeout=timeout)
+        return await pump.connect(), writer
+
+    def test_getters(self):
+        async def scenario():
+            pump, writer = await self._connect([
+                'OK 00 PUMPITY\r\r>',
+                'OK 00 1.9E-10 Torr\r\r>',
+                'OK 00 7000\r\r>',
+                'OK 00 9.0E-08 AMPS\r\r>',
+                'OK 00 YES\r\r>',
+            ])
+            async with pump:
+                self.assertEqual(await pump.identify(), 'PUMPITY')
+                self.assertEqual(await pump.getPressureWithUnits(1), (1.9e-10, 'Torr'))
+                self.assertEqual(await pump.getVoltage(1), 7000)
+                self.assertAlmostEqual(await pump.getCurrent(2), 9.0e-8)
+                self.assertTrue(await pump.getHighVoltageStatus(2))
+            self.assertEqual(writer.written[3], b'spc 0A 2\r\n')
+            self.assertFalse(pump.connected)
+        run(scenario())
+
+    def test_error_reply(self):
+        async def scenario():
+            pump, _ = await self._connect(['ER\r\r>'])
+            self.assertFalse(await pump.enable(1))
+            self.assertTrue(pump.connected)
+        run(scenario())
+
+    def test_deadline(self):
+        async def scenario():
+            pump, _ = await self._connect([])
+            self.assertIsNone(await pump.getVoltage(1, timeout=0.01))
+            self.assertFalse(pump.connected)
+            with self.assertRaises(ConnectionError):
+                await pump.getVoltage(1)
+        run(scenario())
+
+    def test_deadline_of_queued_command(self):
+        async def scenario():
+            pump, writer = await self._connect([])
+            first = asyncio.ensure_future(pump.getVoltage(1, timeout=0.01))
+            second = asyncio.ensure_future(pump.getVoltage(2))
+            self.assertIsNone(await first)
+            with self.assertRaises(ConnectionError):
+                await second
+            self.assertEqual(writer.written, [ b'spc 0C 1\r\n' ])
+        run(scenario())
+
+    def test_deadline_includes_waiting(self):
+        async def scenario():
+            pump, writer = await self._connect([])
+            first = asyncio.ensure_future(pump.getVoltage(1, timeout=5))
+            await asyncio.sleep(0)
+            second = await asyncio.wait_for(pump.getVoltage(2, timeout=0.01), 1)
+            self.assertIsNone(second)
+            self.assertTrue(pump.connected)
+            writer.reader.feed_data(b'OK 00 7000\r\r>')
+            self.assertEqual(await first, 7000)
+            self.assertEqual(writer.written, [ b'spc 0C 1\r\n' ])
+        run(scenario())
@@ -0,0 +1,28 @@
+'''Smoke test of the benchmark harness
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from gammaionctl.bench import run, percentile
+from gammaionctl.simulator import QPCSimulator
+
+class TestBench(unittest.TestCase):
+    def test_percentile(self):
+        samples = list(range(101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([ 1, 2, 3, 4 ], 50), 2)
+        self.assertEqual(percentile(list(range(1, 21)), 95), 19)
+        self.assertEqual(percentile([ 1, 2, 3 ], 0), 1)
+        self.assertEqual(percentile([ 1, 2, 3 ], 100), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_run(self):
+        with QPCSimulator() as simulator:
+            results = run("127.0.0.1", simulator.port, 20, [ 2 ])
+        self.assertIn("single.getVoltage", results)
+        self.assertIn("sweep.snapshot", results)
+        self.assertIn("parallel.2", results)
+        self.assertEqual(results["single.getVoltage"]["sendPerReply"], 1.0)
+        self.assertLess(results["sweep.snapshot"]["sendPerReply"], 1.0)
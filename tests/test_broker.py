@@ -0,0 +1,113 @@
+'''Unit tests for the connection sharing broker
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from gammaionctl.broker import Broker, BrokerGammaIonPump
+from gammaionctl.coalesce import RequestCoalescer
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+
+class TestRequestCoalescer(unittest.TestCase):
+    def test_concurrent_identical_requests(self):
+        coalescer = RequestCoalescer()
+        release = threading.Event()
+        calls = []
+
+        def query():
+            calls.append(1)
+            release.wait()
+            return len(calls)
+
+        results = []
+        threads = [ threading.Thread(target=lambda: results.append(coalescer.execute("0B 1", query))) for _ in range(5) ]
+        for thread in threads:
+            thread.start()
+        while coalescer.coalesced < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [ 1 ] * 5)
+        self.assertEqual(coalescer.execute("0B 1", query), 2)
+
+    def test_error_propagated(self):
+        coalescer = RequestCoalescer()
+        def failing():
+            raise ConnectionError("lost")
+        with self.assertRaises(ConnectionError):
+            coalescer.execute("01", failing)
+        self.assertEqual(coalescer.inflight(), 0)
+
+class TestBroker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.simulator = QPCSimulator(SimulatedController(seed=1))
+        self.host = "127.0.0.1:{}".format(self.simulator.start())
+        self.broker = Broker([ self.host ], self.directory)
+        self.broker.start()
+
+    def tearDown(self):
+        self.broker.stop()
+        self.simulator.stop()
+        shutil.rmtree(self.directory)
+
+    def test_clients_share_session(self):
+        path = self.broker.socketPath(self.host)
+        clients = [ BrokerGammaIonPump(path) for _ in range(3) ]
+        try:
+            for client in clients:
+                self.assertEqual(client.identify(), "DIGITEL QPC")
+                self.assertIsNotNone(client.getPressure(1))
+            snap = clients[0].snapshot()
+            self.assertTrue(snap.ok)
+            self.assertTrue(clients[1].disable(2))
+            self.assertEqual(clients[2].getSupplyStatus(2), "STANDBY")
+        finally:
+            for client in clients:
+                client.close()
+        self.assertEqual(self.simulator.connections, 1)
+
+    def test_unknown_command_passed_once(self):
+        client = BrokerGammaIonPump(self.broker.socketPath(self.host))
+        try:
+            self.assertEqual(client.identify(), "DIGITEL QPC")
+            commands = self.simulator.controller.commands
+            self.assertEqual(client.sendCommands([ "99 1" ]), [ "ER 02 INVALID COMMAND" ])
+            self.assertTrue(client.sock)
+            self.assertEqual(self.simulator.controller.commands, commands + 1)
+            self.assertEqual(client.sendCommand("0D 2"), "OK 00 RUNNING\r\r")
+        finally:
+            client.close()
+
+    def test_socket_mode(self):
+        path = self.broker.socketPath(self.host)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+
+    def test_refuses_to_replace_file(self):
+        broker = Broker([ "127.0.0.1:1" ], self.directory, timeout=0.5)
+        path = broker.socketPath("127.0.0.1:1")
+        with open(path, "w") as f:
+            f.write("data")
+        with self.assertRaises(FileExistsError):
+            broker.start()
+        broker.stop()
+        with open(path) as f:
+            self.assertEqual(f.read(), "data")
+
+    def test_controller_unreachable(self):
+        broker = Broker([ "127.0.0.1:1" ], self.directory, timeout=0.5)
+        broker.start()
+        try:
+            client = BrokerGammaIonPump(broker.socketPath("127.0.0.1:1"))
+            self.assertFalse(client.getPressure(1))
+            self.assertTrue(client.sock)
+            client.close()
+        finally:
+            broker.stop()
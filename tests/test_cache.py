@@ -0,0 +1,80 @@
+'''Unit tests for the command cache
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.cache import CommandCache
+from test_pump import FakeConnection, FakeClock
+
+class RecordingConnection(FakeConnection):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+class TestCommandCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = CommandCache(clock=self.clock, maxEntries=2)
+
+    def test_ttl(self):
+        self.cache.store("11 1", b'OK 00 300 L/S\r\r>')
+        self.assertEqual(self.cache.get("11 1"), b'OK 00 300 L/S\r\r>')
+        self.clock.now = 3601.0
+        self.assertIsNone(self.cache.get("11 1"))
+        self.assertEqual(self.cache.statistics()["hits"], 1)
+        self.assertEqual(self.cache.statistics()["misses"], 1)
+
+    def test_only_ok_and_configured(self):
+        self.cache.store("11 1", b'ER 01\r\r>')
+        self.cache.store("0B 1", b'OK 00 1.0E-09 MBAR\r\r>')
+        self.assertEqual(len(self.cache), 0)
+        self.assertIsNone(self.cache.get("0B 1"))
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_lru_and_invalidation(self):
+        self.cache.store("11 1", b'OK 00 300 L/S\r\r>')
+        self.cache.store("0D 1", b'OK 00 RUNNING\r\r>')
+        self.cache.store("11 2", b'OK 00 300 L/S\r\r>')
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNone(self.cache.get("11 1"))
+        self.cache.store("38 1", b'OK 00\r\r>')
+        self.assertIsNone(self.cache.get("0D 1"))
+        self.assertIsNotNone(self.cache.get("11 2"))
+
+class TestCachedPump(unittest.TestCase):
+    def setUp(self):
+        self.connection = RecordingConnection()
+        self.connection.set_response('>')
+        self.pump = GammaIonPump(host=None, connection=self.connection)
+        self.pump.setCache(CommandCache())
+
+    def test_identity_served_from_cache(self):
+        self.connection.set_response('OK 00 DIGITEL QPC\r\r>')
+        self.assertEqual(self.pump.identify(), 'DIGITEL QPC')
+        self.assertEqual(self.pump.identify(), 'DIGITEL QPC')
+        self.assertEqual(len(self.connection.sent), 1)
+        self.assertEqual(self.pump.cache.hits, 1)
+
+    def test_batch_mixes_cached_and_sent(self):
+        self.connection.set_response('OK 00 300 L/S\r\r>')
+        self.pump.getPumpSize(1)
+        self.connection.sent = []
+        self.connection.set_response('OK 00 1.0E-09 MBAR\r\r>')
+        result = self.pump.batch([ ("getPumpSize", 1), ("getPressure", 1) ])
+        self.assertEqual(result, [ 300, 1.0e-9 ])
+        self.assertEqual(self.connection.sent, [ b'spc 0B 1\r\n' ])
+
+    def test_switch_in_batch_bypasses_cache(self):
+        self.connection.set_response('OK 00 RUNNING\r\r>')
+        self.assertEqual(self.pump.getSupplyStatus(1), 'RUNNING')
+        self.connection.set_response('OK 00\r\r>OK 00 STANDBY\r\r>')
+        result = self.pump.batch([ ("disable", 1), ("getSupplyStatus", 1) ])
+        self.assertEqual(result, [ True, 'STANDBY' ])
+        self.connection.set_response('OK 00\r\r>')
+        self.assertTrue(self.pump.enable(1))
+        self.assertEqual(len(self.pump.cache), 0)
@@ -0,0 +1,115 @@
+'''Unit tests for session recording and replay
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import os
+import socket
+import tempfile
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.bench import benchReplay
+from gammaionctl.capture import (CaptureWriter, ReplayConnection, ReplayMismatch, readCapture, recordConnection,
+                                 replayRequests, EVENT_RECV, EVENT_SEND, EVENT_TIMEOUT)
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".qcap")
+        os.close(fd)
+        with QPCSimulator(SimulatedController(pumps=(40, 40, 40, 0), seed=3)) as simulator:
+            pump = GammaIonPump(None, connection=recordConnection("127.0.0.1", self.filename, port=simulator.port))
+            self.identity = pump.identify()
+            self.pressure = pump.getPressure(1)
+            self.snapshot = pump.snapshot((1, 2))
+            self.disabled = pump.disable(2)
+            pump.close()
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_recording(self):
+        capture = readCapture(self.filename)
+        self.assertEqual(capture.events[0].kind, EVENT_RECV)
+        self.assertEqual(capture.requests()[:2], [ [ "01" ], [ "0B 1" ] ])
+        self.assertEqual(len(capture.requests()[2]), 10)
+        self.assertEqual(capture.requests()[3], [ "38 2" ])
+        offsets = [ e.offset for e in capture ]
+        self.assertEqual(offsets, sorted(offsets))
+
+    def test_replay(self):
+        connection = ReplayConnection(self.filename, strict=True)
+        pump = GammaIonPump(None, connection=connection)
+        self.assertEqual(pump.identify(), self.identity)
+        self.assertEqual(pump.getPressure(1), self.pressure)
+        snapshot = pump.snapshot((1, 2))
+        self.assertEqual([ c.pressure for c in snapshot ], [ c.pressure for c in self.snapshot ])
+        self.assertEqual(pump.disable(2), self.disabled)
+        self.assertTrue(connection.exhausted)
+        self.assertEqual(connection.mismatches, 0)
+
+    def test_end_of_recording(self):
+        connection = ReplayConnection(self.filename)
+        pump = GammaIonPump(None, connection=connection)
+        replayRequests(self.filename, pump)
+        self.assertEqual(connection.mismatches, 0)
+        self.assertFalse(pump.getVoltage(1))
+        self.assertFalse(pump.sock)
+
+    def test_replay_requests(self):
+        capture = readCapture(self.filename)
+        results = replayRequests(capture, GammaIonPump(None, connection=ReplayConnection(capture, strict=True)))
+        self.assertEqual(results[0], ("01", self.identity))
+        self.assertEqual(results[1][1][0], self.pressure)
+        self.assertEqual(len(results), 13)
+
+    def test_mismatch(self):
+        pump = GammaIonPump(None, connection=ReplayConnection(self.filename, strict=True))
+        with self.assertRaises(ReplayMismatch):
+            pump.getVoltage(1)
+
+        connection = ReplayConnection(self.filename)
+        pump = GammaIonPump(None, connection=connection)
+        # The recorded reply is delivered anyway
+        self.assertTrue(pump.sendCommand("0C 1").startswith("OK 00 " + self.identity))
+        self.assertEqual(connection.mismatches, 1)
+
+    def test_realtime(self):
+        now = [ 0.0 ]
+        sleeps = []
+        def sleep(delay):
+            sleeps.append(delay)
+            now[0] = now[0] + delay
+
+        writer = CaptureWriter(self.filename, clock=lambda: now[0])
+        writer.record(EVENT_RECV, b'\r\n>')
+        now[0] = 1.0
+        writer.record(EVENT_SEND, b'spc 01\r\n')
+        now[0] = 1.5
+        writer.record(EVENT_RECV, b'OK 00 DIGITEL QPC\r\r>')
+        now[0] = 2.0
+        writer.record(EVENT_SEND, b'spc 0C 1\r\n')
+        now[0] = 4.0
+        writer.record(EVENT_TIMEOUT, b'timeout')
+        writer.close()
+
+        now[0] = 100.0
+        pump = GammaIonPump(None, connection=ReplayConnection(self.filename, realtime=True, speed=2.0,
+                                                              clock=lambda: now[0], sleep=sleep))
+        self.assertEqual(pump.identify(), "DIGITEL QPC")
+        self.assertEqual(sleeps, [ 0.25 ])
+        with self.assertRaises(socket.timeout):
+            pump.getVoltage(1)
+        self.assertEqual(sleeps, [ 0.25, 1.0 ])
+
+    def test_truncated(self):
+        with open(self.filename, "ab") as f:
+            f.write(b'\x00\x00')
+        size = len(readCapture(self.filename))
+        with open(self.filename, "r+b") as f:
+            f.truncate(os.path.getsize(self.filename) - 5)
+        self.assertEqual(len(readCapture(self.filename)), size - 1)
+
+    def test_bench(self):
+        results = benchReplay(self.filename, 3)
+        self.assertEqual(results["replay"]["replies"], 39)
@@ -0,0 +1,153 @@
+'''Unit tests for the command line utility
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from gammaionctl.gammaioncli import gammaioncli, parseCommands, UsageError, COMMANDS
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+
+class TestParseCommands(unittest.TestCase):
+    def test_single_pass(self):
+        commands = parseCommands([ "id", "pres", "1", "sleep", "0.5", "off", "4" ])
+        self.assertEqual([ (c.name, arg) for c, arg in commands ], [ ("id", None), ("pres", 1), ("sleep", 0.5), ("off", 4) ])
+        self.assertIs(commands[0][0], COMMANDS["id"])
+
+    def test_errors(self):
+        for tokens, message in ((["pres"], "Missing pump index for preassure query"),
+                                (["cur", "x"], "Failed to interpret pump index x"),
+                                (["on", "5"], "Invalid pump index 5"),
+                                (["frobnicate"], "Unsupported command or setting frobnicate")):
+            with self.assertRaises(UsageError) as context:
+                parseCommands(tokens)
+            self.assertEqual(str(context.exception), message)
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.simulator = QPCSimulator(SimulatedController(pumps=(40, 40, 40, 0), seed=1))
+        self.port = str(self.simulator.start())
+
+    def tearDown(self):
+        self.simulator.stop()
+
+    def _run(self, argv, stdin=None):
+        output = io.StringIO()
+        code = 0
+        saved = sys.stdin
+        if stdin is not None:
+            sys.stdin = io.StringIO(stdin)
+        try:
+            with contextlib.redirect_stdout(output):
+                gammaioncli([ "--host", "127.0.0.1", "--port", self.port ] + argv)
+        except SystemExit as e:
+            code = e.code
+        finally:
+            sys.stdin = saved
+        return code, output.getvalue()
+
+    def test_command_line(self):
+        code, output = self._run([ "id", "off", "2", "status", "2" ])
+        self.assertEqual(code, 0)
+        self.assertIn("QPC Identity: DIGITEL QPC", output)
+        self.assertIn("Power pump 2: standby", output)
+        self.assertIn("Supply status of pump 2: STANDBY", output)
+
+    def test_zero_readings(self):
+        code, output = self._run([ "off", "1", "volt", "4", "cur", "1" ])
+        self.assertEqual(code, 0)
+        self.assertIn("Voltage pump 4: 0 V", output)
+        self.assertIn("Current pump 1: 0.0 mA", output)
+
+    def test_disabled_channel_is_not_a_failure(self):
+        code, output = self._run([ "off", "2", "pres", "2" ])
+        self.assertEqual(code, 0)
+        self.assertIn("Pressure pump 2: not available", output)
+        code, output = self._run([ "--host", "127.0.0.1:" + self.port, "pres", "2" ])
+        self.assertEqual(code, 0)
+        self.assertNotIn("Failed on", output)
+
+    def test_script_with_timing(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".qpc", delete=False) as f:
+            f.write("# pressure of all pumps\npres 1 pres 2\n\nvolt 3\nbogus 1\n")
+        try:
+            code, output = self._run([ "--script", f.name, "--timing" ])
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(code, 1)
+        self.assertIn("Pressure pump 2:", output)
+        self.assertIn("Voltage pump 3: ", output)
+        self.assertIn("Line 5: Unsupported command or setting bogus", output)
+        self.assertIn("Executed 3 commands", output)
+        self.assertEqual(self.simulator.connections, 1)
+
+    def test_stdin_and_failures(self):
+        code, output = self._run([ "--script", "-" ], stdin="pres 4\nsize 1\nquit\nsize 2\n")
+        self.assertEqual(code, 0)
+        self.assertIn("Pressure pump 4: not available (pump disabled or not fitted)", output)
+        self.assertIn("Size of pump 1: 40", output)
+        self.assertNotIn("pump 2", output)
+
+    def test_watch_rejects_actions(self):
+        code, output = self._run([ "watch", "on", "1", "pres", "1", "--count", "1" ])
+        self.assertEqual(code, 2)
+        self.assertIn("not on", output)
+        self.assertEqual(self.simulator.controller.commands, 0)
+
+    def test_watch(self):
+        code, output = self._run([ "watch", "pres", "1", "cur", "2", "--count", "2", "--interval", "0.01" ])
+        self.assertEqual(code, 0)
+        lines = output.splitlines()
+        self.assertEqual(lines[0], "timestamp,pres1,cur2")
+        self.assertEqual(len(lines), 3)
+
+class TestCliMultipleHosts(unittest.TestCase):
+    def setUp(self):
+        self.simulators = [ QPCSimulator(SimulatedController(pumps=(40, 40, 40, 0), seed=i)) for i in range(2) ]
+        self.hosts = [ "127.0.0.1:{}".format(simulator.start()) for simulator in self.simulators ]
+
+    def tearDown(self):
+        for simulator in self.simulators:
+            simulator.stop()
+
+    def _run(self, argv):
+        output = io.StringIO()
+        code = 0
+        try:
+            with contextlib.redirect_stdout(output):
+                gammaioncli(argv)
+        except SystemExit as e:
+            code = e.code
+        return code, output.getvalue()
+
+    def test_grouped_output(self):
+        code, output = self._run([ "--host", self.hosts[0], "--host", self.hosts[1], "id", "size", "1" ])
+        self.assertEqual(code, 0)
+        self.assertEqual(output.splitlines(), [
+            "[{}] QPC Identity: DIGITEL QPC".format(self.hosts[0]),
+            "[{}] Size of pump 1: 40.0 L/S".format(self.hosts[0]),
+            "[{}] QPC Identity: DIGITEL QPC".format(self.hosts[1]),
+            "[{}] Size of pump 1: 40.0 L/S".format(self.hosts[1])
+        ])
+
+    def test_hosts_file_with_unreachable(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("# controllers\n{}\n127.0.0.1:1\n{}\n".format(self.hosts[0], self.hosts[1]))
+        try:
+            code, output = self._run([ "--hosts-file", f.name, "--parallel", "2", "off", "3" ])
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(code, 1)
+        self.assertIn("[{}] Power pump 3: standby".format(self.hosts[0]), output)
+        self.assertIn("[{}] Power pump 3: standby".format(self.hosts[1]), output)
+        self.assertIn("[127.0.0.1:1] Communication with controller failed", output)
+        self.assertIn("Failed on 1 of 3 controllers: 127.0.0.1:1", output)
+
+    def test_modes_require_single_host(self):
+        code, output = self._run([ "--host", self.hosts[0], "--host", self.hosts[1], "shell" ])
+        self.assertEqual(code, 2)
+        self.assertIn("shell requires a single host", output)
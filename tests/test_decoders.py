@@ -0,0 +1,32 @@
+'''Unit tests for the reply decoders
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from gammaionctl.decoders import decode, commandCode
+
+class TestDecoders(unittest.TestCase):
+    def test_values(self):
+        self.assertEqual(decode("01", b'OK 00 DIGITEL QPC\r\r>'), 'DIGITEL QPC')
+        self.assertEqual(decode("0B", b'\nOK 00 1.2E-09 MBAR\r\r>'), (1.2e-9, 'MBAR'))
+        self.assertEqual(decode("0B", b'OK 00 1.3E-11 MBAR\r\r>'), (None, 'MBAR'))
+        self.assertAlmostEqual(decode("0A", b'OK 00 9.0E-08 AMPS\r\r>'), 9.0e-8)
+        self.assertEqual(decode("0C", b'OK 00 5600\r\r>'), 5600)
+        self.assertEqual(decode("11", b'OK 00 040.0 L/S\r\r>'), 40.0)
+        self.assertEqual(decode("0D", b'OK 00 RUNNING  \r\r>'), 'RUNNING')
+        self.assertTrue(decode("61", b'OK 00 YES\r\r>'))
+        self.assertFalse(decode("61", b'OK 00 NO\r\r>'))
+        self.assertTrue(decode("37", b'OK 00\r\r>'))
+
+    def test_malformed(self):
+        self.assertIsNone(decode("0A", b'OK 00\r\r>'))
+        self.assertIsNone(decode("0A", b'OK 00 9.0E-08 VOLTS\r\r>'))
+        self.assertIsNone(decode("0B", b'OK 00 1.2E-09\r\r>'))
+        self.assertIsNone(decode("0C", b'OK 00 HIGH\r\r>'))
+        self.assertIsNone(decode("11", b'ER 01\r\r>'))
+        self.assertIsNone(decode("38", b'ER\r\r>'))
+
+    def test_command_code(self):
+        self.assertEqual(commandCode("0B 1"), "0B")
+        self.assertEqual(commandCode("01"), "01")
@@ -0,0 +1,58 @@
+'''Unit tests for the channel discovery
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.discovery import ChannelMap, ChannelInfo, discover
+from gammaionctl.fleet import GammaFleet
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+from test_pump import FakeClock
+
+class TestChannelInfo(unittest.TestCase):
+    def test_populated(self):
+        self.assertTrue(ChannelInfo(1, 40, "RUNNING", True).populated)
+        self.assertFalse(ChannelInfo(1, 0, "NO PUMP", False).populated)
+        self.assertFalse(ChannelInfo(1, None, "NO PUMP", None).populated)
+        self.assertIsNone(ChannelInfo(1).populated)
+
+class TestDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.simulator = QPCSimulator(SimulatedController(pumps=(40, 0, 75, 0), seed=1))
+        self.port = self.simulator.start()
+        self.pump = GammaIonPump("127.0.0.1", port=self.port)
+
+    def tearDown(self):
+        self.pump.close()
+        self.simulator.stop()
+
+    def test_discover_and_snapshot(self):
+        channelMap = discover(self.pump)
+        self.assertEqual(channelMap.populated, (1, 3))
+        self.pump.setChannelMap(channelMap)
+        commands = self.simulator.controller.commands
+        snap = self.pump.snapshot()
+        self.assertEqual([ c.pumpIndex for c in snap ], [ 1, 3 ])
+        self.assertEqual(self.simulator.controller.commands - commands, 10)
+
+    def test_incremental_refresh(self):
+        clock = FakeClock()
+        channelMap = ChannelMap(channels=(1, 2, 3, 4), maxAge=60, clock=clock)
+        channelMap.update(ChannelInfo(1, 40, "RUNNING", True, 0.0))
+        channelMap.update(ChannelInfo(2, None, None, None, 0.0))
+        self.assertEqual(channelMap.due(), [ 2, 3, 4 ])
+        self.assertEqual([ info.pumpIndex for info in channelMap.refresh(self.pump) ], [ 2, 3, 4 ])
+        self.assertEqual(channelMap.refresh(self.pump), [])
+        clock.now = 61.0
+        self.assertEqual(channelMap.due(), [ 1, 2, 3, 4 ])
+
+    def test_fleet_discovery(self):
+        host = "127.0.0.1:{}".format(self.port)
+        with GammaFleet([ host ], metrics=("pressure",), discovery=True) as fleet:
+            fleet.poll()
+            commands = self.simulator.controller.commands
+            reading = fleet.poll()[host]
+        self.assertTrue(reading.ok)
+        self.assertEqual(sorted(reading.values), [ ("pressure", 1), ("pressure", 3) ])
+        self.assertEqual(self.simulator.controller.commands - commands, 2)
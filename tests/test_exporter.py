@@ -0,0 +1,54 @@
+'''Unit tests for the Prometheus exporter
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from gammaionctl.exporter import Exporter, MetricsServer
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        self.simulator = QPCSimulator(SimulatedController(pumps=(40, 0, 40, 40), seed=1))
+        self.host = "127.0.0.1:{}".format(self.simulator.start())
+        self.exporter = Exporter([ self.host, "127.0.0.1:1" ], interval=0.05, timeout=0.5, discovery=True)
+
+    def tearDown(self):
+        self.exporter.stop()
+        self.simulator.stop()
+
+    def test_render_from_cache(self):
+        for host in self.exporter.hosts:
+            self.exporter.pollHost(host)
+        commands = self.simulator.controller.commands
+        text = self.exporter.metrics().decode()
+        self.assertIs(self.exporter.metrics(), self.exporter.metrics())
+        self.assertEqual(self.simulator.controller.commands, commands)
+        self.assertIn('gammaion_up{{host="{}"}} 1'.format(self.host), text)
+        self.assertIn('gammaion_up{host="127.0.0.1:1"} 0', text)
+        self.assertIn('gammaion_pressure{{host="{}",pump="1",units="MBAR"}}'.format(self.host), text)
+        self.assertNotIn('pump="2"', text)
+        self.assertIn('gammaion_command_latency_seconds_bucket{{host="{}",code="0B",le="+Inf"}} 3'.format(self.host), text)
+        buckets = [ int(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+                    if line.startswith('gammaion_command_latency_seconds_bucket{{host="{}",code="0B",'.format(self.host)) ]
+        self.assertGreater(len(buckets), 2)
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_http(self):
+        server = MetricsServer(self.exporter, "127.0.0.1", 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            self.exporter.start()
+            url = "http://127.0.0.1:{}".format(server.server_address[1])
+            with urllib.request.urlopen(url + "/metrics", timeout=5) as response:
+                self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+                self.assertIn(b'# TYPE gammaion_pressure gauge', response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + "/", timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
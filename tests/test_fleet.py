@@ -0,0 +1,54 @@
+'''Unit tests for the fleet poller
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import time
+import unittest
+from gammaionctl.fleet import GammaFleet
+
+class FakePump:
+    def __init__(self, host, delay=0):
+        self.host = host
+        self.delay = delay
+        self.sock = True
+
+    def getPressure(self, pumpIndex):
+        time.sleep(self.delay)
+        return 1e-9 * pumpIndex
+
+    def getVoltage(self, pumpIndex):
+        time.sleep(self.delay)
+        return 5000
+
+    def close(self):
+        self.sock = False
+
+def factory(host, timeout):
+    if host == "dead":
+        raise ConnectionError("Failed to Connect to ion pump")
+    if host == "slow":
+        return FakePump(host, delay=0.5)
+    return FakePump(host, delay=0.05)
+
+class TestFleet(unittest.TestCase):
+    def test_poll(self):
+        hosts = [ "qpc{}".format(i) for i in range(8) ] + [ "dead" ]
+        with GammaFleet(hosts, metrics=("pressure", "voltage"), pumps=(1, 2), pumpFactory=factory) as fleet:
+            snap = fleet.poll()
+        self.assertEqual(list(snap.hosts), hosts)
+        self.assertEqual(snap.failed, [ "dead" ])
+        self.assertAlmostEqual(snap["qpc3"].get("pressure", 2), 2e-9)
+        self.assertEqual(snap["qpc3"].get("voltage", 1), 5000)
+        # Hosts are polled concurrently - 8 hosts with 4 queries of 50 ms each
+        self.assertLess(snap.duration, 8 * 4 * 0.05)
+
+    def test_slow_host_isolated(self):
+        with GammaFleet([ "fast", "slow" ], pumps=(1,), cycleTimeout=0.2, pumpFactory=factory) as fleet:
+            snap = fleet.poll()
+            self.assertTrue(snap["fast"].ok)
+            self.assertFalse(snap["slow"].ok)
+            self.assertLess(snap.duration, 0.4)
+
+            snap = fleet.poll()
+            self.assertEqual(snap["slow"].error, "Previous cycle still running")
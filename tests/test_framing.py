@@ -0,0 +1,48 @@
+'''Unit tests for the receive buffer and reply framing
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from collections import deque
+from gammaionctl.framing import ReplyBuffer, FramedReader, REPLY_DELIMITER
+
+class ChunkConnection:
+    def __init__(self, chunks):
+        self.chunks = deque(chunks)
+
+    def recv(self, buf):
+        if not self.chunks:
+            return b''
+        return self.chunks.popleft()
+
+class TestReplyBuffer(unittest.TestCase):
+    def test_split_delimiter(self):
+        buf = ReplyBuffer()
+        buf.feed(b'OK 00 YES\r')
+        self.assertIsNone(buf.nextFrame())
+        buf.feed(b'\r')
+        self.assertIsNone(buf.nextFrame())
+        buf.feed(b'>OK 00')
+        self.assertEqual(buf.nextFrame(), b'OK 00 YES\r\r>')
+        self.assertEqual(buf.pending(), b'OK 00')
+
+    def test_multiple_frames(self):
+        buf = ReplyBuffer()
+        buf.feed(b'OK 00 1\r\r>OK 00 2\r\r>')
+        self.assertEqual(buf.nextFrame(), b'OK 00 1\r\r>')
+        self.assertEqual(buf.nextFrame(), b'OK 00 2\r\r>')
+        self.assertIsNone(buf.nextFrame())
+        self.assertEqual(len(buf), 0)
+
+class TestFramedReader(unittest.TestCase):
+    def test_read_frames(self):
+        reader = FramedReader(ChunkConnection([b'>OK 00 A\r', b'\r>OK', b' 00 B\r\r>']))
+        self.assertEqual(reader.readFrame(b'>'), b'>')
+        self.assertEqual(reader.readFrame(REPLY_DELIMITER), b'OK 00 A\r\r>')
+        self.assertEqual(reader.readFrame(REPLY_DELIMITER), b'OK 00 B\r\r>')
+        self.assertEqual(reader.recvCalls, 3)
+
+    def test_closed_connection(self):
+        reader = FramedReader(ChunkConnection([b'OK 00']))
+        self.assertIsNone(reader.readFrame(REPLY_DELIMITER))
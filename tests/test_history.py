@@ -0,0 +1,97 @@
+'''Unit tests for the reading history
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import math
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.history import RingSeries, RollupSeries, PumpHistory
+from test_pump import FakeConnection
+
+class TestRingSeries(unittest.TestCase):
+    def test_eviction_and_window(self):
+        series = RingSeries(4)
+        for t in range(6):
+            series.append(float(t), t * 10.0)
+        self.assertEqual(len(series), 4)
+        self.assertEqual(series.latest(), (5.0, 50.0))
+        segments = series.segments()
+        self.assertEqual(len(segments), 2)
+        timestamps, values = series.window()
+        self.assertEqual(list(timestamps), [ 2.0, 3.0, 4.0, 5.0 ])
+        timestamps, values = series.window(3.0, 4.5)
+        self.assertEqual(list(values), [ 30.0, 40.0 ])
+
+    def test_stats_ignore_missing(self):
+        series = RingSeries(10)
+        series.append(0.0, 1.0)
+        series.append(1.0, None)
+        series.append(2.0, 3.0)
+        self.assertEqual(series.stats(), (1.0, 3.0, 2.0, 2))
+        self.assertTrue(math.isnan(series.window()[1][1]))
+        self.assertEqual(series.downsample(2.0), [ (0.0, 1.0, 1.0, 1.0, 1), (2.0, 3.0, 3.0, 3.0, 1) ])
+
+class TestRollupSeries(unittest.TestCase):
+    def test_buckets(self):
+        rollup = RollupSeries(60, 2)
+        for t in range(0, 180, 10):
+            rollup.append(float(t), float(t))
+        buckets = rollup.buckets()
+        self.assertEqual(len(buckets), 2)
+        self.assertEqual(buckets[0], (60.0, 60.0, 110.0, 85.0, 6))
+
+class TestPumpHistory(unittest.TestCase):
+    def test_memory_bound(self):
+        history = PumpHistory()
+        self.assertLess(history.nbytes(), 7 * 1024 * 1024)
+
+    def test_attached_to_pump(self):
+        fake_connection = FakeConnection()
+        fake_connection.set_response('>')
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        history = PumpHistory(capacity=10)
+        pump.setHistory(history)
+        fake_connection.set_response('OK 00 1.2E-09 MBAR\r\r>')
+        pump.getPressure(2)
+        fake_connection.set_response('OK 00 9.0E-08 AMPS\r\r>OK 00 1.3E-11 MBAR\r\r>')
+        pump.batch([ ("getCurrent", 1), ("getPressure", 1) ])
+        self.assertEqual(history.latest("pressure", 2)[1], 1.2e-9)
+        self.assertAlmostEqual(history.latest("current", 1)[1], 9.0e-8)
+        self.assertTrue(math.isnan(history.latest("pressure", 1)[1]))
+        self.assertEqual(history.units("pressure", 2), "MBAR")
+
+    def test_pressure_units(self):
+        fake_connection = FakeConnection()
+        fake_connection.set_response('>')
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        history = PumpHistory(capacity=10)
+        pump.setHistory(history)
+        fake_connection.set_response('OK 00 1.2E-09 TORR\r\r>')
+        self.assertFalse(pump.getPressure(2))
+        fake_connection.set_response('OK 00 3.4E-09 TORR\r\r>ER 01 SIMULATED ERROR\r\r>')
+        self.assertEqual(pump.batch([ ("getPressure", 3), ("getPressure", 4) ]), [ False, False ])
+        self.assertEqual(history.latest("pressure", 2)[1], 1.2e-9)
+        self.assertEqual(history.latest("pressure", 3)[1], 3.4e-9)
+        self.assertEqual(history.units("pressure", 3), "TORR")
+        self.assertIsNone(history.latest("pressure", 4))
+
+    def test_failed_reads_not_recorded(self):
+        fake_connection = FakeConnection()
+        fake_connection.set_response('>')
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        history = PumpHistory(capacity=10)
+        pump.setHistory(history)
+        fake_connection.set_response('ER 01\r\r>')
+        self.assertIsNone(pump.getVoltage(1))
+        fake_connection.set_response('ER 01\r\r>')
+        self.assertIsNone(pump.getCurrent(1))
+        fake_connection.set_response('OK 00 5600\r\r>ER 01\r\r>ER 01\r\r>OK 00 0.0E+00 AMPS\r\r>')
+        pump.batch([ ("getVoltage", 2), ("getCurrent", 2), ("getVoltage", 3), ("getCurrent", 3) ])
+        self.assertIsNone(history.latest("voltage", 1))
+        self.assertIsNone(history.latest("current", 1))
+        self.assertIsNone(history.latest("current", 2))
+        self.assertIsNone(history.latest("voltage", 3))
+        self.assertEqual(history.latest("voltage", 2)[1], 5600)
+        self.assertEqual(history.latest("current", 3)[1], 0.0)
+        self.assertEqual(len(history.series("voltage", 1)), 0)
@@ -0,0 +1,33 @@
+'''Unit tests for the host specification parsing
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import os
+import tempfile
+import unittest
+from gammaionctl.hosts import splitHost, readHostsFile
+
+class TestSplitHost(unittest.TestCase):
+    def test_forms(self):
+        for host, expected in (("10.0.0.11", ("10.0.0.11", 23)),
+                               ("10.0.0.11:2323", ("10.0.0.11", 2323)),
+                               ("qpc1.example.org:2323", ("qpc1.example.org", 2323)),
+                               ("[fd00::11]:2323", ("fd00::11", 2323)),
+                               ("[fd00::11]", ("fd00::11", 23)),
+                               ("fd00::11", ("fd00::11", 23)),
+                               ("fe80::1:23", ("fe80::1:23", 23)),
+                               ("10.0.0.11:telnet", ("10.0.0.11:telnet", 23))):
+            self.assertEqual(splitHost(host), expected)
+        self.assertEqual(splitHost("10.0.0.11", 2323), ("10.0.0.11", 2323))
+
+class TestReadHostsFile(unittest.TestCase):
+    def test_comments(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".hosts", delete=False) as f:
+            f.write("# rack 1\n10.0.0.11\n\n[fd00::12]:2323  # spare\n")
+        try:
+            self.assertEqual(readHostsFile(f.name), [ "10.0.0.11", "[fd00::12]:2323" ])
+        finally:
+            os.unlink(f.name)
+        with self.assertRaises(OSError):
+            readHostsFile(f.name)
@@ -0,0 +1,60 @@
+'''Unit tests for the instrumentation hooks
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import json
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.instrumentation import Instrumentation, LatencyHistogram
+from test_pump import FakeConnection
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_buckets(self):
+        histogram = LatencyHistogram((0.001, 0.01))
+        for latency in (0.0005, 0.002, 0.003, 0.5):
+            histogram.observe(latency)
+        self.assertEqual(histogram.counts, [ 1, 2, 1 ])
+        self.assertEqual(histogram.percentile(50), 0.01)
+        self.assertEqual(histogram.percentile(100), 0.5)
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.connection.set_response('>')
+        self.pump = GammaIonPump(host=None, connection=self.connection)
+        self.instrumentation = Instrumentation()
+        self.pump.setInstrumentation(self.instrumentation)
+        self.events = []
+        self.instrumentation.addHook(self.events.append)
+
+    def test_single_commands(self):
+        self.connection.set_response('OK 00 1.0E-09 MBAR\r\r>')
+        self.pump.getPressure(1)
+        self.connection.set_response('ER 01\r\r>')
+        self.pump.getPressure(1)
+        statistics = self.instrumentation.statistics(None, "0B")
+        self.assertEqual(statistics.commands, 2)
+        self.assertEqual(statistics.errors, 1)
+        self.assertEqual(statistics.bytesSent, 2 * len(b'spc 0B 1\r\n'))
+        self.assertEqual(statistics.bytesReceived, len(b'OK 00 1.0E-09 MBAR\r\r>') + len(b'ER 01\r\r>'))
+        self.assertEqual(statistics.recvCalls, statistics.bytesReceived)
+        self.assertEqual(statistics.latency.count, 2)
+        self.assertEqual([ e.ok for e in self.events ], [ True, False ])
+
+    def test_pipelined_and_disconnect(self):
+        self.connection.set_response('OK 00 1.0E-09 MBAR\r\r>OK 00 5600\r\r>')
+        self.connection.response.append(b'')
+        self.pump.batch([ ("getPressure", 1), ("getVoltage", 1), ("getCurrent", 1) ])
+        self.assertEqual(self.instrumentation.statistics(None, "0C").commands, 1)
+        self.assertEqual(self.instrumentation.statistics(None, "0A").failures, 1)
+        self.assertEqual(self.instrumentation.disconnects(None), 1)
+        snapshot = json.loads(json.dumps(self.instrumentation.snapshot()))
+        self.assertEqual(snapshot["hosts"]["None"]["commands"]["0B"]["commands"], 1)
+        self.assertIsNone(self.events[-1].code)
+
+    def test_detached(self):
+        self.pump.setInstrumentation(None)
+        self.connection.set_response('OK 00 1.0E-09 MBAR\r\r>')
+        self.pump.getPressure(1)
+        self.assertEqual(self.events, [])
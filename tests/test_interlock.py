@@ -0,0 +1,144 @@
+'''Unit tests for the interlock engine
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.interlock import InterlockRule, InterlockEngine
+from gammaionctl.simulator import QPCSimulator, SimulatedController, SimulatedPump
+from test_pump import FakeConnection
+
+class TestInterlockRule(unittest.TestCase):
+    def test_hysteresis_and_debounce(self):
+        rule = InterlockRule("p1", "pressure", 1, limit=1e-6, clearLimit=5e-7, debounce=2)
+        self.assertIsNone(rule.evaluate(2e-6))
+        self.assertIsNone(rule.evaluate(1e-7))
+        self.assertIsNone(rule.evaluate(2e-6))
+        self.assertEqual(rule.evaluate(3e-6), "trip")
+        self.assertIsNone(rule.evaluate(8e-7))
+        self.assertIsNone(rule.evaluate(None))
+        self.assertIsNone(rule.evaluate(4e-7))
+        self.assertEqual(rule.evaluate(3e-7), "clear")
+
+    def test_trip_on_error(self):
+        rule = InterlockRule("c1", "current", 1, limit=1e-3, tripOnError=True)
+        self.assertEqual(rule.evaluate(False), "trip")
+        self.assertFalse(InterlockRule("c1", "current", 1, limit=1e-3).evaluate(False))
+        # getCurrent and getVoltage report error replies as None
+        self.assertEqual(InterlockRule("v1", "voltage", 1, limit=7000, tripOnError=True).evaluate(None), "trip")
+        # A disabled pump reports no pressure, this is not an error
+        self.assertIsNone(InterlockRule("p1", "pressure", 1, limit=1e-6, tripOnError=True).evaluate(None))
+
+    def test_invalid_hysteresis(self):
+        with self.assertRaises(ValueError):
+            InterlockRule("p1", "pressure", 1, limit=1e-6, clearLimit=1e-5)
+
+class TestInterlockReplies(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.connection.set_response('>')
+        self.pump = GammaIonPump(host=None, connection=self.connection)
+
+    def test_error_reply_trips(self):
+        engine = InterlockEngine(self.pump, [ InterlockRule("current 1", "current", 1, limit=1e-3, tripOnError=True) ])
+        self.connection.set_response('ER 01\r\r>OK 00\r\r>')
+        events = engine.step()
+        self.assertEqual([ (e.action, e.pumpIndex, e.success) for e in events ], [ ("disable", 1, True) ])
+
+    def test_pressure_units(self):
+        engine = InterlockEngine(self.pump, [ InterlockRule("pressure 1", "pressure", 1, limit=1.2e-6) ])
+        self.connection.set_response('OK 00 1.0E-06 TORR\r\r>OK 00\r\r>')
+        events = engine.step()
+        self.assertEqual(len(events), 1)
+        self.assertAlmostEqual(events[0].value, 1.333e-6, places=9)
+
+        with self.assertRaises(ValueError):
+            InterlockEngine(self.pump, [], units="psi")
+
+class RecordingPump:
+    def __init__(self):
+        self.calls = []
+
+    def enable(self, pumpIndex):
+        self.calls.append(("enable", pumpIndex))
+        return True
+
+    def disable(self, pumpIndex):
+        self.calls.append(("disable", pumpIndex))
+        return True
+
+class FailingPump:
+    def __init__(self):
+        self.attempts = 0
+
+    def disable(self, pumpIndex):
+        self.attempts = self.attempts + 1
+        return self.attempts > 1
+
+class TestInterlockEngine(unittest.TestCase):
+    def setUp(self):
+        self.controller = SimulatedController(pumps=[
+            SimulatedPump(40, startPressure=1e-5, timeConstant=1e6),
+            SimulatedPump(40, startPressure=1e-5, timeConstant=1e6),
+            40, 0 ], seed=1)
+        self.simulator = QPCSimulator(self.controller)
+        self.pump = GammaIonPump("127.0.0.1", port=self.simulator.start())
+
+    def tearDown(self):
+        self.pump.close()
+        self.simulator.stop()
+
+    def test_disable_on_breach(self):
+        engine = InterlockEngine(self.pump, [
+            InterlockRule("pressure 1", "pressure", 1, limit=1e-6, pumps=(1, 2)),
+            InterlockRule("pressure 3", "pressure", 3, limit=1e-6)
+        ])
+        events = engine.step()
+        self.assertEqual(sorted(e.pumpIndex for e in events), [ 1, 2, 3 ])
+        self.assertTrue(all(e.success and e.latency >= 0 for e in events))
+        self.assertFalse(self.controller.pumps[0].enabled)
+        self.assertFalse(self.controller.pumps[1].enabled)
+        self.assertEqual(engine.step(), [])
+        self.assertEqual(len(engine.latencies()), 3)
+
+    def test_restore(self):
+        engine = InterlockEngine(self.pump, [ InterlockRule("current 1", "current", 1, limit=1e-6, clearLimit=1e-7, restore=True) ])
+        engine.feed([ ("current", 1, 1e-5) ])
+        self.assertFalse(self.controller.pumps[0].enabled)
+        events = engine.feed([ ("current", 1, 1e-8) ])
+        self.assertEqual(events[0].action, "enable")
+        self.assertTrue(self.controller.pumps[0].enabled)
+
+    def test_restore_respects_other_rules(self):
+        pump = RecordingPump()
+        engine = InterlockEngine(pump, [
+            InterlockRule("pressure 1", "pressure", 1, limit=1e-6),
+            InterlockRule("current 1", "current", 1, limit=1e-3, clearLimit=1e-4, restore=True)
+        ])
+        engine.feed([ ("pressure", 1, 1e-5), ("current", 1, 1e-2) ])
+        self.assertEqual(engine.feed([ ("pressure", 1, 1e-5), ("current", 1, 1e-5) ]), [])
+        self.assertEqual(pump.calls, [ ("disable", 1) ])
+        self.assertEqual(engine.pending, [])
+
+    def test_unknown_pressure_unit(self):
+        pump = RecordingPump()
+        engine = InterlockEngine(pump, [
+            InterlockRule("pressure 1", "pressure", 1, limit=1e-6, tripOnError=True),
+            InterlockRule("pressure 2", "pressure", 2, limit=1e-6),
+            InterlockRule("pressure 3", "pressure", 3, limit=1e-6)
+        ])
+        events = engine.feed([ ("pressure", 3, (1e-5, "MBAR")), ("pressure", 1, (1e-9, "FURLONGS")),
+                               ("pressure", 2, (1e-9, "FURLONGS")) ])
+        self.assertEqual([ (e.pumpIndex, e.value) for e in events ], [ (3, 1e-5), (1, False) ])
+        self.assertEqual(pump.calls, [ ("disable", 3), ("disable", 1) ])
+        self.assertFalse(engine.rules[1].tripped)
+
+    def test_failed_action_retried(self):
+        engine = InterlockEngine(FailingPump(), [ InterlockRule("p1", "pressure", 1, limit=1e-6) ])
+        event = engine.feed([ ("pressure", 1, 1e-5) ])[0]
+        self.assertFalse(event.success)
+        self.assertEqual(engine.pending, [ event ])
+        engine.actuate()
+        self.assertTrue(event.success)
+        self.assertEqual(event.attempts, 2)
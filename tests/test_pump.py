@@ -3,9 +3,11 @@
 Run by running `python -m unittest` from this dir.
 Need to have gammaionctl installed in your viratual environment
 '''
+import socket
 import unittest
 from collections import deque
 from gammaionctl import GammaIonPump
+from gammaionctl.snapshot import FIELD_CURRENT
 
 class FakeConnection:
     def __init__(self):
@@ -26,6 +28,13 @@ class FakeConnection:
     def close(self):
         pass
 
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
 class TestPump(unittest.TestCase):
     def setUp(self):
         self.fake_connection = FakeConnection()
@@ -86,3 +95,114 @@ class TestPump(unittest.TestCase):
         self.assertEqual(self.pump.getSupplyStatus(1), 'RUNNING', 'Fetch Supply Status Failed')
         self.fake_connection.set_response('OK 00 STAND\r\r>')
         self.assertEqual(self.pump.getSupplyStatus(1), 'STAND', 'Fetch Supply Status Failed')
+
+class QueueRejectingConnection(FakeConnection):
+    '''Answers only the first of several queued commands'''
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def recv(self, buf):
+        if not self.response:
+            raise socket.timeout()
+        return self.response.popleft()
+
+    def send(self, message):
+        self.sent.append(message)
+        if len(self.sent) == 2:
+            self.set_response('OK 00 6000\r\r>')
+
+class StallingConnection:
+    '''Replies with scripted chunks per send, None simulates a timeout'''
+    def __init__(self, script):
+        self.script = deque(script)
+        self.chunks = deque([ b'>' ])
+        self.sent = []
+
+    def recv(self, buf):
+        if not self.chunks:
+            raise socket.timeout()
+        chunk = self.chunks.popleft()
+        if chunk is None:
+            raise socket.timeout()
+        return chunk
+
+    def send(self, message):
+        self.sent.append(message)
+        self.chunks.extend(self.script.popleft())
+
+    def close(self):
+        pass
+
+class TestBatch(unittest.TestCase):
+    def test_pipelined_batch(self):
+        fake_connection = FakeConnection()
+        fake_connection.set_response('>')
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        fake_connection.set_response('OK 00 PUMPITY\r\r>OK 00 1.2E-10 Torr\r\r>ER\r\r>OK 00 9.0E-08 AMPS\r\r>')
+        res = pump.batch([ "identify", ("getPressure", 1, "Torr"), ("getVoltage", 1), ("getCurrent", 1) ])
+        self.assertEqual(res[0], 'PUMPITY')
+        self.assertEqual(res[1], 1.2e-10)
+        self.assertIsNone(res[2])
+        self.assertAlmostEqual(res[3], 9.0e-8)
+        self.assertTrue(pump.pipelining)
+
+    def test_fallback_to_request_response(self):
+        fake_connection = QueueRejectingConnection()
+        fake_connection.set_response('>')
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        fake_connection.set_response('OK 00 5000\r\r>')
+        res = pump.batch([ ("getVoltage", 1), ("getVoltage", 2) ])
+        self.assertEqual(res, [ 5000, 6000 ])
+        self.assertFalse(pump.pipelining)
+        self.assertEqual(fake_connection.sent[1], b'spc 0C 2\r\n')
+
+    def test_stall_does_not_repeat_writes(self):
+        fake_connection = StallingConnection([
+            # Stalls after the first reply, the remaining ones arrive late
+            [ b'OK 00 5000\r\r>', None, b'OK 00 1.0E-09 AMPS\r\r>OK 00\r\r>' ],
+            [ b'OK 00 2.0E-09 AMPS\r\r>' ],
+            [ b'OK 00 5100\r\r>' ]
+        ])
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        res = pump.batch([ ("getVoltage", 1), ("getCurrent", 1), ("enable", 1) ])
+        self.assertEqual(res, [ 5000, 2.0e-9, False ])
+        self.assertFalse(pump.pipelining)
+        self.assertEqual(fake_connection.sent[1:], [ b'spc 0A 1\r\n' ])
+        # The stream is in sync again
+        self.assertEqual(pump.getVoltage(2), 5100)
+
+    def test_send_commands(self):
+        fake_connection = StallingConnection([
+            [ b'OK 00\r\r>ER 03 INVALID PUMP\r\r>', None ]
+        ])
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        self.assertEqual(pump.sendCommands([ "37 1", "37 5", "37 2" ]), [ "OK 00", "ER 03 INVALID PUMP", False ])
+        self.assertEqual(len(fake_connection.sent), 1)
+
+    def test_snapshot(self):
+        fake_connection = FakeConnection()
+        fake_connection.set_response('>')
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        fake_connection.set_response(
+            'OK 00 1.2E-09 MBAR\r\r>OK 00 5600\r\r>OK 00 9.0E-08 AMPS\r\r>OK 00 YES\r\r>OK 00 RUNNING\r\r>' +
+            'OK 00 1.3E-11 MBAR\r\r>OK 00 0\r\r>ER\r\r>OK 00 NO\r\r>OK 00 STANDBY\r\r>'
+        )
+        snap = pump.snapshot(pumps=(1, 2))
+        self.assertTrue(snap.connected)
+        self.assertFalse(snap.ok)
+        first, second = snap.channels
+        self.assertEqual((first.pressure, first.units, first.voltage, first.highVoltage, first.supplyStatus),
+                         (1.2e-9, 'MBAR', 5600, True, 'RUNNING'))
+        self.assertTrue(first.ok)
+        self.assertIsNone(second.pressure)
+        self.assertIsNone(second.current)
+        self.assertEqual(second.errors, FIELD_CURRENT)
+        self.assertEqual(len(snap.toArray()), 1 + 2 * 4)
+
+    def test_short_current_reply(self):
+        fake_connection = FakeConnection()
+        fake_connection.set_response('>')
+        pump = GammaIonPump(host=None, connection=fake_connection)
+        fake_connection.set_response('OK 00\r\r>')
+        self.assertIsNone(pump.getCurrent(1))
@@ -0,0 +1,111 @@
+'''Unit tests for the binary record log
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import math
+import os
+import struct
+import tempfile
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.recordlog import RecordLogWriter, RecordLogReader, PumpRecorder, \
+    METRIC_PRESSURE, METRIC_CURRENT, METRIC_VOLTAGE, FLAG_MISSING, FLAG_ERROR, FLAG_HIGHVOLTAGE
+from gammaionctl.simulator import QPCSimulator
+from gammaionctl.snapshot import ChannelSnapshot, ControllerSnapshot, FIELD_VOLTAGE
+
+class FakeHostPump:
+    host = None
+
+class TestRecordLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "pressure.log")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_range_lookup(self):
+        with RecordLogWriter(self.filename) as writer:
+            for n in range(10000):
+                writer.append(1000.0 + n, "qpc1", 1 + n % 4, "pressure", n * 1e-9)
+            writer.append(20000.0, "qpc2", 1, "current", None)
+
+        with RecordLogReader(self.filename, stride=64) as reader:
+            self.assertEqual(len(reader), 10001)
+            self.assertEqual(reader.indexRange(1500.0, 1599.5), (500, 600))
+            self.assertEqual(reader.indexRange(0, 999), (0, 0))
+            timestamps, values = reader.values(1500.0, 1599.0, host="qpc1", channel=1, metric="pressure")
+            self.assertEqual(len(timestamps), 25)
+            self.assertEqual(timestamps[0], 1500.0)
+            last = list(reader.records(start=19999.0))
+            self.assertEqual(len(last), 1)
+            self.assertEqual(reader.hostTable.name(last[0].host), "qpc2")
+            self.assertTrue(last[0].flags & FLAG_MISSING)
+            self.assertTrue(math.isnan(last[0].value))
+
+    def test_refresh_and_reopen(self):
+        writer = RecordLogWriter(self.filename)
+        writer.append(1.0, "qpc1", 1, METRIC_PRESSURE, 1e-9)
+        writer.flush()
+        reader = RecordLogReader(self.filename, stride=2)
+        self.assertEqual(len(reader), 1)
+        for n in range(2, 10):
+            writer.append(float(n), "qpc1", 1, METRIC_PRESSURE, 1e-9)
+        writer.close()
+        reader.refresh()
+        self.assertEqual(len(reader), 9)
+        self.assertEqual(reader.indexRange(4.0, 6.0), (3, 6))
+        reader.close()
+
+        with RecordLogWriter(self.filename) as writer:
+            writer.append(10.0, "qpc1", 1, METRIC_PRESSURE, 1e-9)
+        with RecordLogReader(self.filename) as reader:
+            self.assertEqual(len(reader), 10)
+
+    def test_reopen_after_torn_write(self):
+        with RecordLogWriter(self.filename) as writer:
+            writer.append(1.0, "qpc1", 1, METRIC_PRESSURE, 1e-9)
+        with open(self.filename, "ab") as f:
+            f.write(b'\x00' * 10)
+        with RecordLogWriter(self.filename) as writer:
+            writer.append(2.0, "qpc1", 1, METRIC_PRESSURE, 2e-9)
+        with RecordLogReader(self.filename) as reader:
+            self.assertEqual([ (r.timestamp, r.value) for r in reader.records() ], [ (1.0, 1e-9), (2.0, 2e-9) ])
+
+    def test_refresh_with_live_view(self):
+        writer = RecordLogWriter(self.filename)
+        writer.append(1.0, "qpc1", 1, METRIC_PRESSURE, 1e-9)
+        writer.flush()
+        reader = RecordLogReader(self.filename)
+        view = reader.rawRange()
+        records = reader.records()
+        next(records)
+        writer.append(2.0, "qpc1", 1, METRIC_PRESSURE, 2e-9)
+        writer.close()
+        reader.refresh()
+        self.assertEqual(len(reader), 2)
+        self.assertEqual(len(reader.rawRange()), 2 * len(view))
+        reader.close()
+        self.assertEqual(view.tobytes()[:8], struct.pack('<d', 1.0))
+        view.release()
+
+    def test_recorder_error_flags(self):
+        snapshot = ControllerSnapshot("sim", 1.0, (ChannelSnapshot(1, pressure=None, units="MBAR", voltage=None,
+                                                                   current=0.0, errors=FIELD_VOLTAGE),), True)
+        with RecordLogWriter(self.filename) as writer:
+            PumpRecorder(FakeHostPump(), writer, hostName="sim").recordSnapshot(snapshot)
+        with RecordLogReader(self.filename) as reader:
+            flags = { r.metric : r.flags for r in reader.records() }
+        self.assertEqual(flags, { METRIC_PRESSURE : FLAG_MISSING, METRIC_CURRENT : 0, METRIC_VOLTAGE : FLAG_MISSING | FLAG_ERROR })
+
+    def test_recorder(self):
+        with QPCSimulator() as simulator:
+            with GammaIonPump("127.0.0.1", port=simulator.port) as pump, RecordLogWriter(self.filename) as writer:
+                recorder = PumpRecorder(pump, writer, hostName="sim", pumps=(1, 2))
+                recorder.run(0.01, count=3)
+        with RecordLogReader(self.filename) as reader:
+            self.assertEqual(len(reader), 3 * 2 * 3)
+            records = list(reader.records(host="sim", channel=2, metric="pressure"))
+            self.assertEqual(len(records), 3)
+            self.assertTrue(records[0].flags & FLAG_HIGHVOLTAGE)
@@ -0,0 +1,84 @@
+'''Unit tests for the adaptive polling scheduler
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from gammaionctl.scheduler import AdaptiveScheduler
+from test_pump import FakeClock
+
+class FakePump:
+    '''Returns the values of a function of (getter, pumpIndex, time)'''
+    def __init__(self, clock, values):
+        self.clock = clock
+        self.values = values
+        self.requests = []
+        self.switched = []
+        self.sock = True
+
+    def batch(self, requests):
+        self.requests.extend(requests)
+        return [ self.values(getter, pumpIndex, self.clock.now) for getter, pumpIndex in requests ]
+
+    def enable(self, pumpIndex):
+        self.switched.append(("enable", pumpIndex))
+        return True
+
+    def disable(self, pumpIndex):
+        self.switched.append(("disable", pumpIndex))
+        return True
+
+class TestAdaptiveScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def _simulate(self, scheduler, duration, step=0.1):
+        while self.clock.now < duration:
+            scheduler.poll()
+            self.clock.now = self.clock.now + step
+
+    def test_stable_slows_down_changing_speeds_up(self):
+        # Pump 1 is stable, pump 2 pumps down one decade per 10 seconds
+        def values(getter, pumpIndex, t):
+            return 1e-9 if pumpIndex == 1 else 1e-5 * 10 ** (-t / 10.0)
+        pump = FakePump(self.clock, values)
+        scheduler = AdaptiveScheduler(pump, channels=(1, 2), metrics=("pressure",), budget=100, clock=self.clock)
+        self._simulate(scheduler, 60)
+        self.assertEqual(scheduler.schedule("pressure", 1).interval, scheduler.maxInterval)
+        self.assertEqual(scheduler.schedule("pressure", 2).interval, scheduler.minInterval)
+        stable = sum(1 for _, pumpIndex in pump.requests if pumpIndex == 1)
+        changing = sum(1 for _, pumpIndex in pump.requests if pumpIndex == 2)
+        self.assertLess(stable * 5, changing)
+
+    def test_pressure_units(self):
+        pump = FakePump(self.clock, lambda getter, pumpIndex, t: ((1e-6, "TORR"), None, (1e-6, "PSI"))[pumpIndex - 1])
+        scheduler = AdaptiveScheduler(pump, channels=(1, 2, 3), metrics=("pressure",), budget=100,
+                                      thresholds={ "pressure" : 1.4e-6 }, nearFactor=1.1, clock=self.clock)
+        results = scheduler.poll()
+        self.assertEqual(pump.requests[0], ("getPressureWithUnits", 1))
+        self.assertAlmostEqual(results[0][2], 1.333e-6, places=9)
+        self.assertEqual([ value for _, _, value in results[1:] ], [ None, False ])
+        self._simulate(scheduler, 60)
+        self.assertEqual(scheduler.schedule("pressure", 1).interval, scheduler.minInterval)
+        with self.assertRaises(ValueError):
+            AdaptiveScheduler(pump, units="psi")
+
+    def test_threshold_and_boost(self):
+        pump = FakePump(self.clock, lambda getter, pumpIndex, t: 1e-6)
+        scheduler = AdaptiveScheduler(pump, channels=(1, 2), metrics=("pressure",), budget=100,
+                                      thresholds={ ("pressure", 1) : 1.5e-6 }, clock=self.clock)
+        self._simulate(scheduler, 60)
+        self.assertEqual(scheduler.schedule("pressure", 1).interval, scheduler.minInterval)
+        self.assertEqual(scheduler.schedule("pressure", 2).interval, scheduler.maxInterval)
+        scheduler.disable(2)
+        self.assertEqual(pump.switched, [ ("disable", 2) ])
+        scheduler.poll()
+        self.assertEqual(scheduler.schedule("pressure", 2).interval, scheduler.minInterval)
+
+    def test_budget(self):
+        pump = FakePump(self.clock, lambda getter, pumpIndex, t: 1e-6 * (1 + t))
+        scheduler = AdaptiveScheduler(pump, metrics=("pressure", "current"), minInterval=0.1,
+                                      budget=4, clock=self.clock)
+        self._simulate(scheduler, 10, step=0.05)
+        self.assertLessEqual(len(pump.requests), 4 * 10 + 4)
+        self.assertTrue(all(entry.polls > 0 for entry in scheduler.schedules))
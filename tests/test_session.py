@@ -0,0 +1,88 @@
+'''Unit tests for the reconnecting session
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from collections import deque
+from gammaionctl.session import ReconnectingGammaIonPump
+from gammaionctl.framing import FramedReader, PROMPT_DELIMITER
+
+class ScriptedConnection:
+    '''Replays the given reply chunks and reports EOF afterwards'''
+    def __init__(self, *chunks):
+        self.chunks = deque([ bytes(c, 'ascii') for c in chunks ])
+        self.sent = []
+
+    def recv(self, buf):
+        if not self.chunks:
+            return b''
+        return self.chunks.popleft()
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def close(self):
+        pass
+
+class ResettingConnection(ScriptedConnection):
+    '''Raises a connection reset once all chunks have been delivered'''
+    def recv(self, buf):
+        if not self.chunks:
+            raise ConnectionResetError("Connection reset by peer")
+        return self.chunks.popleft()
+
+class ScriptedPump(ReconnectingGammaIonPump):
+    def __init__(self, connections, **kwargs):
+        self.connections = deque(connections)
+        super().__init__("qpc", **kwargs)
+
+    def _connect(self, connection=None):
+        if not self.connections:
+            raise ConnectionRefusedError("Connection refused")
+        self.sock = self.connections.popleft()
+        self.reader = FramedReader(self.sock)
+        self.reader.readFrame(PROMPT_DELIMITER)
+
+class TestSession(unittest.TestCase):
+    def test_retry_idempotent_query(self):
+        first = ScriptedConnection('>', 'OK 00 5000\r\r>')
+        second = ScriptedConnection('>', 'OK 00 6000\r\r>')
+        pump = ScriptedPump([ first, second ])
+        self.assertEqual(pump.getVoltage(1), 5000)
+        # First connection drops, the query is repeated on the second one
+        self.assertEqual(pump.getVoltage(1), 6000)
+        self.assertEqual(pump.stats.reconnects, 1)
+        self.assertEqual(pump.stats.retries, 1)
+        self.assertEqual(pump.stats.disconnects, 1)
+
+    def test_no_retry_of_enable(self):
+        first = ScriptedConnection('>')
+        second = ScriptedConnection('>', 'OK 00\r\r>')
+        pump = ScriptedPump([ first, second ])
+        self.assertFalse(pump.enable(1))
+        self.assertEqual(second.sent, [])
+        self.assertTrue(pump.enable(1))
+        self.assertEqual(second.sent, [ b'spc 37 1\r\n' ])
+
+    def test_no_retry_of_unknown_command(self):
+        first = ScriptedConnection('>')
+        second = ScriptedConnection('>', 'OK 00\r\r>')
+        pump = ScriptedPump([ first, second ])
+        self.assertFalse(pump.sendCommand("99 1"))
+        self.assertEqual(second.sent, [])
+
+    def test_batch_keeps_received_replies(self):
+        first = ResettingConnection('>', 'OK 00 5000\r\r>')
+        second = ScriptedConnection('>', 'OK 00 5100\r\r>', 'OK 00 5200\r\r>')
+        pump = ScriptedPump([ first, second ], pipelining=False)
+        res = pump.batch([ ("getVoltage", 1), ("getVoltage", 2), ("enable", 1), ("getVoltage", 3) ])
+        self.assertEqual(res, [ 5000, 5100, False, 5200 ])
+        self.assertEqual(second.sent, [ b'spc 0C 2\r\n', b'spc 0C 3\r\n' ])
+
+    def test_backoff(self):
+        pump = ScriptedPump([], backoffInitial=60)
+        self.assertFalse(pump.connected)
+        self.assertIsNone(pump.getVoltage(1))
+        self.assertEqual(pump.stats.failedAttempts, 1)
+        self.assertGreater(pump.downtime, 0)
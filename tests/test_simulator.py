@@ -0,0 +1,77 @@
+'''Tests of the clients against the local QPC simulator
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import asyncio
+import unittest
+from gammaionctl import GammaIonPump, AsyncGammaIonPump
+from gammaionctl.fleet import GammaFleet
+from gammaionctl.session import ReconnectingGammaIonPump
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+
+class TestSimulator(unittest.TestCase):
+    def setUp(self):
+        self.simulator = QPCSimulator(SimulatedController(pumps=(40, 40, 0, 0), seed=1))
+        self.port = self.simulator.start()
+
+    def tearDown(self):
+        self.simulator.stop()
+
+    def test_pump(self):
+        with GammaIonPump("127.0.0.1", port=self.port) as pump:
+            self.assertEqual(pump.identify(), "DIGITEL QPC")
+            self.assertEqual(pump.getPumpSize(1), 40.0)
+            self.assertIsNotNone(pump.getPressure(1, require_units="MBAR"))
+            self.assertTrue(pump.disable(2))
+            self.assertFalse(pump.getHighVoltageStatus(2))
+            self.assertEqual(pump.getSupplyStatus(2), "STANDBY")
+            self.assertIsNone(pump.getPressure(2, require_units="MBAR"))
+
+            snap = pump.snapshot()
+            self.assertTrue(snap.ok)
+            self.assertEqual(snap.channel(3).supplyStatus, "NO PUMP")
+
+    def test_async_pump(self):
+        async def scenario():
+            pumps = [ AsyncGammaIonPump("127.0.0.1", port=self.port) for _ in range(20) ]
+            for pump in pumps:
+                await pump.connect()
+            volts = await asyncio.gather(*[ pump.getVoltage(1) for pump in pumps ])
+            for pump in pumps:
+                await pump.close()
+            return volts
+        loop = asyncio.new_event_loop()
+        try:
+            volts = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+        self.assertEqual(len(volts), 20)
+        self.assertTrue(all(v > 5000 for v in volts))
+
+    def test_fleet(self):
+        other = QPCSimulator(SimulatedController(pumps=(40, 0, 0, 0), identity="QPC 2", seed=2))
+        hosts = [ "127.0.0.1:{}".format(self.port), "127.0.0.1:{}".format(other.start()), "127.0.0.1:1" ]
+        try:
+            with GammaFleet(hosts + [ hosts[0] ], metrics=("pressure", "status"), pumps=(1, 2), timeout=1) as fleet:
+                self.assertEqual(fleet.hosts, hosts)
+                snap = fleet.poll()
+        finally:
+            other.stop()
+        self.assertEqual(len(snap), 3)
+        self.assertEqual(snap.failed, [ "127.0.0.1:1" ])
+        self.assertEqual(snap[hosts[0]].get("status", 2), "RUNNING")
+        self.assertEqual(snap[hosts[1]].get("status", 2), "NO PUMP")
+        for host in hosts[:2]:
+            self.assertIsInstance(snap[host].get("pressure", 1), float)
+        self.assertEqual(self.simulator.connections, 1)
+        self.assertEqual(other.connections, 1)
+
+    def test_reconnect_after_disconnect(self):
+        pump = ReconnectingGammaIonPump("127.0.0.1", port=self.port)
+        self.simulator.controller.disconnectRate = 1.0
+        self.assertIsNone(pump.getVoltage(1))
+        self.simulator.controller.disconnectRate = 0.0
+        self.assertGreater(pump.getVoltage(1), 5000)
+        self.assertGreaterEqual(pump.stats.reconnects, 1)
+        pump.close()
@@ -0,0 +1,100 @@
+'''Unit tests for bulk enabling and disabling
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.hosts import splitHost
+from gammaionctl.simulator import QPCSimulator, SimulatedController, SimulatedPump
+from gammaionctl.switching import (BulkSwitch, OUTCOME_CONFIRMED, OUTCOME_FAILED, OUTCOME_NO_PUMP,
+                                   OUTCOME_REJECTED, OUTCOME_TIMEOUT)
+
+class StuckPump:
+    '''Acknowledges enable on channel 1 but never switches, rejects channel 2,
+    does not answer for channel 3 although it switches it'''
+    sock = True
+
+    def sendCommands(self, commands):
+        return [ { "37 1" : "OK 00", "37 2" : "ER 03 INVALID PUMP" }.get(command, False) for command in commands ]
+
+    def batch(self, requests):
+        results = []
+        for getter, pumpIndex in requests:
+            if getter == "getHighVoltageStatus":
+                results.append(pumpIndex == 3)
+            else:
+                results.append("STANDBY")
+        return results
+
+    def close(self):
+        pass
+
+class TestBulkSwitch(unittest.TestCase):
+    def setUp(self):
+        self.simulators = []
+        self.hosts = []
+        for _ in range(2):
+            pumps = [ SimulatedPump(size=40, enabled=False, rampTime=0.1) for _ in range(3) ] + [ SimulatedPump(size=0) ]
+            simulator = QPCSimulator(SimulatedController(pumps=pumps, seed=1))
+            self.hosts.append("127.0.0.1:{}".format(simulator.start()))
+            self.simulators.append(simulator)
+
+    def tearDown(self):
+        for simulator in self.simulators:
+            simulator.stop()
+
+    def factory(self, host, timeout):
+        if host == "dead":
+            raise ConnectionError("Failed to Connect to ion pump")
+        if host == "stuck":
+            return StuckPump()
+        address, port = splitHost(host)
+        return GammaIonPump(address, timeout=timeout, port=port)
+
+    def test_enable_and_disable(self):
+        targets = { self.hosts[0] : (1, 2, 3, 4), self.hosts[1] : (2, 3), "dead" : (1,) }
+        with BulkSwitch(targets, pumpFactory=self.factory) as rack:
+            result = rack.enable(verifyTimeout=2.0)
+            self.assertEqual(len(result), 7)
+            self.assertFalse(result.ok)
+            self.assertEqual([ (o.host, o.pumpIndex, o.outcome) for o in result.failed ], [
+                (self.hosts[0], 4, OUTCOME_NO_PUMP), ("dead", 1, OUTCOME_FAILED) ])
+            for host, pumpIndex in ((self.hosts[0], 1), (self.hosts[0], 3), (self.hosts[1], 2)):
+                outcome = result[(host, pumpIndex)]
+                self.assertEqual(outcome.outcome, OUTCOME_CONFIRMED)
+                self.assertTrue(outcome.highVoltage)
+                self.assertEqual(outcome.supplyStatus, "RUNNING")
+                self.assertGreaterEqual(outcome.timeToConfirm, 0.1)
+                self.assertGreater(outcome.polls, 1)
+            # Controllers are switched concurrently
+            self.assertLess(result.slowest, 0.5)
+            self.assertLess(result.duration, 1.0)
+            self.assertTrue(self.simulators[1].controller.pumps[1].enabled)
+            self.assertFalse(self.simulators[1].controller.pumps[0].enabled)
+
+            result = rack.disable()
+            self.assertEqual([ o.host for o in result.failed ], [ "dead" ])
+            self.assertEqual(result[(self.hosts[0], 4)].outcome, OUTCOME_CONFIRMED)
+            self.assertEqual(result[(self.hosts[1], 3)].polls, 1)
+
+    def test_stagger(self):
+        with BulkSwitch({ self.hosts[0] : (1, 2), self.hosts[1] : (1,) }, pumpFactory=self.factory) as rack:
+            result = rack.enable(stagger=0.1)
+        self.assertTrue(result.ok)
+        sent = [ o.sent for o in result ]
+        for n, offset in enumerate(sent):
+            self.assertGreaterEqual(offset, n * 0.1)
+            self.assertLess(offset, n * 0.1 + 0.08)
+
+    def test_rejected_and_timeout(self):
+        with BulkSwitch({ "stuck" : (1, 2, 3) }, pumpFactory=self.factory) as rack:
+            result = rack.enable(verifyTimeout=0.2, initialDelay=0.01, maxDelay=0.05)
+        self.assertEqual(result[("stuck", 1)].outcome, OUTCOME_TIMEOUT)
+        self.assertGreaterEqual(result[("stuck", 1)].polls, 4)
+        self.assertEqual(result[("stuck", 2)].outcome, OUTCOME_REJECTED)
+        self.assertEqual(result[("stuck", 2)].error, "ER 03 INVALID PUMP")
+        self.assertEqual(result[("stuck", 2)].polls, 0)
+        self.assertEqual(result[("stuck", 3)].outcome, OUTCOME_CONFIRMED)
+        self.assertIsNone(result[("stuck", 3)].timeToAck)
+        self.assertEqual(result[("stuck", 3)].polls, 1)
@@ -0,0 +1,57 @@
+'''Unit tests for the thread safe pump
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import threading
+import unittest
+from gammaionctl.threadsafe import ThreadSafeGammaIonPump, ThreadSafeReconnectingGammaIonPump
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+
+class TestThreadSafePump(unittest.TestCase):
+    def setUp(self):
+        self.simulator = QPCSimulator(SimulatedController(latency=0.02, seed=1))
+        self.port = self.simulator.start()
+
+    def tearDown(self):
+        self.simulator.stop()
+
+    def _parallel(self, pump, function, count=8):
+        barrier = threading.Barrier(count)
+        results = [ None ] * count
+
+        def worker(n):
+            barrier.wait()
+            results[n] = function(pump, n)
+
+        threads = [ threading.Thread(target=worker, args=(n,)) for n in range(count) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesced_reads(self):
+        with ThreadSafeGammaIonPump("127.0.0.1", port=self.port) as pump:
+            commands = self.simulator.controller.commands
+            results = self._parallel(pump, lambda p, n: p.getPressure(2))
+            self.assertTrue(all(isinstance(r, float) for r in results))
+            self.assertEqual(len(set(results)), 1)
+            self.assertLess(self.simulator.controller.commands - commands, 8)
+            self.assertGreater(pump.coalescer.coalesced, 0)
+
+    def test_unknown_commands_not_coalesced(self):
+        with ThreadSafeGammaIonPump("127.0.0.1", port=self.port) as pump:
+            commands = self.simulator.controller.commands
+            results = self._parallel(pump, lambda p, n: p.sendCommand("99 1"))
+            self.assertEqual(results, [ False ] * 8)
+            self.assertEqual(self.simulator.controller.commands - commands, 8)
+            self.assertEqual(pump.coalescer.calls, 0)
+
+    def test_mixed_commands(self):
+        with ThreadSafeReconnectingGammaIonPump("127.0.0.1", port=self.port) as pump:
+            results = self._parallel(pump, lambda p, n: (p.getVoltage(n % 4 + 1), p.snapshot().ok, p.identify()))
+            for voltage, ok, identity in results:
+                self.assertIsInstance(voltage, int)
+                self.assertTrue(ok)
+                self.assertEqual(identity, "DIGITEL QPC")
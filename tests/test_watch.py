@@ -0,0 +1,48 @@
+'''Unit tests for the watch mode
+
+Run by running `python -m unittest` from this dir.
+Need to have gammaionctl installed in your viratual environment
+'''
+import io
+import os
+import json
+import tempfile
+import time
+import unittest
+from gammaionctl import GammaIonPump
+from gammaionctl.simulator import QPCSimulator, SimulatedController
+from gammaionctl.watch import Watcher, RotatingOutput
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.simulator = QPCSimulator(SimulatedController(latency=0.01, seed=1))
+        self.pump = GammaIonPump("127.0.0.1", port=self.simulator.start())
+
+    def tearDown(self):
+        self.pump.close()
+        self.simulator.stop()
+
+    def test_cadence(self):
+        out = io.StringIO()
+        watcher = Watcher(self.pump, [ ("pres", 1), ("volt", 2) ], interval=0.05, fmt="json")
+        start = time.monotonic()
+        self.assertEqual(watcher.run(out, count=6), 6)
+        elapsed = time.monotonic() - start
+        # 5 intervals between 6 samples, each sample taking ~10 ms must not add up
+        self.assertLess(elapsed, 5 * 0.05 + 0.04)
+        records = [ json.loads(line) for line in out.getvalue().splitlines() ]
+        self.assertEqual(len(records), 6)
+        self.assertEqual(set(records[0]), { "timestamp", "pres1", "volt2" })
+
+    def test_rotation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "samples.csv")
+            watcher = Watcher(self.pump, [ ("cur", 1) ], interval=0.001)
+            out = RotatingOutput(filename, maxBytes=200, backupCount=2, header=watcher.header())
+            watcher.run(out, count=40)
+            out.close()
+            self.assertTrue(os.path.exists(filename + ".2"))
+            self.assertFalse(os.path.exists(filename + ".3"))
+            with open(filename + ".1") as f:
+                self.assertEqual(f.readline(), "timestamp,cur1\n")
+                self.assertLessEqual(os.path.getsize(filename + ".1"), 200)